@@ -0,0 +1,56 @@
+"""
+Индекс уже проанализированных переписок рядом с результатами
+(<output>.index.json): {fileName: {messagesCount, fingerprint, size, mtime_ns}}.
+
+Решение «пропустить или анализировать» принимается по индексу, без загрузки
+результатов: совпал отпечаток (chat_model) — переписка не менялась; для файлов
+exported_messages совпали размер и mtime — файл можно даже не читать.
+Индекс сохраняется атомарно после каждого батча.
+"""
+
+import os
+import json
+
+
+class AnalysisIndex:
+    def __init__(self, path):
+        self.path = path
+        self.chats = {}
+        self.dirty = False
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.chats = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.chats = {}
+        return self
+
+    def get(self, file_name):
+        return self.chats.get(file_name)
+
+    def file_unchanged(self, entry):
+        """Файл (chat_files.ChatFileEntry) не менялся с момента анализа"""
+        indexed = self.chats.get(entry.file_name)
+        return (
+            indexed is not None
+            and indexed.get('size') == entry.size
+            and indexed.get('mtime_ns') == entry.mtime_ns
+        )
+
+    def update(self, file_name, messages_count, fingerprint, entry=None):
+        indexed = {'messagesCount': messages_count, 'fingerprint': fingerprint}
+        if entry is not None:
+            indexed['size'] = entry.size
+            indexed['mtime_ns'] = entry.mtime_ns
+        self.chats[file_name] = indexed
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.chats, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
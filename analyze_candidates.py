@@ -14,10 +14,26 @@
   --tiktok-export FILE Файл экспорта данных TikTok (user_data_tiktok.json)
   --output FILE        Выходной файл (по умолчанию: candidate_analysis.json)
   --fresh              Начать анализ с нуля, игнорируя существующие результаты
+  --triage             Сначала анализировать активные и свежие переписки
+  --time-limit MIN     Не запускать новые батчи после MIN минут (остаток — в следующий запуск)
+  --metrics FILE       Сохранить метрики запуска (JSON или .prom)
+  --budget-usd X       Остановить запуск, когда стоимость вызовов GPT превысит X долларов
+  --usage-report FILE  Сохранить отчёт о токенах и стоимости (JSON)
+  --pack-tokens N      Упаковывать короткие переписки по несколько в один запрос GPT,
+                       до N токенов переписок на запрос (по умолчанию: 0 = выкл.)
+  --pack-max-chats N   Максимум переписок в одном запросе (по умолчанию: 8)
+  --dead-letter FILE   Карантин переписок, которые не удалось проанализировать
+                       (по умолчанию: <output>.dead.jsonl); они пропускаются в следующих запусках
+  --retry-dead-letter  Повторить переписки из карантина
+  --cpu-workers N      Процессов для разбора и форматирования переписок
+                       (по умолчанию: ядра - 1; 0 = в основном процессе)
+  --index FILE         Индекс проанализированных переписок: отпечатки сообщений,
+                       для --messages-dir ещё размер и mtime файлов (по умолчанию: <output>.index.json)
 
 ПРИМЕР:
   python3 analyze_candidates.py --batch-size 100 --parallel 5
   python3 analyze_candidates.py --tiktok-export user_data_tiktok.json --fresh --batch-size 100
+  python3 analyze_candidates.py --tiktok-export user_data_tiktok.json --triage --time-limit 30
 """
 
 import json
@@ -25,6 +41,8 @@ import os
 import sys
 import argparse
 import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
 from openai import AsyncOpenAI
 from dotenv import load_dotenv
 
@@ -35,11 +53,37 @@ from field_definitions import (
     POLISH_LEVEL,
     VEHICLE_TYPES,
     ROUTE_TYPE,
+    CANDIDATE_PROFILE_FIELDS,
+)
+from analysis_index import AnalysisIndex
+from chat_files import ChatFileEntry, index_chat_files, load_chat_file
+from chat_prepare import (
+    chat_fingerprint,
+    convert_tiktok_messages,
+    message_count,
+    prepare_all,
+    prepare_chat,
+    prepare_stream,
+    tiktok_chat_name,
+)
+import metrics
+from llm_usage import UsageTracker, combine_usage, pack_by_tokens, prefix_fingerprint, split_usage, usage_from_response
+from llm_validation import (
+    PERMANENT,
+    SCHEMA,
+    DeadLetter,
+    LLMCallFailed,
+    LLMRunAborted,
+    call_with_retries_async,
+    check_enums,
+    validate_schema,
 )
 
 load_dotenv()
 
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+# Переопределяется для локального стенда (fake_openai_server.py)
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
 RECRUITER_ACCOUNT = 'rabotazarulem'
 
 # Номера которые НЕ являются номерами кандидатов (номер менеджера/бизнеса)
@@ -54,12 +98,19 @@ def clean_manager_phone(result):
             result['profile']['phone_number'] = None
     return result
 
+def apply_chat_signals(result, signals):
+    """Дополняет результат GPT номером телефона, найденным регуляркой."""
+    profile = result.get('profile', {})
+    if not profile.get('phone_number') and signals['phones']:
+        profile['phone_number'] = signals['phones'][0]
+    return result
+
 if not OPENAI_API_KEY:
     print("❌ Ошибка: переменная окружения OPENAI_API_KEY не установлена")
     sys.exit(1)
 
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
-
+# Повторы делает llm_validation (с классификацией ошибок), встроенные отключены
+client = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, max_retries=0)
 RESPONSE_SCHEMA = {
     "type": "object",
     "properties": {
@@ -431,28 +482,98 @@ SYSTEM_PROMPT = f"""Ты эксперт по анализу переписок 
     • null: если номер телефона кандидата не указан
 """
 
+# Статический префикс запроса: системный промпт и схема ответа одинаковы
+# байт в байт в каждом вызове и идут первыми — OpenAI кэширует такой префикс
+# (prompt caching), переписка — только в последнем сообщении
+SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "candidate_analysis",
+        "strict": True,
+        "schema": RESPONSE_SCHEMA
+    }
+}
+PREFIX_HASH = prefix_fingerprint(SYSTEM_PROMPT, RESPONSE_FORMAT)
+# Направляет запросы с одинаковым префиксом на один кэш
+PROMPT_CACHE_KEY = f"analyze_candidates-{PREFIX_HASH}"
+
+usage_tracker = UsageTracker('analyze_candidates', prefix_hash=PREFIX_HASH)
+# Путь задаётся в main (--dead-letter); без пути (pipeline_queue) карантин не ведётся
+dead_letter = DeadLetter()
+
+# Упаковка коротких переписок (--pack-tokens): несколько чатов в одном запросе.
+# Инструкция дописывается в конец системного промпта, чтобы общий префикс
+# с одиночными запросами оставался в кэше
+PACK_MAX_CHATS = 8
+PACK_HEADER = "=== Переписка с кандидатом {chat_name} ==="
+PACKING_PROMPT = """
+═══════════════════════════════════════════════════════════════════════════════
+НЕСКОЛЬКО ПЕРЕПИСОК В ОДНОМ ЗАПРОСЕ
+═══════════════════════════════════════════════════════════════════════════════
+
+Сообщение может содержать несколько переписок, каждая начинается со строки
+"=== Переписка с кандидатом <имя> ===".
+• Анализируй каждую переписку НЕЗАВИСИМО по правилам выше, не переноси факты между ними
+• Верни results — ровно один элемент на каждую переписку
+• chatName — имя кандидата точно как в заголовке переписки
+"""
+PACKED_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "results": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "chatName": {"type": "string", "description": "Имя кандидата из заголовка переписки"},
+                    **RESPONSE_SCHEMA["properties"]
+                },
+                "required": ["chatName"] + RESPONSE_SCHEMA["required"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["results"],
+    "additionalProperties": False
+}
+PACKED_SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT + PACKING_PROMPT}
+PACKED_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "candidate_analysis_batch",
+        "strict": True,
+        "schema": PACKED_RESPONSE_SCHEMA
+    }
+}
+PACKED_PROMPT_CACHE_KEY = f"analyze_candidates-packed-{prefix_fingerprint(PACKED_SYSTEM_MESSAGE['content'], PACKED_RESPONSE_FORMAT)}"
+
+
+def read_chat_file(entry):
+    """Читает одну переписку из индекса (chat_files); None — файл не читается"""
+    try:
+        return load_chat_file(entry)
+    except (ValueError, OSError) as e:
+        print(f"  ⚠️  Ошибка чтения {entry.file_name}: {e}")
+        return None
+
 
 def read_chat_files(messages_dir):
     """Читает все файлы переписок из директории"""
     files = []
-    for filename in sorted(os.listdir(messages_dir)):
-        if filename.endswith('.json') and filename != 'export_summary.json':
-            filepath = os.path.join(messages_dir, filename)
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    content = json.load(f)
-                    files.append({
-                        'fileName': filename,
-                        'chatName': content.get('chatName', filename.replace('.json', '')),
-                        'messages': content.get('messages', [])
-                    })
-            except (json.JSONDecodeError, IOError) as e:
-                print(f"  ⚠️  Ошибка чтения {filename}: {e}")
+    for entry in index_chat_files(messages_dir):
+        chat = read_chat_file(entry)
+        if chat is not None:
+            files.append(chat)
     return files
 
 
-def read_tiktok_export(filepath):
-    """Читает файл экспорта TikTok и преобразует в формат чатов"""
+def read_tiktok_export(filepath, raw=False):
+    """
+    Читает файл экспорта TikTok и преобразует в формат чатов.
+    raw=True — сообщения не разбираются здесь ('rawMessages' + 'messagesCount'),
+    их разберёт CPU-этап (chat_prepare) в пуле процессов.
+    """
     with open(filepath, 'r', encoding='utf-8') as f:
         data = json.load(f)
     
@@ -460,102 +581,227 @@ def read_tiktok_export(filepath):
     
     chats = []
     for chat_key, messages in chat_history.items():
-        chat_name = chat_key.replace('Chat History with ', '').rstrip(':')
-        
-        converted_messages = []
-        for msg in reversed(messages):
-            converted_messages.append({
-                'time': msg.get('Date', ''),
-                'author': msg.get('From', ''),
-                'text': msg.get('Content', '')
-            })
-        
-        chats.append({
-            'fileName': f"{chat_name}.json",
-            'chatName': chat_name,
-            'messages': converted_messages
-        })
+        chat_name = tiktok_chat_name(chat_key)
+        chat = {'fileName': f"{chat_name}.json", 'chatName': chat_name}
+        if raw:
+            chat['rawMessages'] = messages
+            chat['messagesCount'] = len(messages)
+        else:
+            chat['messages'] = convert_tiktok_messages(messages)
+        chats.append(chat)
     
     chats.sort(key=lambda x: x['chatName'].lower())
     return chats
 
 
-def format_messages(messages):
-    """Форматирует сообщения для анализа"""
-    formatted = []
-    for idx, msg in enumerate(messages, 1):
-        time_str = msg.get('time', 'no time')
-        author = msg.get('author', 'unknown')
-        text = msg.get('text', '')
-        formatted.append(f"#{idx} [{time_str}] {author}: {text}")
-    return '\n'.join(formatted)
+def build_rule_based_analysis(signals):
+    """Результат анализа без GPT для пустых переписок (только приветствия/спам)."""
+    checklist_schema = RESPONSE_SCHEMA['properties']['checklist']['properties']
+    profile_schema = RESPONSE_SCHEMA['properties']['profile']['properties']
+    checklist = {field: False for field in checklist_schema}
+    profile = {
+        field: [] if spec['type'] == 'array' else None
+        for field, spec in profile_schema.items()
+    }
+    return {'checklist': checklist, 'profile': profile}
+
+
+def validate_analysis(analysis):
+    """
+    Ошибки ответа GPT: схема ответа и допустимые значения профиля (field_definitions).
+    Синонимы в профиле нормализуются на месте.
+    """
+    errors = validate_schema(analysis, RESPONSE_SCHEMA)
+    if not errors:
+        analysis['profile'], enum_errors = check_enums(analysis['profile'], CANDIDATE_PROFILE_FIELDS)
+        errors.extend(enum_errors)
+    return errors
 
 
+@metrics.timed('openai_request_seconds', script='analyze_candidates')
 async def analyze_chat_async(chat_name, messages_text):
-    """Асинхронно вызывает GPT API для анализа переписки"""
+    """
+    Асинхронно вызывает GPT API для анализа переписки. Сетевые ошибки и 429
+    повторяются с задержкой, ответ с ошибками проверки — один раз с repair-промптом.
+    При неудаче возвращает {'error', 'error_class'}.
+    """
     user_message = f"Переписка с кандидатом {chat_name}:\n\n{messages_text}"
+    usages = []
+
+    async def request(repair):
+        started = time.perf_counter()
+        response = await client.beta.chat.completions.parse(
+            model="gpt-4o-mini",
+            messages=[
+                SYSTEM_MESSAGE,
+                {"role": "user", "content": user_message}
+            ] + (repair or []),
+            temperature=0.1,
+            response_format=RESPONSE_FORMAT,
+            extra_body={"prompt_cache_key": PROMPT_CACHE_KEY}
+        )
+
+        usage = usage_from_response(response, time.perf_counter() - started)
+        usage_tracker.add(usage)
+        usages.append(usage)
+
+        return json.loads(response.choices[0].message.content)
 
     try:
+        analysis = await call_with_retries_async(request, validate_analysis, 'analyze_candidates')
+    except LLMCallFailed as e:
+        metrics.inc('openai_errors_total', script='analyze_candidates', error=type(e.__cause__).__name__)
+        return {'error': str(e), 'error_class': e.error_class, 'attempts': e.attempts}
+
+    analysis['usage'] = combine_usage(usages)
+    return analysis
+
+
+def pack_chats(items, pack_tokens, max_chats=PACK_MAX_CHATS):
+    """
+    Группирует переписки для упаковки: в пачке не больше pack_tokens (оценка)
+    и max_chats чатов, имена в пачке не повторяются. Длинная переписка идёт одна.
+    items — список (номер чата, чат, сигналы, текст переписки).
+    """
+    return pack_by_tokens(
+        items,
+        [item[3] for item in items],
+        pack_tokens,
+        max_chats,
+        keys=[item[1]['chatName'].strip().lower() for item in items]
+    )
+
+
+async def analyze_packed_async(chats):
+    """
+    Анализирует несколько переписок одним запросом. chats — список (имя, текст).
+    Возвращает анализы в том же порядке; переписки, которых нет в ответе
+    (или если запрос упал), анализируются по одной.
+    """
+    if len(chats) == 1:
+        return [await analyze_chat_async(*chats[0])]
+
+    user_message = "\n\n".join(
+        f"{PACK_HEADER.format(chat_name=chat_name)}\n\n{messages_text}" for chat_name, messages_text in chats
+    )
+    by_name = {}
+    usage = None
+    try:
+        started = time.perf_counter()
         response = await client.beta.chat.completions.parse(
             model="gpt-4o-mini",
             messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
+                PACKED_SYSTEM_MESSAGE,
                 {"role": "user", "content": user_message}
             ],
             temperature=0.1,
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "candidate_analysis",
-                    "strict": True,
-                    "schema": RESPONSE_SCHEMA
-                }
-            }
+            response_format=PACKED_RESPONSE_FORMAT,
+            extra_body={"prompt_cache_key": PACKED_PROMPT_CACHE_KEY}
         )
 
-        content = response.choices[0].message.content
-        return json.loads(content)
+        usage = usage_from_response(response, time.perf_counter() - started)
+        usage_tracker.add(usage)
+        metrics.inc('openai_packed_requests_total', script='analyze_candidates')
 
+        for item in json.loads(response.choices[0].message.content).get('results', []):
+            analysis = {'checklist': item.get('checklist'), 'profile': item.get('profile')}
+            # Элемент с ошибками проверки — анализ этой переписки отдельным запросом
+            if isinstance(item.get('chatName'), str) and not validate_analysis(analysis):
+                by_name.setdefault(item['chatName'].strip().lower(), analysis)
     except Exception as e:
-        return {'error': str(e)}
-
-
-async def process_batch(chats_batch, total_chats, start_offset):
-    """Обрабатывает батч чатов параллельно"""
-    tasks = []
-    valid_chats = []
+        metrics.inc('openai_errors_total', script='analyze_candidates', error=type(e).__name__)
+
+    results = [by_name.get(chat_name.strip().lower()) for chat_name, _ in chats]
+    found = [idx for idx, result in enumerate(results) if result is not None]
+    if usage and found:
+        for idx, part in zip(found, split_usage(usage, [len(chats[idx][1]) for idx in found])):
+            results[idx] = {
+                'checklist': results[idx]['checklist'],
+                'profile': results[idx]['profile'],
+                'usage': part
+            }
 
-    for idx, chat in enumerate(chats_batch):
-        if len(chat['messages']) < 2:
-            print(f"  ⚠️  {start_offset + idx + 1}/{total_chats}: {chat['chatName']} — мало сообщений")
+    missing = [idx for idx, result in enumerate(results) if result is None]
+    if missing:
+        metrics.inc('packed_fallback_total', len(missing), script='analyze_candidates')
+        fallback = await asyncio.gather(*(analyze_chat_async(*chats[idx]) for idx in missing))
+        for idx, analysis in zip(missing, fallback):
+            results[idx] = analysis
+    return results
+
+
+async def process_batch(batch_items, total_chats, pack_tokens=0, pack_max_chats=PACK_MAX_CHATS):
+    """
+    Обрабатывает батч чатов параллельно. batch_items — список (номер чата, чат);
+    чат — исходный или уже подготовленный CPU-этапом (chat_prepare.prepare_chat).
+    pack_tokens > 0 — короткие переписки упаковываются по несколько в один запрос.
+    """
+    gpt_items = []
+    local_results = []
+
+    for idx, chat in batch_items:
+        chat = prepare_chat(chat, RECRUITER_ACCOUNT, EXCLUDED_PHONE_NUMBERS)
+        if chat['messagesCount'] < 2:
+            print(f"  ⚠️  {idx + 1}/{total_chats}: {chat['chatName']} — мало сообщений")
+            continue
+        
+        signals = chat['signals']
+        if signals['trivial']:
+            # Только приветствия/эмодзи/ссылки — классифицируем без GPT
+            metrics.inc('chats_total', path='rules')
+            local_results.append((idx, chat, signals, build_rule_based_analysis(signals)))
             continue
         
-        messages_text = format_messages(chat['messages'])
-        tasks.append(analyze_chat_async(chat['chatName'], messages_text))
-        valid_chats.append((idx, chat))
+        messages_text = chat['messagesText']
+        metrics.inc('chats_total', path='gpt')
+        gpt_items.append((idx, chat, signals, messages_text))
 
-    if not tasks:
-        return []
+    if pack_tokens:
+        groups = pack_chats(gpt_items, pack_tokens, pack_max_chats)
+    else:
+        groups = [[item] for item in gpt_items]
 
-    results = await asyncio.gather(*tasks)
+    group_results = await asyncio.gather(*(
+        analyze_packed_async([(chat['chatName'], messages_text) for _, chat, _, messages_text in group])
+        for group in groups
+    )) if groups else []
+    
+    analyses = [
+        (idx, chat, signals, analysis)
+        for group, results in zip(groups, group_results)
+        for (idx, chat, signals, _), analysis in zip(group, results)
+    ]
+    analyses.extend(local_results)
     
     processed = []
-    for (idx, chat), analysis in zip(valid_chats, results):
+    for idx, chat, signals, analysis in analyses:
         if 'error' in analysis:
-            print(f"  ❌ {start_offset + idx + 1}/{total_chats}: {chat['chatName']} — {analysis['error']}")
+            if analysis.get('error_class') in (SCHEMA, PERMANENT):
+                # Повтор без изменений не поможет — в карантин, а не в каждый следующий запуск
+                dead_letter.add(
+                    chat['fileName'], analysis['error_class'], analysis['error'], analysis.get('attempts'),
+                    chatName=chat['chatName'], messagesCount=chat['messagesCount']
+                )
+            print(f"  ❌ {idx + 1}/{total_chats}: {chat['chatName']} — {analysis['error']}")
             continue
-            
+        
+        analysis = apply_chat_signals(analysis, signals)
         result = {
             'chatName': chat['chatName'],
             'fileName': chat['fileName'],
-            'messagesCount': len(chat['messages']),
+            'messagesCount': chat['messagesCount'],
             'checklist': analysis.get('checklist', {}),
             'profile': analysis.get('profile', {})
         }
+        if analysis.get('usage'):
+            result['usage'] = analysis['usage']
         
-        checklist_true = sum(1 for v in result['checklist'].values() if v is True)
-        profile_filled = sum(1 for v in result['profile'].values() if v is not None and v != [])
-        print(f"  ✅ {start_offset + idx + 1}/{total_chats}: {chat['chatName']} — checklist: {checklist_true}/5, profile: {profile_filled}/13")
+        if signals['trivial']:
+            print(f"  ⚡ {idx + 1}/{total_chats}: {chat['chatName']} — без GPT (нет содержательных сообщений кандидата)")
+        else:
+            checklist_true = sum(1 for v in result['checklist'].values() if v is True)
+            profile_filled = sum(1 for v in result['profile'].values() if v is not None and v != [])
+            print(f"  ✅ {idx + 1}/{total_chats}: {chat['chatName']} — checklist: {checklist_true}/5, profile: {profile_filled}/13")
         
         processed.append(result)
     
@@ -563,34 +809,54 @@ async def process_batch(chats_batch, total_chats, start_offset):
 
 
 async def main_async(args):
+    cpu_workers = args.cpu_workers if args.cpu_workers is not None else (os.cpu_count() or 1) - 1
+
     if args.tiktok_export:
         if not os.path.exists(args.tiktok_export):
             print(f"❌ Файл {args.tiktok_export} не найден")
             sys.exit(1)
         print(f"📥 Загрузка переписок из TikTok экспорта {args.tiktok_export}...")
-        chats = read_tiktok_export(args.tiktok_export)
+        chats = read_tiktok_export(args.tiktok_export, raw=cpu_workers > 0)
     else:
         if not os.path.exists(args.messages_dir):
             print(f"❌ Папка {args.messages_dir} не найдена")
             sys.exit(1)
-        print(f"📥 Загрузка переписок из {args.messages_dir}...")
-        chats = read_chat_files(args.messages_dir)
+        # Только индекс файлов: переписки читаются по мере надобности
+        print(f"📇 Индекс переписок в {args.messages_dir}...")
+        chats = index_chat_files(args.messages_dir)
     
     total_chats = len(chats)
     print(f"✅ Найдено {total_chats} переписок")
 
-    existing_results = {}
-    if not args.fresh and os.path.exists(args.output):
-        try:
-            with open(args.output, 'r', encoding='utf-8') as f:
-                existing = json.load(f)
-                for item in existing:
-                    existing_results[item['fileName']] = item
-            print(f"📂 Загружено {len(existing_results)} существующих результатов")
-        except:
-            pass
-    elif args.fresh:
+    # Индекс решает, что пропустить; сами результаты загружаются, только если
+    # что-то придётся анализировать (или для записей старого формата без индекса)
+    index = AnalysisIndex(args.index or os.path.splitext(args.output)[0] + '.index.json')
+    existing_results = None
+    if args.fresh:
         print("🔄 Режим --fresh: начинаем анализ с нуля")
+        existing_results = {}
+    elif os.path.exists(args.output):
+        index.load()
+    else:
+        existing_results = {}
+
+    def load_existing_results():
+        nonlocal existing_results
+        if existing_results is None:
+            existing_results = {}
+            try:
+                with open(args.output, 'r', encoding='utf-8') as f:
+                    existing = json.load(f)
+                    for item in existing:
+                        existing_results[item['fileName']] = item
+                print(f"📂 Загружено {len(existing_results)} существующих результатов")
+            except:
+                pass
+        return existing_results
+
+    quarantined = {} if args.retry_dead_letter else dead_letter.load()
+    if quarantined:
+        print(f"🚫 В карантине {len(quarantined)} переписок ({dead_letter.path}), повторить: --retry-dead-letter")
 
     start_idx = args.start_from
     if args.batch_size is None:
@@ -602,66 +868,167 @@ async def main_async(args):
         print(f"❌ Индекс начала ({start_idx}) >= количества чатов ({total_chats})")
         sys.exit(1)
 
-    # Фильтруем уже обработанные (пропускаем если нет новых сообщений)
+    # Фильтруем уже обработанные: отпечаток не изменился — пропускаем
     chats_to_process = []
+    # fileName → (отпечаток, файл exported_messages) — для записи в индекс после анализа
+    pending_index = {}
+    unchanged_count = 0
     for idx in range(start_idx, end_idx):
         chat = chats[idx]
-        current_count = len(chat['messages'])
+        file_entry = None
+        if isinstance(chat, ChatFileEntry):
+            file_entry = chat
+            if index.file_unchanged(file_entry):
+                unchanged_count += 1
+                continue
+            chat = read_chat_file(file_entry)
+            if chat is None:
+                continue
+        current_count = message_count(chat)
+        if current_count < 2:
+            # Анализировать нечего — результата не будет ни в этот, ни в следующий раз
+            print(f"  ⚠️  {idx + 1}/{total_chats}: {chat['chatName']} — мало сообщений")
+            continue
+        fingerprint = chat_fingerprint(chat)
         
-        if chat['fileName'] in existing_results:
-            existing = existing_results[chat['fileName']]
-            existing_count = existing.get('messagesCount', 0)
+        if chat['fileName'] in quarantined and current_count <= quarantined[chat['fileName']].get('messagesCount', 0):
+            print(f"🚫 {idx + 1}/{total_chats}: {chat['chatName']} — в карантине ({quarantined[chat['fileName']]['error_class']})")
+            continue
+
+        indexed = index.get(chat['fileName'])
+        if indexed is not None:
+            if indexed['fingerprint'] == fingerprint:
+                unchanged_count += 1
+                if file_entry is not None:
+                    # Файл переписан без изменений (новый mtime) — запоминаем, чтобы не читать снова
+                    index.update(chat['fileName'], current_count, fingerprint, file_entry)
+                continue
+            print(f"🔄 {idx + 1}/{total_chats}: {chat['chatName']} — переписка изменилась ({indexed['messagesCount']} → {current_count})")
+        elif chat['fileName'] in load_existing_results():
+            # Результат старого формата (без отпечатка) — сравниваем число сообщений
+            existing_count = existing_results[chat['fileName']].get('messagesCount', 0)
             
             if current_count <= existing_count:
                 print(f"⏭️  {idx + 1}/{total_chats}: {chat['chatName']} — нет новых сообщений ({current_count})")
+                index.update(chat['fileName'], current_count, fingerprint, file_entry)
                 continue
             else:
                 print(f"🔄 {idx + 1}/{total_chats}: {chat['chatName']} — новые сообщения ({existing_count} → {current_count})")
         
+        pending_index[chat['fileName']] = (fingerprint, file_entry)
         chats_to_process.append((idx, chat))
 
+    if unchanged_count:
+        print(f"⏭️  Без изменений: {unchanged_count} переписок")
+    index.save()
     if not chats_to_process:
         print("\n✅ Все чаты в диапазоне уже обработаны")
         return
+    load_existing_results()
+
+    # CPU-этап (разбор, признаки, текст для GPT) — в пуле процессов
+    executor = ProcessPoolExecutor(max_workers=cpu_workers) if cpu_workers > 0 else None
+    if executor:
+        print(f"⚙️  Подготовка переписок: {cpu_workers} процессов")
+
+    if args.triage:
+        # Приоритизация: активные и свежие переписки — первыми, пустые и старые — в конец
+        chats = [chat for _, chat in chats_to_process]
+        if executor:
+            prepared = await prepare_all(chats, executor, RECRUITER_ACCOUNT, EXCLUDED_PHONE_NUMBERS, with_triage=True)
+        else:
+            prepared = [prepare_chat(chat, RECRUITER_ACCOUNT, EXCLUDED_PHONE_NUMBERS, with_triage=True) for chat in chats]
+        chats_to_process = [(idx, chat) for (idx, _), chat in zip(chats_to_process, prepared)]
+        chats_to_process.sort(key=lambda item: item[1].get('triageScore', 0.0), reverse=True)
+        top = ', '.join(f"{chat['chatName']} ({chat.get('triageScore', 0.0)})" for _, chat in chats_to_process[:5])
+        print(f"🎯 Приоритизация: первые — {top}")
+
+    deadline = time.monotonic() + args.time_limit * 60 if args.time_limit else None
 
     print(f"\n🔄 Обработка {len(chats_to_process)} чатов (параллельно по {args.parallel})")
     print(f"📂 Результаты: {args.output}\n")
 
-    results = list(existing_results.values())
     success_count = 0
     error_count = 0
 
-    # Обрабатываем параллельными батчами
-    for i in range(0, len(chats_to_process), args.parallel):
-        batch_items = chats_to_process[i:i + args.parallel]
-        batch_chats = [chat for _, chat in batch_items]
-        batch_start = batch_items[0][0]
-        
-        batch_results = await process_batch(batch_chats, total_chats, batch_start)
-        
-        for result in batch_results:
-            # Очищаем номер менеджера, если AI ошибочно его записал
-            result = clean_manager_phone(result)
-            results.append(result)
-            existing_results[result['fileName']] = result
-            success_count += 1
-        
-        error_count += len(batch_chats) - len(batch_results)
-        
-        # Сохраняем после каждого батча
-        with open(args.output, 'w', encoding='utf-8') as f:
-            json.dump(results, f, ensure_ascii=False, indent=2)
-        
-        # Задержка между батчами для rate limit
-        if i + args.parallel < len(chats_to_process):
-            await asyncio.sleep(5)
+    deferred_count = 0
+
+    # При упаковке в батче parallel запросов по pack_max_chats чатов
+    batch_size = args.parallel * (args.pack_max_chats if args.pack_tokens else 1)
+    if args.pack_tokens:
+        print(f"📦 Упаковка коротких переписок: до {args.pack_max_chats} чатов / ~{args.pack_tokens} токенов в запросе\n")
+
+    # Продюсер готовит переписки в пуле, батчи берутся из очереди по мере готовности —
+    # первые запросы уходят, пока остальные переписки ещё разбираются
+    # (после --triage переписки уже подготовлены и идут в очередь как есть)
+    queue = asyncio.Queue(maxsize=batch_size * 2)
+    producer = asyncio.create_task(prepare_stream(
+        chats_to_process, queue, None if args.triage else executor,
+        RECRUITER_ACCOUNT, EXCLUDED_PHONE_NUMBERS, cpu_workers
+    ))
+
+    try:
+        # Обрабатываем параллельными батчами
+        i = 0
+        while i < len(chats_to_process):
+            if deadline and time.monotonic() >= deadline:
+                deferred_count = len(chats_to_process) - i
+                print(f"\n⏰ Лимит времени {args.time_limit} мин исчерпан, отложено {deferred_count} чатов")
+                break
+            if usage_tracker.budget_exceeded():
+                deferred_count = len(chats_to_process) - i
+                print(f"\n💸 Бюджет ${args.budget_usd:g} исчерпан, отложено {deferred_count} чатов")
+                break
+            
+            batch_items = []
+            while len(batch_items) < batch_size and i + len(batch_items) < len(chats_to_process):
+                item = await queue.get()
+                if isinstance(item, Exception):
+                    raise item
+                batch_items.append(item)
+            i += len(batch_items)
+            
+            batch_results = await process_batch(batch_items, total_chats, args.pack_tokens, args.pack_max_chats)
+            
+            for result in batch_results:
+                # Очищаем номер менеджера, если AI ошибочно его записал
+                result = clean_manager_phone(result)
+                # Повторный анализ изменившейся переписки заменяет старую запись, а не дублирует её
+                existing_results[result['fileName']] = result
+                success_count += 1
+                fingerprint, file_entry = pending_index[result['fileName']]
+                index.update(result['fileName'], result['messagesCount'], fingerprint, file_entry)
+            
+            error_count += len(batch_items) - len(batch_results)
+            
+            # Сохраняем после каждого батча
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(list(existing_results.values()), f, ensure_ascii=False, indent=2)
+            index.save()
+            
+            # Задержка между батчами для rate limit
+            if i < len(chats_to_process):
+                await asyncio.sleep(5)
+    finally:
+        producer.cancel()
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    usage_tracker.print_summary()
+    usage_tracker.write(args.usage_report)
 
     print(f"\n📊 Статистика:")
     print(f"  ✅ Успешно: {success_count}")
     print(f"  ❌ Ошибок: {error_count}")
-    print(f"  📦 Всего в файле: {len(results)}")
-
-    if end_idx < total_chats:
+    if deferred_count:
+        print(f"  ⏰ Отложено: {deferred_count}")
+    if dead_letter.count:
+        print(f"  🚫 В карантин: {dead_letter.count} ({dead_letter.path})")
+    print(f"  📦 Всего в файле: {len(existing_results)}")
+
+    if deferred_count:
+        print(f"\n💡 Запустите ещё раз — отложенные чаты будут обработаны (уже готовые пропускаются)")
+    elif end_idx < total_chats:
         print(f"\n💡 Следующий батч:")
         batch_size_arg = f" --batch-size {args.batch_size}" if args.batch_size is not None else ""
         print(f"   python3 analyze_candidates.py --start-from {end_idx}{batch_size_arg}")
@@ -678,9 +1045,30 @@ def main():
     parser.add_argument('--tiktok-export', help='Файл экспорта данных TikTok (user_data_tiktok.json)')
     parser.add_argument('--output', default='candidate_analysis.json', help='Выходной файл')
     parser.add_argument('--fresh', action='store_true', help='Начать анализ с нуля, игнорируя существующие результаты')
+    parser.add_argument('--triage', action='store_true', help='Сначала анализировать активные и свежие переписки')
+    parser.add_argument('--time-limit', type=float, default=None, help='Не запускать новые батчи после N минут')
+    parser.add_argument('--metrics', help='Сохранить метрики запуска (JSON или .prom)')
+    parser.add_argument('--budget-usd', type=float, default=None, help='Лимит стоимости вызовов GPT, USD')
+    parser.add_argument('--usage-report', help='Сохранить отчёт о токенах и стоимости (JSON)')
+    parser.add_argument('--pack-tokens', type=int, default=0, help='Упаковывать короткие переписки в один запрос до N токенов (0 = выкл.)')
+    parser.add_argument('--pack-max-chats', type=int, default=PACK_MAX_CHATS, help='Максимум переписок в одном запросе')
+    parser.add_argument('--dead-letter', help='Файл карантина (по умолчанию: <output>.dead.jsonl)')
+    parser.add_argument('--retry-dead-letter', action='store_true', help='Повторить переписки из карантина')
+    parser.add_argument('--cpu-workers', type=int, default=None, help='Процессов для подготовки переписок (0 = в основном процессе)')
+    parser.add_argument('--index', help='Индекс проанализированных переписок (по умолчанию: <output>.index.json)')
 
     args = parser.parse_args()
-    asyncio.run(main_async(args))
+    usage_tracker.budget_usd = args.budget_usd
+    dead_letter.path = args.dead_letter or os.path.splitext(args.output)[0] + '.dead.jsonl'
+    try:
+        with metrics.timer('run_seconds', script='analyze_candidates'):
+            asyncio.run(main_async(args))
+    except LLMRunAborted as e:
+        # Сохранены результаты завершённых батчей; карантин не тронут
+        print(f"\n🛑 Запуск остановлен: {e}")
+        sys.exit(1)
+    finally:
+        metrics.write_report(args.metrics)
 
 
 if __name__ == "__main__":
@@ -23,6 +23,8 @@ from dotenv import load_dotenv
 load_dotenv()
 
 NOTION_TOKEN = os.getenv('NOTION_TOKEN')
+# Переопределяется для локального стенда (fake_notion_server.py)
+NOTION_API_URL = os.getenv('NOTION_API_URL', 'https://api.notion.com/v1').rstrip('/')
 
 if not NOTION_TOKEN:
     print("❌ Ошибка: переменная окружения NOTION_TOKEN не установлена")
@@ -76,7 +78,7 @@ def update_vacancy(json_file_path, silent=False):
             else:
                 properties[key] = {"select": {"name": value}}
 
-    url = f"https://api.notion.com/v1/pages/{page_id}"
+    url = f"{NOTION_API_URL}/pages/{page_id}"
     headers = {
         "Authorization": f"Bearer {NOTION_TOKEN}",
         "Content-Type": "application/json",
@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк конвейера найма: экспорт TikTok → анализ GPT → импорт в Notion,
+вакансии Notion → правила → GPT.
+
+Данные синтетические (benchmarks/synthetic_data.py), внешние API заменены
+локальными стендами (fake_openai_server.py, fake_notion_server.py), поэтому
+бенчмарк не тратит токены и не трогает рабочие базы.
+
+Каждый масштаб запускается в отдельном процессе, чтобы пиковая память (RSS)
+относилась к нему. peak_rss_mb этапа — пик процесса к концу этапа.
+
+ЭТАПЫ (переписки):
+  export_parsing          read_tiktok_export() по всему экспорту
+  transcript_cache_load   load_chat_history_cache() импортёра
+  chat_signals            collect_chat_signals() на чат
+  format_messages         format_messages() на чат
+  build_page_properties   build_page_properties() на кандидата
+  transcript_chunking     get_chat_text() + build_chat_blocks() на чат
+  llm_analyse             analyze_candidates.py на выборке (стенд OpenAI)
+  notion_sync_create      import_drivers_to_notion.py на выборке, новые записи
+  notion_sync_update      то же, обновление (новые сообщения)
+
+ЭТАПЫ (вакансии):
+  vacancy_fetch           fetch_vacancies.py по дереву страниц (стенд Notion)
+  vacancy_prefill         prefill_vacancy() на вакансию
+  vacancy_llm             create_patches.py на выборке (стенд OpenAI)
+
+ИСПОЛЬЗОВАНИЕ:
+  python3 benchmarks/run_benchmarks.py [--scales 1000,10000,50000] [--vacancy-scales 100,1000]
+                                       [--output benchmark_report.json] [--llm-sample N] [--notion-sample N]
+
+ПАРАМЕТРЫ:
+  --scales LIST           Количество переписок (по умолчанию: 1000,10000,50000)
+  --vacancy-scales LIST   Количество вакансий (по умолчанию: 100,1000)
+  --output FILE           JSON-отчёт (по умолчанию: benchmark_report.json)
+  --repeat N              Повторов для этапов разбора экспорта (по умолчанию: 3)
+  --llm-sample N          Чатов для LLM-этапа (по умолчанию: 50)
+  --vacancy-llm-sample N  Вакансий для LLM-этапа (по умолчанию: 25)
+  --notion-sample N       Записей для синхронизации с Notion (по умолчанию: 200)
+  --parallel N            --parallel для analyze_candidates.py (по умолчанию: 5)
+  --llm-latency MS        Медиана задержки стенда OpenAI (по умолчанию: 300)
+  --llm-sigma S           Разброс задержки стенда OpenAI (по умолчанию: 0.6)
+  --notion-latency MS     Задержка стенда Notion (по умолчанию: 30)
+  --notion-rate N         Лимит стенда Notion, req/s (по умолчанию: 0 = без лимита)
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+import metrics  # noqa: E402
+import synthetic_data  # noqa: E402
+
+BENCH_DRIVERS_DB_ID = 'benchmark-drivers-db'
+
+
+# =============================================================================
+# Измерения
+# =============================================================================
+
+def peak_rss_mb():
+    """Пиковая память процесса (ru_maxrss: КБ в Linux, байты в macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak /= 1024
+    return round(peak / 1024, 1)
+
+
+def stage_result(items, seconds, latencies):
+    """Метрики этапа: пропускная способность, p50/p95 операции и пиковая память"""
+    ordered = sorted(latencies)
+    p50 = metrics.percentile(ordered, 50)
+    p95 = metrics.percentile(ordered, 95)
+    return {
+        'items': items,
+        'seconds': round(seconds, 4),
+        'throughput_per_s': round(items / seconds, 2) if seconds > 0 else None,
+        'operations': len(ordered),
+        'p50_ms': round(p50 * 1000, 3) if p50 is not None else None,
+        'p95_ms': round(p95 * 1000, 3) if p95 is not None else None,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def time_each(func, items):
+    """Вызывает func для каждого элемента, возвращает (время всего, задержки)"""
+    latencies = []
+    started = time.perf_counter()
+    for item in items:
+        t0 = time.perf_counter()
+        func(item)
+        latencies.append(time.perf_counter() - t0)
+    return time.perf_counter() - started, latencies
+
+
+def timed_wrapper(func, latencies):
+    """Обёртка, записывающая длительность каждого вызова (sync и async)"""
+    if asyncio.iscoroutinefunction(func):
+        async def async_wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                latencies.append(time.perf_counter() - t0)
+        return async_wrapper
+
+    def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - t0)
+    return wrapper
+
+
+@contextmanager
+def patched(module, name, value):
+    original = getattr(module, name)
+    setattr(module, name, value)
+    try:
+        yield
+    finally:
+        setattr(module, name, original)
+
+
+@contextmanager
+def quiet():
+    """Скрипты много печатают — в бенчмарке их вывод не нужен"""
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        yield
+
+
+def run_script_main(module, argv):
+    """Запускает main() скрипта с заданными аргументами командной строки"""
+    saved_argv = sys.argv
+    sys.argv = [f"{module.__name__}.py"] + [str(a) for a in argv]
+    try:
+        with quiet():
+            module.main()
+    finally:
+        sys.argv = saved_argv
+
+
+def write_json(path, data):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+# =============================================================================
+# Стенды
+# =============================================================================
+
+def start_stands(args):
+    """Поднимает стенды OpenAI и Notion и направляет на них скрипты (до их импорта)"""
+    import fake_notion_server
+    import fake_openai_server
+
+    _, notion_state, notion_url = fake_notion_server.start_in_thread(
+        port=0, latency=args.notion_latency, rate=args.notion_rate, burst=max(args.notion_rate, 1)
+    )
+    _, openai_state, openai_url = fake_openai_server.start_in_thread(
+        port=0, latency_median=args.llm_latency, latency_sigma=args.llm_sigma, seed=0
+    )
+
+    os.environ['NOTION_API_URL'] = notion_url
+    os.environ['OPENAI_BASE_URL'] = openai_url
+    os.environ['NOTION_TOKEN'] = 'benchmark'
+    os.environ['OPENAI_API_KEY'] = 'benchmark'
+    return notion_state, openai_state
+
+
+# =============================================================================
+# Масштабы
+# =============================================================================
+
+def run_chat_scale(chats_count, args, workdir):
+    notion_state, openai_state = start_stands(args)
+
+    import analyze_candidates
+    import import_drivers_to_notion as importer
+    from chat_prepare import format_messages
+    from chat_signals import collect_chat_signals
+
+    stages = {}
+    export_path = os.path.join(workdir, 'user_data_tiktok.json')
+    export = synthetic_data.generate_tiktok_export(chats_count)
+    write_json(export_path, export)
+    del export
+
+    # Разбор экспорта
+    seconds, latencies = time_each(lambda _: analyze_candidates.read_tiktok_export(export_path), range(args.repeat))
+    stages['export_parsing'] = stage_result(chats_count * args.repeat, seconds, latencies)
+    chats = analyze_candidates.read_tiktok_export(export_path)
+
+    def load_cache(_):
+        importer._chat_history_cache = None
+        importer.load_chat_history_cache()
+
+    with patched(importer, 'TIKTOK_DATA_FILE', export_path):
+        seconds, latencies = time_each(load_cache, range(args.repeat))
+        stages['transcript_cache_load'] = stage_result(chats_count * args.repeat, seconds, latencies)
+
+        seconds, latencies = time_each(
+            lambda chat: collect_chat_signals(
+                chat['messages'], analyze_candidates.RECRUITER_ACCOUNT, analyze_candidates.EXCLUDED_PHONE_NUMBERS
+            ),
+            chats
+        )
+        stages['chat_signals'] = stage_result(len(chats), seconds, latencies)
+
+        seconds, latencies = time_each(lambda chat: format_messages(chat['messages']), chats)
+        stages['format_messages'] = stage_result(len(chats), seconds, latencies)
+
+        records = synthetic_data.generate_candidate_records(chats)
+        seconds, latencies = time_each(importer.build_page_properties, records)
+        stages['build_page_properties'] = stage_result(len(records), seconds, latencies)
+
+        def chunk_transcript(chat):
+            text = importer.get_chat_text(chat['chatName'])
+            if text:
+                importer.build_chat_blocks(text, len(chat['messages']))
+
+        seconds, latencies = time_each(chunk_transcript, chats)
+        stages['transcript_chunking'] = stage_result(len(chats), seconds, latencies)
+
+        # LLM-этап: настоящий analyze_candidates.py на выборке против стенда OpenAI
+        sample = chats[:args.llm_sample]
+        sample_path = os.path.join(workdir, 'llm_sample_export.json')
+        history = export_history_subset(export_path, {chat['chatName'] for chat in sample})
+        write_json(sample_path, history)
+        llm_latencies = []
+        with patched(analyze_candidates, 'analyze_chat_async',
+                     timed_wrapper(analyze_candidates.analyze_chat_async, llm_latencies)):
+            started = time.perf_counter()
+            run_script_main(analyze_candidates, [
+                '--tiktok-export', sample_path,
+                '--output', os.path.join(workdir, 'llm_candidate_analysis.json'),
+                '--fresh', '--parallel', args.parallel,
+            ])
+            seconds = time.perf_counter() - started
+        stages['llm_analyse'] = stage_result(len(sample), seconds, llm_latencies)
+        with openai_state.lock:
+            stages['llm_analyse']['stand'] = dict(openai_state.stats)
+
+        # Синхронизация с Notion: создание, затем обновление тех же записей
+        sync_records = records[:args.notion_sample]
+        analysis_path = os.path.join(workdir, 'candidate_analysis.json')
+        for stage_name in ('notion_sync_create', 'notion_sync_update'):
+            if stage_name == 'notion_sync_update':
+                # Те же кандидаты с новыми сообщениями: обновление свойств и переписки
+                for record in sync_records:
+                    record['messagesCount'] += 1
+            write_json(analysis_path, sync_records)
+            with notion_state.lock:
+                requests_before = notion_state.stats['requests']
+                limited_before = notion_state.stats['rate_limited']
+            sync_latencies = []
+            with patched(importer, 'CANDIDATE_ANALYSIS_FILE', analysis_path), \
+                    patched(importer, 'DRIVERS_DB_ID', BENCH_DRIVERS_DB_ID), \
+                    patched(importer, 'upsert_driver_async', timed_wrapper(importer.upsert_driver_async, sync_latencies)):
+                started = time.perf_counter()
+                # Лимит импортёра — как у стенда (0 = без лимита)
+                run_script_main(importer, ['--rate', args.notion_rate])
+                seconds = time.perf_counter() - started
+            stages[stage_name] = stage_result(len(sync_records), seconds, sync_latencies)
+            with notion_state.lock:
+                stages[stage_name]['stand'] = {
+                    'requests': notion_state.stats['requests'] - requests_before,
+                    'rate_limited': notion_state.stats['rate_limited'] - limited_before,
+                }
+
+    return stages
+
+
+def export_history_subset(export_path, chat_names):
+    """Экспорт TikTok только с указанными переписками"""
+    with open(export_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    history = data['Direct Message']['Direct Messages']['ChatHistory']
+    subset = {
+        key: messages for key, messages in history.items()
+        if key[len('Chat History with '):-1] in chat_names
+    }
+    return {'Direct Message': {'Direct Messages': {'ChatHistory': subset}}}
+
+
+def run_vacancy_scale(vacancies_count, args, workdir):
+    notion_state, openai_state = start_stands(args)
+
+    import fetch_vacancies
+    import create_patches
+    from vacancy_prefill import prefill_vacancy
+
+    stages = {}
+    vacancies = synthetic_data.generate_vacancies(vacancies_count)
+
+    # Обход дерева страниц вакансий
+    synthetic_data.seed_vacancy_tree(notion_state, fetch_vacancies.DATABASE_ID, vacancies)
+    fetch_latencies = []
+    with patched(fetch_vacancies, 'get_page_content', timed_wrapper(fetch_vacancies.get_page_content, fetch_latencies)):
+        started = time.perf_counter()
+        run_script_main(fetch_vacancies, [os.path.join(workdir, 'vacancies.json')])
+        seconds = time.perf_counter() - started
+    stages['vacancy_fetch'] = stage_result(vacancies_count, seconds, fetch_latencies)
+    with notion_state.lock:
+        stages['vacancy_fetch']['stand'] = {'requests': notion_state.stats['requests']}
+
+    texts = [vacancy['child_pages'][0]['content'] for vacancy in vacancies]
+    seconds, latencies = time_each(prefill_vacancy, texts)
+    stages['vacancy_prefill'] = stage_result(len(texts), seconds, latencies)
+
+    # LLM-этап: настоящий create_patches.py на выборке против стенда OpenAI
+    sample = vacancies[:args.vacancy_llm_sample]
+    sample_path = os.path.join(workdir, 'llm_sample_vacancies.json')
+    write_json(sample_path, sample)
+    llm_latencies = []
+    with patched(create_patches, 'call_openai_api', timed_wrapper(create_patches.call_openai_api, llm_latencies)):
+        started = time.perf_counter()
+        run_script_main(create_patches, [
+            '--vacancies-file', sample_path,
+            '--output-dir', os.path.join(workdir, 'patches'),
+            '--batch-size', len(sample),
+        ])
+        seconds = time.perf_counter() - started
+    stages['vacancy_llm'] = stage_result(len(sample), seconds, llm_latencies)
+    with openai_state.lock:
+        stages['vacancy_llm']['stand'] = dict(openai_state.stats)
+
+    return stages
+
+
+# =============================================================================
+# Запуск
+# =============================================================================
+
+def worker(args):
+    """Один масштаб в текущем процессе, результат — в args.worker_output"""
+    with tempfile.TemporaryDirectory(prefix='hiring-bench-') as workdir:
+        if args.worker == 'chats':
+            stages = run_chat_scale(args.worker_scale, args, workdir)
+        else:
+            stages = run_vacancy_scale(args.worker_scale, args, workdir)
+    write_json(args.worker_output, {'kind': args.worker, 'scale': args.worker_scale, 'stages': stages})
+
+
+def passthrough_args(args):
+    return [
+        '--repeat', args.repeat,
+        '--llm-sample', args.llm_sample,
+        '--vacancy-llm-sample', args.vacancy_llm_sample,
+        '--notion-sample', args.notion_sample,
+        '--parallel', args.parallel,
+        '--llm-latency', args.llm_latency,
+        '--llm-sigma', args.llm_sigma,
+        '--notion-latency', args.notion_latency,
+        '--notion-rate', args.notion_rate,
+    ]
+
+
+def print_stages(run):
+    print(f"\n📊 {run['kind']} × {run['scale']}")
+    print(f"  {'этап':<24} {'шт/с':>12} {'p50, мс':>10} {'p95, мс':>10} {'RSS, МБ':>9}")
+    for name, stage in run['stages'].items():
+        throughput = stage['throughput_per_s']
+        print(
+            f"  {name:<24} {throughput if throughput is not None else '-':>12} "
+            f"{stage['p50_ms'] if stage['p50_ms'] is not None else '-':>10} "
+            f"{stage['p95_ms'] if stage['p95_ms'] is not None else '-':>10} "
+            f"{stage['peak_rss_mb']:>9}"
+        )
+
+
+def parse_scales(value):
+    return [int(x) for x in value.split(',') if x.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк конвейера найма')
+    parser.add_argument('--scales', type=parse_scales, default=[1000, 10000, 50000], help='Количество переписок')
+    parser.add_argument('--vacancy-scales', type=parse_scales, default=[100, 1000], help='Количество вакансий')
+    parser.add_argument('--output', default='benchmark_report.json', help='JSON-отчёт')
+    parser.add_argument('--repeat', type=int, default=3, help='Повторов для этапов разбора экспорта')
+    parser.add_argument('--llm-sample', type=int, default=50, help='Чатов для LLM-этапа')
+    parser.add_argument('--vacancy-llm-sample', type=int, default=25, help='Вакансий для LLM-этапа')
+    parser.add_argument('--notion-sample', type=int, default=200, help='Записей для синхронизации с Notion')
+    parser.add_argument('--parallel', type=int, default=5, help='--parallel для analyze_candidates.py')
+    parser.add_argument('--llm-latency', type=float, default=300, help='Медиана задержки стенда OpenAI, мс')
+    parser.add_argument('--llm-sigma', type=float, default=0.6, help='Разброс задержки стенда OpenAI')
+    parser.add_argument('--notion-latency', type=float, default=30, help='Задержка стенда Notion, мс')
+    parser.add_argument('--notion-rate', type=float, default=0, help='Лимит стенда Notion, req/s (0 = без лимита)')
+    parser.add_argument('--worker', choices=['chats', 'vacancies'], help=argparse.SUPPRESS)
+    parser.add_argument('--worker-scale', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--worker-output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args)
+        return
+
+    plan = [('chats', n) for n in args.scales] + [('vacancies', n) for n in args.vacancy_scales]
+    runs = []
+    started = time.perf_counter()
+
+    for kind, scale in plan:
+        print(f"⏱️  {kind} × {scale}...")
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as tmp:
+            worker_output = tmp.name
+        try:
+            command = [
+                sys.executable, os.path.abspath(__file__),
+                '--worker', kind, '--worker-scale', str(scale), '--worker-output', worker_output,
+            ] + [str(a) for a in passthrough_args(args)]
+            completed = subprocess.run(command, cwd=REPO_ROOT)
+            if completed.returncode != 0:
+                print(f"  ❌ Процесс завершился с кодом {completed.returncode}")
+                runs.append({'kind': kind, 'scale': scale, 'error': completed.returncode})
+                continue
+            with open(worker_output, 'r', encoding='utf-8') as f:
+                run = json.load(f)
+        finally:
+            os.unlink(worker_output)
+        runs.append(run)
+        print_stages(run)
+
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {key: value for key, value in vars(args).items() if not key.startswith('worker')},
+        'total_seconds': round(time.perf_counter() - started, 2),
+        'runs': runs,
+    }
+    write_json(args.output, report)
+    print(f"\n💾 Отчёт сохранён: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+Генераторы синтетических данных для бенчмарков.
+
+Формы данных повторяют настоящие:
+  - экспорт TikTok (user_data_tiktok.json): Direct Message → ChatHistory
+  - результаты анализа (candidate_analysis.json)
+  - вакансии: тексты по шаблону из filter-fields-basic.md и дерево страниц Notion
+    (база → страница вакансии → child_page → параграфы)
+"""
+
+import random
+from datetime import datetime, timedelta
+
+RECRUITER = 'rabotazarulem'
+
+CANDIDATE_PHRASES = [
+    'Привет', 'Здравствуйте', 'Добрый день', 'ок', '👍',
+    'Есть права категории CE и код 95',
+    'Опыт работы 3 года на тенте по Европе',
+    'Карта водителя есть, ADR нет',
+    'Виза польская, карта побыту в процессе',
+    'Интересует реф, международка',
+    'Какая зарплата? В евро или злотых?',
+    'Ищу работу в паре с женой, экипаж',
+    'Мой номер +48 512 345 678',
+    'Пишите в телеграм +380 67 123 45 67',
+    'Готов выйти с понедельника',
+    'По-польски не говорю, только русский',
+    'https://www.tiktok.com/@someone',
+]
+RECRUITER_PHRASES = [
+    'Здравствуйте! Какие у вас категории прав и опыт?',
+    'Есть ли код 95 и карта водителя?',
+    'Какой регион работы вам интересен?',
+    'Оставьте номер телефона, менеджер перезвонит',
+    (
+        'Вакансия: водитель CE, тент, база в городе Познань. График 6/2, '
+        'зарплата 450 зл в день нетто, umowa o pracę. Машины Volvo и DAF, '
+        'маршруты по Европе. Требуется опыт от 1 года и код 95.'
+    ),
+]
+
+VACANCY_TEMPLATE = """Водитель категории {license}
+
+Место работы (база): {city}
+Регионы работы: {regions}
+Прицеп: {vehicle}
+Водительские права: {license}
+Минимальный опыт работы: {experience}
+Свидетельство квалификации (код 95): {code95}
+ADR: {adr}
+Карта водителя: {card}
+Тип договора: {contract}
+Система оплаты: {payment}
+Средняя дневная зарплата (нетто): {salary_min}-{salary_max} zł
+Экипаж: {crew}
+
+Дополнительно: {extra}"""
+
+CITIES = ['Познань', 'Варшава', 'Вроцлав', 'Лодзь', 'Гданьск', 'Щецин']
+REGIONS = ['Польша', 'Германия', 'Франция', 'Бенилюкс', 'Скандинавия', 'По всей Европе']
+VEHICLES = ['Тент', 'Реф', 'Штора', 'Цистерна', 'BDF']
+LICENSES = ['C', 'CE', 'C+E']
+CONTRACTS = ['umowa o pracę', 'umowa zlecenie', 'B2B']
+REQUIREMENTS = ['обязательно', 'желательно', 'не требуется']
+CREWS = ['одиночный', 'двойной экипаж']
+EXTRA = [
+    'Новые машины, оплачиваемые стоянки.',
+    'Помощь с оформлением документов и жильём.',
+    'Возможность работы в паре, выезд с базы по графику.',
+]
+
+
+def _message_count(rng):
+    """Длина переписки: много коротких, длинный хвост"""
+    return max(1, min(int(rng.lognormvariate(2.3, 0.9)), 400))
+
+
+def generate_tiktok_export(chats_count, seed=0, now=None):
+    """Экспорт TikTok в формате user_data_tiktok.json на chats_count переписок"""
+    rng = random.Random(seed)
+    now = now or datetime(2026, 1, 1)
+    chat_history = {}
+
+    for chat_idx in range(chats_count):
+        chat_name = f"driver_{chat_idx:06d}"
+        start = now - timedelta(days=rng.uniform(0, 120))
+        messages = []
+        for msg_idx in range(_message_count(rng)):
+            is_recruiter = msg_idx % 2 == 1 or rng.random() < 0.2
+            author = RECRUITER if is_recruiter else chat_name
+            phrases = RECRUITER_PHRASES if is_recruiter else CANDIDATE_PHRASES
+            text = rng.choice(phrases)
+            if rng.random() < 0.02:
+                # Редкие очень длинные сообщения проверяют нарезку на блоки Notion
+                text = ' '.join([text] * rng.randint(60, 120))
+            sent = start + timedelta(minutes=msg_idx * rng.uniform(1, 90))
+            messages.append({
+                'Date': sent.strftime('%Y-%m-%d %H:%M:%S'),
+                'From': author,
+                'Content': text,
+            })
+        # В экспорте TikTok новые сообщения идут первыми
+        messages.reverse()
+        chat_history[f"Chat History with {chat_name}:"] = messages
+
+    return {'Direct Message': {'Direct Messages': {'ChatHistory': chat_history}}}
+
+
+def generate_candidate_records(chats, seed=0):
+    """Записи candidate_analysis.json для списка чатов (как из read_tiktok_export)"""
+    rng = random.Random(seed)
+    records = []
+    for chat in chats:
+        records.append({
+            'fileName': chat['fileName'],
+            'chatName': chat['chatName'],
+            'messagesCount': len(chat['messages']),
+            'checklist': {
+                'preferences_provided': rng.random() < 0.5,
+                'vacancy_offered': rng.random() < 0.3,
+                'vacancy_accepted': rng.random() < 0.1,
+                'external_contact_shared': rng.random() < 0.2,
+            },
+            'profile': {
+                'work_permit_status': rng.choice([None, 'есть', 'нет', 'в процессе']),
+                'code_95_status': rng.choice([None, 'есть', 'нет']),
+                'adr_status': rng.choice([None, 'есть', 'нет']),
+                'driver_card_status': rng.choice([None, 'есть', 'нет']),
+                'license_categories': rng.sample(['B', 'C', 'CE'], rng.randint(0, 2)),
+                'experience_months': rng.choice([None, 6, 12, 36, 120]),
+                'polish_language': rng.choice([None, 'нет', 'базовый']),
+                'crew_type': rng.choice([None, 'Одиночный', 'Двойной']),
+                'preferred_vehicle_types': rng.sample(VEHICLES, rng.randint(0, 2)),
+                'preferred_regions': rng.sample(REGIONS, rng.randint(0, 2)),
+                'route_type_preference': rng.choice([None, 'внутренние', 'международные']),
+                'avoided_regions': [],
+                'preferred_base_cities': rng.sample(CITIES, rng.randint(0, 1)),
+                'min_salary_expectation': rng.choice([None, 350, 450, 6000]),
+                'salary_currency': rng.choice([None, 'PLN', 'EUR']),
+                'citizenship': rng.sample(['Украина', 'Беларусь', 'Грузия'], rng.randint(0, 1)),
+                'phone_number': rng.choice([None, '+48 512 345 678', '+380671234567']),
+            },
+        })
+    return records
+
+
+FREE_FORM_TEMPLATE = (
+    "Ищем водителя {license} на {vehicle}, выезд с базы {city}. Работа {regions}. "
+    "Платим от {salary_min} зл, условия обсудим по телефону. {extra}"
+)
+# Доля вакансий без шаблона — их правила не разбирают, они идут в GPT
+FREE_FORM_SHARE = 0.3
+
+
+def generate_vacancy_text(rng):
+    salary_min = rng.randrange(300, 500, 10)
+    if rng.random() < FREE_FORM_SHARE:
+        return FREE_FORM_TEMPLATE.format(
+            license=rng.choice(LICENSES),
+            vehicle=rng.choice(VEHICLES).lower(),
+            city=rng.choice(CITIES),
+            regions=rng.choice(['по Европе', 'по Польше', 'в Германии']),
+            salary_min=salary_min,
+            extra=rng.choice(EXTRA),
+        )
+    return VACANCY_TEMPLATE.format(
+        license=rng.choice(LICENSES),
+        city=rng.choice(CITIES),
+        regions=', '.join(rng.sample(REGIONS, rng.randint(1, 3))),
+        vehicle=rng.choice(VEHICLES),
+        experience=rng.choice(['от 6 месяцев', 'от 1 года', '2 года', 'без опыта']),
+        code95=rng.choice(REQUIREMENTS),
+        adr=rng.choice(REQUIREMENTS),
+        card=rng.choice(REQUIREMENTS),
+        contract=rng.choice(CONTRACTS),
+        payment=rng.choice(['поденная', 'месячная']),
+        salary_min=salary_min,
+        salary_max=salary_min + rng.randrange(0, 150, 10),
+        crew=rng.choice(CREWS),
+        extra=rng.choice(EXTRA),
+    )
+
+
+def generate_vacancies(vacancies_count, seed=0):
+    """Вакансии в формате vacancies.json (вывод fetch_vacancies.py)"""
+    rng = random.Random(seed)
+    vacancies = []
+    for idx in range(vacancies_count):
+        page_id = f"00000000-0000-4000-8000-{idx:012d}"
+        vacancies.append({
+            'page_id': page_id,
+            'status': rng.choice(['Актуальна', 'Закрыта']),
+            'child_pages': [{'page_id': f"{page_id}-doc", 'content': generate_vacancy_text(rng)}],
+        })
+    return vacancies
+
+
+def seed_vacancy_tree(state, database_id, vacancies):
+    """
+    Заполняет стенд Notion (FakeNotionState) деревом вакансий:
+    страница в базе → блок child_page → параграфы по строкам текста.
+    """
+    for vacancy in vacancies:
+        page = state.add_page(database_id, {'Status': {'status': {'name': vacancy['status']}}})
+        for child in vacancy['child_pages']:
+            child_block = state.append_children(page['id'], [{'type': 'child_page', 'child_page': {'title': 'Вакансия'}}])[0]
+            paragraphs = [
+                {'type': 'paragraph', 'paragraph': {'rich_text': [{'text': {'content': line}}]}}
+                for line in child['content'].split('\n') if line
+            ]
+            state.append_children(child_block['id'], paragraphs)
@@ -0,0 +1,79 @@
+"""
+Ленивое чтение переписок из TickTokDMParser/exported_messages.
+
+index_chat_files() только перечисляет файлы (os.scandir: имя, размер, mtime),
+ничего не открывая; load_chat_file() читает одну переписку по требованию —
+через mmap и orjson, если он установлен (pip install orjson), иначе json.
+Размер и mtime из индекса позволяют пропускать неизменённые файлы без чтения
+(см. analysis_index.AnalysisIndex).
+"""
+
+import os
+import json
+import mmap
+
+from chat_model import ChatMessages
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+SUMMARY_FILE = 'export_summary.json'
+
+
+class ChatFileEntry:
+    """Файл переписки в индексе (без содержимого)"""
+
+    __slots__ = ('file_name', 'path', 'size', 'mtime_ns')
+
+    def __init__(self, file_name, path, size, mtime_ns):
+        self.file_name = file_name
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+    @property
+    def chat_name(self):
+        """Имя по файлу — настоящее chatName есть только внутри"""
+        return self.file_name[:-len('.json')]
+
+
+def index_chat_files(messages_dir):
+    """Файлы переписок папки, отсортированные по имени"""
+    entries = []
+    with os.scandir(messages_dir) as it:
+        for dir_entry in it:
+            name = dir_entry.name
+            if not name.endswith('.json') or name == SUMMARY_FILE or not dir_entry.is_file():
+                continue
+            stat = dir_entry.stat()
+            entries.append(ChatFileEntry(name, dir_entry.path, stat.st_size, stat.st_mtime_ns))
+    entries.sort(key=lambda entry: entry.file_name)
+    return entries
+
+
+def _load_json(path, size):
+    with open(path, 'rb') as f:
+        if orjson is None or size == 0:
+            return json.loads(f.read())
+        # orjson разбирает прямо из отображённой в память страницы, без копии
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                return orjson.loads(view)
+            finally:
+                view.release()
+
+
+def load_chat_file(entry):
+    """
+    Читает переписку: {'fileName', 'chatName', 'messages'}.
+    Ошибки чтения/разбора пробрасываются как ValueError или OSError.
+    """
+    content = _load_json(entry.path, entry.size)
+    return {
+        'fileName': entry.file_name,
+        'chatName': content.get('chatName', entry.chat_name),
+        'messages': ChatMessages.from_dicts(content.get('messages', []))
+    }
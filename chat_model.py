@@ -0,0 +1,146 @@
+"""
+Компактное представление переписки в памяти.
+
+Переписка хранится столбцами (ChatMessages: times / authors / texts) вместо
+списка словарей: на сообщение — три ссылки в списках вместо dict с ключами.
+Имена авторов интернируются (в переписке их два), поэтому хранятся один раз.
+Итерация и индексация отдают Message — запись со __slots__ и dict-подобным
+доступом (msg.get('text'), msg['author']), так что функции, написанные
+для словарей (chat_signals, format_messages), работают без изменений.
+
+    messages = ChatMessages.from_tiktok(raw_messages)
+    len(messages), messages[-1].time, messages.to_dicts()
+
+Отпечаток переписки (ChatMessages.fingerprint, tiktok_fingerprint) — число
+сообщений и хэш, накопленный по всем сообщениям в хронологическом порядке:
+меняется при любом новом, изменённом или удалённом сообщении и одинаков
+для экспорта TikTok и файлов exported_messages.
+"""
+
+import sys
+import hashlib
+
+_intern = sys.intern
+
+
+class Message:
+    """Одно сообщение: time, author, text"""
+
+    __slots__ = ('time', 'author', 'text')
+
+    def __init__(self, time, author, text):
+        self.time = time
+        self.author = author
+        self.text = text
+
+    def get(self, key, default=None):
+        if key in Message.__slots__:
+            return getattr(self, key)
+        return default
+
+    def __getitem__(self, key):
+        if key not in Message.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __eq__(self, other):
+        if isinstance(other, Message):
+            return (self.time, self.author, self.text) == (other.time, other.author, other.text)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"Message({self.time!r}, {self.author!r}, {self.text!r})"
+
+    def to_dict(self):
+        return {'time': self.time, 'author': self.author, 'text': self.text}
+
+
+def _intern_author(author):
+    return _intern(author) if isinstance(author, str) else author
+
+
+def _fingerprint(count, rows):
+    digest = hashlib.blake2b(digest_size=12)
+    for time, author, text in rows:
+        digest.update(f"{time}\x1f{author}\x1f{text}\x1e".encode('utf-8', 'surrogatepass'))
+    return f"{count}:{digest.hexdigest()}"
+
+
+def tiktok_fingerprint(raw_messages):
+    """Отпечаток сообщений экспорта TikTok без их преобразования (новые первыми)"""
+    return _fingerprint(len(raw_messages), (
+        (msg.get('Date', ''), msg.get('From', ''), msg.get('Content', ''))
+        for msg in reversed(raw_messages)
+    ))
+
+
+class ChatMessages:
+    """Сообщения переписки столбцами, в хронологическом порядке"""
+
+    __slots__ = ('times', 'authors', 'texts')
+
+    def __init__(self, times=None, authors=None, texts=None):
+        self.times = times if times is not None else []
+        self.authors = authors if authors is not None else []
+        self.texts = texts if texts is not None else []
+
+    @classmethod
+    def from_dicts(cls, messages):
+        """Из списка {'time', 'author', 'text'} (формат exported_messages)"""
+        return cls(
+            [msg.get('time', '') for msg in messages],
+            [_intern_author(msg.get('author', '')) for msg in messages],
+            [msg.get('text', '') for msg in messages],
+        )
+
+    @classmethod
+    def from_tiktok(cls, raw_messages, newest_first=True):
+        """Из сообщений экспорта TikTok ({'Date', 'From', 'Content'}, новые первыми)"""
+        ordered = raw_messages[::-1] if newest_first else raw_messages
+        return cls(
+            [msg.get('Date', '') for msg in ordered],
+            [_intern_author(msg.get('From', '')) for msg in ordered],
+            [msg.get('Content', '') for msg in ordered],
+        )
+
+    def append(self, time, author, text):
+        self.times.append(time)
+        self.authors.append(_intern_author(author))
+        self.texts.append(text)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __iter__(self):
+        return map(Message, self.times, self.authors, self.texts)
+
+    def __reversed__(self):
+        return map(Message, reversed(self.times), reversed(self.authors), reversed(self.texts))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ChatMessages(self.times[index], self.authors[index], self.texts[index])
+        return Message(self.times[index], self.authors[index], self.texts[index])
+
+    def __eq__(self, other):
+        if isinstance(other, ChatMessages):
+            return (self.times, self.authors, self.texts) == (other.times, other.authors, other.texts)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"ChatMessages({len(self)} messages)"
+
+    def __reduce__(self):
+        # Одинаковые (интернированные) имена авторов pickle сохраняет один раз
+        return ChatMessages, (self.times, self.authors, self.texts)
+
+    def fingerprint(self):
+        """Отпечаток переписки: 'число сообщений:хэш'"""
+        return _fingerprint(len(self), zip(self.times, self.authors, self.texts))
+
+    def to_dicts(self):
+        """Обратно в список словарей (для JSON)"""
+        return [
+            {'time': time, 'author': author, 'text': text}
+            for time, author, text in zip(self.times, self.authors, self.texts)
+        ]
@@ -0,0 +1,143 @@
+"""
+CPU-этап анализа переписок: разбор, признаки и текст для GPT.
+
+Нормализация сообщений экспорта TikTok, collect_chat_signals и format_messages —
+чистый Python по каждому сообщению. prepare_stream выполняет их пачками
+в ProcessPoolExecutor и кладёт готовые к отправке переписки в asyncio.Queue:
+сетевой этап начинает работу с первой готовой пачкой, а CPU-работа
+распределяется по ядрам.
+
+Модуль без побочных эффектов при импорте — его функции выполняются
+в дочерних процессах.
+"""
+
+import asyncio
+from collections import deque
+
+from chat_model import ChatMessages, tiktok_fingerprint
+from chat_signals import collect_chat_signals, triage_score
+
+# Переписок в одной задаче пула: меньше — больше накладных расходов на pickle,
+# больше — дольше ждать первую пачку
+PREPARE_CHUNK_SIZE = 64
+# Сколько пачек держать в работе на один процесс (ограничивает память)
+PENDING_CHUNKS_PER_WORKER = 2
+
+
+def tiktok_chat_name(chat_key):
+    """'Chat History with name:' → 'name'"""
+    return chat_key.replace('Chat History with ', '').rstrip(':')
+
+
+def convert_tiktok_messages(raw_messages):
+    """Сообщения экспорта TikTok (новые первыми) → ChatMessages по времени"""
+    return ChatMessages.from_tiktok(raw_messages)
+
+
+def format_messages(messages):
+    """Форматирует сообщения для анализа"""
+    formatted = []
+    for idx, msg in enumerate(messages, 1):
+        time_str = msg.get('time', 'no time')
+        author = msg.get('author', 'unknown')
+        text = msg.get('text', '')
+        formatted.append(f"#{idx} [{time_str}] {author}: {text}")
+    return '\n'.join(formatted)
+
+
+def message_count(chat):
+    """Число сообщений переписки — и для разобранной, и для ещё не разобранной"""
+    if 'messagesCount' in chat:
+        return chat['messagesCount']
+    return len(chat['messages'])
+
+
+def chat_fingerprint(chat):
+    """Отпечаток переписки (chat_model) — без разбора сообщений экспорта"""
+    if 'rawMessages' in chat:
+        return tiktok_fingerprint(chat['rawMessages'])
+    return chat['messages'].fingerprint()
+
+
+def prepare_chat(chat, recruiter, excluded_phones=(), with_triage=False):
+    """
+    Готовит переписку к анализу. chat — {'fileName', 'chatName'} и 'messages'
+    (нормализованные) или 'rawMessages' (как в экспорте TikTok).
+    Возвращает {'fileName', 'chatName', 'messagesCount', 'signals', 'messagesText'};
+    messagesText = None, если GPT не нужен (мало сообщений или пустая переписка).
+    Сами сообщения не возвращаются — их не нужно гонять обратно между процессами.
+    """
+    if 'messagesText' in chat:
+        return chat
+    messages = chat['messages'] if 'messages' in chat else convert_tiktok_messages(chat['rawMessages'])
+    prepared = {
+        'fileName': chat['fileName'],
+        'chatName': chat['chatName'],
+        'messagesCount': len(messages),
+        'signals': None,
+        'messagesText': None,
+    }
+    if len(messages) < 2:
+        return prepared
+
+    signals = chat.get('signals') or collect_chat_signals(messages, recruiter, excluded_phones)
+    prepared['signals'] = signals
+    if with_triage:
+        prepared['triageScore'] = triage_score(messages, signals, recruiter)
+    if not signals['trivial']:
+        prepared['messagesText'] = format_messages(messages)
+    return prepared
+
+
+def prepare_chunk(chats, recruiter, excluded_phones=(), with_triage=False):
+    """Задача пула: prepare_chat для пачки переписок"""
+    return [prepare_chat(chat, recruiter, excluded_phones, with_triage) for chat in chats]
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+async def prepare_all(chats, executor, recruiter, excluded_phones=(), with_triage=False):
+    """Готовит все переписки сразу (нужно для --triage: сортировка по оценке до отправки)"""
+    loop = asyncio.get_running_loop()
+    chunks = await asyncio.gather(*(
+        loop.run_in_executor(executor, prepare_chunk, chunk, recruiter, excluded_phones, with_triage)
+        for chunk in _chunks(chats, PREPARE_CHUNK_SIZE)
+    ))
+    return [prepared for chunk in chunks for prepared in chunk]
+
+
+async def prepare_stream(items, queue, executor, recruiter, excluded_phones=(), workers=1):
+    """
+    Продюсер: items — список (номер чата, чат). Пачки готовятся в executor,
+    результаты в исходном порядке кладутся в queue как (номер, готовый чат).
+    Без executor переписки передаются как есть (готовит потребитель).
+    Ошибка пула кладётся в очередь исключением — потребитель её пробросит.
+    """
+    try:
+        if executor is None:
+            for item in items:
+                await queue.put(item)
+            return
+
+        loop = asyncio.get_running_loop()
+        pending = deque()
+        max_pending = max(1, workers) * PENDING_CHUNKS_PER_WORKER
+        for chunk in _chunks(items, PREPARE_CHUNK_SIZE):
+            chats = [chat for _, chat in chunk]
+            future = loop.run_in_executor(executor, prepare_chunk, chats, recruiter, excluded_phones)
+            pending.append(([idx for idx, _ in chunk], future))
+            if len(pending) >= max_pending:
+                await _emit(pending.popleft(), queue)
+        while pending:
+            await _emit(pending.popleft(), queue)
+    except Exception as e:
+        await queue.put(e)
+
+
+async def _emit(entry, queue):
+    indexes, future = entry
+    for idx, prepared in zip(indexes, await future):
+        await queue.put((idx, prepared))
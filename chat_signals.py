@@ -0,0 +1,194 @@
+"""
+Быстрый предварительный проход по переписке до вызова GPT.
+
+Находит номера телефонов (phonenumbers.PhoneNumberMatcher), признаки отправленной
+вакансии в сообщениях рекрутера и "пустые" переписки (только приветствия,
+эмодзи или ссылки), которые можно классифицировать без модели.
+"""
+
+import math
+import re
+from datetime import datetime
+
+import phonenumbers
+
+# Сообщения, которые не несут информации о кандидате
+GREETING_PATTERN = re.compile(
+    r'^(?:привет\w*|здравствуй\w*|здрасте|добр\w+\s+(?:день|утро|вечер|ночи)|доброго\s+\w+'
+    r'|hi|hello|hey|cześć|dzień\s+dobry|хай|салам\w*'
+    r'|спасибо|благодарю|дякую|пожалуйста|👍|🙏|👋|🤝)$',
+    re.IGNORECASE
+)
+# Короткие ответы: пустые, только пока рекрутер ни о чём не спросил
+# («Есть код 95?» — «да» — уже информация о кандидате)
+ANSWER_PATTERN = re.compile(r'^(?:ок|окей|ok|okay|да|нет|ага|угу|\+)$', re.IGNORECASE)
+LINK_PATTERN = re.compile(r'https?://\S+|www\.\S+', re.IGNORECASE)
+# Всё, что не буква/цифра (эмодзи, пунктуация) — убирается перед проверкой
+NON_WORD_PATTERN = re.compile(r'[^\w\s+]+', re.UNICODE)
+
+# Признаки детальной вакансии в сообщении рекрутера (нужно минимум 2)
+VACANCY_MARKERS = [
+    re.compile(r'\d+\s*(?:€|евро|eur|зл|zł|pln|злот)', re.IGNORECASE),
+    re.compile(r'\b\d+\s*/\s*\d+\b|график', re.IGNORECASE),
+    re.compile(r'тент|реф|bdf|прицеп|штора|renault|daf|volvo|scania|\bman\b|mercedes|iveco|sprinter', re.IGNORECASE),
+    re.compile(r'ваканси|база|в городе|umowa|договор', re.IGNORECASE),
+]
+VACANCY_MIN_LENGTH = 120
+VACANCY_MIN_MARKERS = 2
+
+# Слова, по которым видно, что кандидат обсуждает работу (для приоритизации)
+TRIAGE_KEYWORDS = re.compile(
+    r'прав[аоы]|категори|\bCE\b|\bСЕ\b|код\s*95|карт\w*\s+водител|чип|ADR|виз[аыу]|побыт|внж'
+    r'|опыт|зарплат|ставк|евро|злот|тент|реф|штор|экипаж|график|телефон|номер|готов',
+    re.IGNORECASE
+)
+# Форматы времени сообщений: экспорт TikTok и exported_messages
+MESSAGE_TIME_FORMATS = (
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d %H:%M',
+    '%d/%m/%Y %H:%M',
+    '%m/%d/%Y %H:%M',
+    '%d.%m.%Y %H:%M',
+)
+# Веса компонентов оценки (сумма = 100)
+TRIAGE_WEIGHT_RECENCY = 40
+TRIAGE_WEIGHT_ACTIVITY = 20
+TRIAGE_WEIGHT_BALANCE = 20
+TRIAGE_WEIGHT_KEYWORDS = 20
+TRIAGE_PHONE_BONUS = 10
+TRIAGE_RECENCY_HALF_LIFE_DAYS = 7
+
+
+def find_phone_numbers(text, excluded=(), region='PL'):
+    """Возвращает номера телефонов из текста (как написаны), кроме исключённых"""
+    found = []
+    for match in phonenumbers.PhoneNumberMatcher(text, region):
+        e164 = phonenumbers.format_number(match.number, phonenumbers.PhoneNumberFormat.E164)
+        if e164 in excluded:
+            continue
+        if match.raw_string not in found:
+            found.append(match.raw_string)
+    return found
+
+
+def is_vacancy_message(text):
+    """Похоже ли сообщение рекрутера на полную вакансию с деталями"""
+    if len(text) < VACANCY_MIN_LENGTH:
+        return False
+    hits = sum(1 for marker in VACANCY_MARKERS if marker.search(text))
+    return hits >= VACANCY_MIN_MARKERS
+
+
+def is_filler_message(text, after_question=False):
+    """
+    Приветствие, эмодзи, ссылка или пустое сообщение. Короткий ответ
+    («да», «ок») — тоже, если рекрутер до этого не задавал вопросов (after_question).
+    """
+    stripped = LINK_PATTERN.sub(' ', text)
+    stripped = ' '.join(NON_WORD_PATTERN.sub(' ', stripped).split())
+    if not stripped:
+        return True
+    if GREETING_PATTERN.match(stripped):
+        return True
+    return not after_question and bool(ANSWER_PATTERN.match(stripped))
+
+
+def collect_chat_signals(messages, recruiter, excluded_phones=()):
+    """
+    Собирает дешёвые признаки переписки.
+    messages — список {'time', 'author', 'text'}.
+    """
+    candidate_messages = 0
+    recruiter_messages = 0
+    phones = []
+    vacancy_sent = False
+    question_asked = False
+    only_filler = True
+
+    for msg in messages:
+        text = msg.get('text', '') or ''
+        if msg.get('author') == recruiter:
+            recruiter_messages += 1
+            if not vacancy_sent and is_vacancy_message(text):
+                vacancy_sent = True
+            if '?' in text:
+                question_asked = True
+            continue
+
+        candidate_messages += 1
+        for phone in find_phone_numbers(text, excluded_phones):
+            if phone not in phones:
+                phones.append(phone)
+        if only_filler and not is_filler_message(text, question_asked):
+            only_filler = False
+
+    return {
+        'candidate_messages': candidate_messages,
+        'recruiter_messages': recruiter_messages,
+        'phones': phones,
+        'vacancy_sent': vacancy_sent,
+        # Кандидат ничего содержательного не написал и вакансию не отправляли
+        'trivial': only_filler and not phones and not vacancy_sent,
+    }
+
+
+def parse_message_time(msg):
+    """Время сообщения как datetime или None, если формат не распознан"""
+    time_str = (msg.get('time') or '').strip()
+    for fmt in MESSAGE_TIME_FORMATS:
+        try:
+            return datetime.strptime(time_str, fmt)
+        except ValueError:
+            continue
+    try:
+        return datetime.fromisoformat(time_str)
+    except ValueError:
+        return None
+
+
+def last_message_time(messages, lookback=5):
+    """Время последнего сообщения с распознаваемой датой (смотрим только хвост)"""
+    for msg in reversed(messages[-lookback:]):
+        parsed = parse_message_time(msg)
+        if parsed:
+            return parsed.replace(tzinfo=None)
+    return None
+
+
+def triage_score(messages, signals, recruiter, now=None):
+    """
+    Дешёвая оценка приоритета переписки (0..110): свежесть, активность,
+    баланс кандидат/рекрутер и ключевые слова. Пустые переписки → 0.
+    """
+    if signals['trivial']:
+        return 0.0
+    now = now or datetime.now()
+
+    last_time = last_message_time(messages)
+    if last_time is None:
+        recency = 0.5
+    else:
+        age_days = max((now - last_time).total_seconds() / 86400, 0)
+        recency = 0.5 ** (age_days / TRIAGE_RECENCY_HALF_LIFE_DAYS)
+
+    activity = min(math.log2(1 + len(messages)) / 6, 1.0)
+
+    candidate = signals['candidate_messages']
+    recruiter_count = signals['recruiter_messages']
+    balance = min(candidate, recruiter_count) / max(candidate, recruiter_count, 1)
+
+    keyword_hits = sum(
+        1 for msg in messages
+        if msg.get('author') != recruiter and TRIAGE_KEYWORDS.search(msg.get('text', '') or '')
+    )
+    keywords = min(keyword_hits / 5, 1.0)
+
+    score = (
+        TRIAGE_WEIGHT_RECENCY * recency
+        + TRIAGE_WEIGHT_ACTIVITY * activity
+        + TRIAGE_WEIGHT_BALANCE * balance
+        + TRIAGE_WEIGHT_KEYWORDS * keywords
+    )
+    if signals['phones']:
+        score += TRIAGE_PHONE_BONUS
+    return round(score, 2)
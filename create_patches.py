@@ -10,6 +10,15 @@
   --start-from N        Начать с вакансии номер N (по умолчанию: 0)
   --vacancies-file FILE Путь к файлу с вакансиями (по умолчанию: vacancies.json)
   --output-dir DIR      Папка для сохранения результатов (по умолчанию: patches/)
+  --metrics FILE        Сохранить метрики запуска (JSON или .prom)
+  --budget-usd X        Не отправлять новые вакансии в GPT после траты X долларов
+  --usage-report FILE   Сохранить отчёт о токенах и стоимости (JSON)
+  --pack-tokens N       Упаковывать короткие вакансии по несколько в один запрос GPT,
+                        до N токенов текста на запрос (по умолчанию: 0 = выкл.)
+  --pack-max-vacancies N Максимум вакансий в одном запросе (по умолчанию: 5)
+  --dead-letter FILE    Карантин вакансий, которые не удалось извлечь
+                        (по умолчанию: <output-dir>/dead_letter.jsonl); они пропускаются в следующих запусках
+  --retry-dead-letter   Повторить вакансии из карантина
 
 ПРИМЕР:
   python3 process_with_gpt.py --batch-size 10 --start-from 5
@@ -36,11 +45,27 @@ from field_definitions import (
     SALARY_CURRENCY,
     CONTRACT_TYPE,
     POLISH_REQUIREMENT,
+    VACANCY_FIELDS,
+)
+from vacancy_prefill import VACANCY_FIELD_ORDER, prefill_vacancy, missing_fields
+import metrics
+from llm_usage import UsageTracker, combine_usage, pack_by_tokens, prefix_fingerprint, split_usage, usage_from_response
+from llm_validation import (
+    PERMANENT,
+    SCHEMA,
+    DeadLetter,
+    LLMCallFailed,
+    LLMRunAborted,
+    call_with_retries,
+    check_enums,
+    validate_schema,
 )
 
 load_dotenv()
 
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+# Переопределяется для локального стенда (fake_openai_server.py)
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
 
 if not OPENAI_API_KEY:
     print("❌ Ошибка: переменная окружения OPENAI_API_KEY не установлена")
@@ -48,7 +73,8 @@ if not OPENAI_API_KEY:
     sys.exit(1)
 
 try:
-    client = OpenAI(api_key=OPENAI_API_KEY)
+    # Повторы делает llm_validation (с классификацией ошибок), встроенные отключены
+    client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, max_retries=0)
 except Exception as e:
     print(f"❌ Ошибка инициализации OpenAI клиента: {e}")
     print("Установите библиотеку: pip install openai")
@@ -413,14 +439,62 @@ SYSTEM_PROMPT = f"""Ты — эксперт по извлечению струк
 - ВАЖНО: Специфичные правила каждого поля имеют приоритет над общими правилами
 """
 
-def call_openai_api(vacancy_data, page_id):
-    """Вызывает OpenAI API для извлечения структурированных данных
-    
-    Возвращает tuple: (result, error_message)
-    - При успехе: (extracted_data, None)
-    - При ошибке: (None, "описание ошибки")
-    """
-    
+# Статический префикс запроса: системный промпт и полная схема ответа одинаковы
+# байт в байт в каждом вызове и идут первыми — OpenAI кэширует такой префикс
+# (prompt caching). Всё, что зависит от вакансии, — только в сообщении пользователя
+SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "vacancy_extraction",
+        "strict": True,
+        "schema": RESPONSE_SCHEMA
+    }
+}
+PREFIX_HASH = prefix_fingerprint(SYSTEM_PROMPT, RESPONSE_FORMAT)
+# Направляет запросы с одинаковым префиксом на один кэш
+PROMPT_CACHE_KEY = f"create_patches-{PREFIX_HASH}"
+
+usage_tracker = UsageTracker('create_patches', prefix_hash=PREFIX_HASH)
+# Путь задаётся в main (--dead-letter)
+dead_letter = DeadLetter()
+
+# Упаковка коротких вакансий (--pack-tokens): несколько вакансий в одном запросе.
+# Инструкция дописывается в конец системного промпта — общий префикс
+# с одиночными запросами остаётся в кэше
+PACK_MAX_VACANCIES = 5
+PACK_SEPARATOR = "\n\n══════════\n\n"
+PACKING_PROMPT = """
+
+НЕСКОЛЬКО ВАКАНСИЙ В ОДНОМ ЗАПРОСЕ:
+- Сообщение может содержать несколько вакансий, каждая начинается со строки "Вакансия ID: <id>"
+- Извлекай данные каждой вакансии НЕЗАВИСИМО, не переноси значения между ними
+- Верни vacancies — ровно один элемент на каждую вакансию, page_id точно как в строке "Вакансия ID"
+"""
+PACKED_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "vacancies": {
+            "type": "array",
+            "items": RESPONSE_SCHEMA
+        }
+    },
+    "required": ["vacancies"],
+    "additionalProperties": False
+}
+PACKED_SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT + PACKING_PROMPT}
+PACKED_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "vacancy_extraction_batch",
+        "strict": True,
+        "schema": PACKED_RESPONSE_SCHEMA
+    }
+}
+PACKED_PROMPT_CACHE_KEY = f"create_patches-packed-{prefix_fingerprint(PACKED_SYSTEM_MESSAGE['content'], PACKED_RESPONSE_FORMAT)}"
+
+def get_vacancy_text(vacancy_data):
+    """Возвращает tuple: (текст вакансии, error_message)"""
     # Берём только первый документ (оригинал вакансии), игнорируем "Пост"
     child_pages = vacancy_data.get('child_pages', [])
     if not child_pages:
@@ -431,42 +505,159 @@ def call_openai_api(vacancy_data, page_id):
     if not vacancy_text.strip():
         return None, "пустая вакансия"
     
+    return vacancy_text, None
+
+
+def build_user_message(vacancy_text, page_id, prefilled):
+    """Сообщение пользователя для одной вакансии"""
     user_message = f"Вакансия ID: {page_id}\n\n{vacancy_text}"
+    if prefilled:
+        # Схема ответа всегда полная (общий кэшируемый префикс), поэтому
+        # уже известные значения передаём подсказкой, а не урезанной схемой
+        user_message += (
+            "\n\nПоля, уже извлечённые автоматически (верни их без изменений, сосредоточься на остальных: "
+            + ", ".join(missing_fields(prefilled)) + "):\n"
+            + json.dumps(prefilled, ensure_ascii=False)
+        )
+    return user_message
+
+
+def finalize_extraction(extracted_data, page_id, prefilled, usage):
+    """Приводит ответ GPT к записи патча: page_id, приоритет prefilled, usage"""
+    # Убеждаемся, что page_id правильный
+    extracted_data['page_id'] = page_id
     
-    try:
+    if prefilled:
+        merged = {**extracted_data.get('properties', {}), **prefilled}
+        extracted_data['properties'] = {field: merged.get(field) for field in VACANCY_FIELD_ORDER}
+    
+    extracted_data['usage'] = usage
+    return extracted_data
+
+
+def validate_extraction(extracted_data):
+    """
+    Ошибки ответа GPT: схема ответа и допустимые значения полей (field_definitions).
+    Синонимы нормализуются на месте.
+    """
+    errors = validate_schema(extracted_data, RESPONSE_SCHEMA)
+    if not errors:
+        extracted_data['properties'], enum_errors = check_enums(extracted_data['properties'], VACANCY_FIELDS)
+        errors.extend(enum_errors)
+    return errors
+
+
+@metrics.timed('openai_request_seconds', script='create_patches')
+def call_openai_api(vacancy_data, page_id, prefilled=None):
+    """Вызывает OpenAI API для извлечения структурированных данных
+    
+    prefilled — поля, уже извлечённые правилами (vacancy_prefill.py): передаются
+    GPT подсказкой и имеют приоритет над его ответом.
+    
+    Сетевые ошибки и 429 повторяются с задержкой, ответ с ошибками проверки —
+    один раз с repair-промптом; неисправимые ошибки пишутся в карантин (dead_letter).
+    
+    Возвращает tuple: (result, error_message)
+    - При успехе: (extracted_data, None)
+    - При ошибке: (None, "описание ошибки")
+    """
+    
+    vacancy_text, error = get_vacancy_text(vacancy_data)
+    if error:
+        return None, error
+    
+    prefilled = prefilled or {}
+    user_message = build_user_message(vacancy_text, page_id, prefilled)
+    usages = []
+    
+    def request(repair):
+        started = time.perf_counter()
         response = client.beta.chat.completions.parse(
             model="gpt-4o-mini",
             messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
+                SYSTEM_MESSAGE,
                 {"role": "user", "content": user_message}
-            ],
+            ] + (repair or []),
             temperature=0.1,
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "vacancy_extraction",
-                    "strict": True,
-                    "schema": RESPONSE_SCHEMA
-                }
-            }
+            response_format=RESPONSE_FORMAT,
+            extra_body={"prompt_cache_key": PROMPT_CACHE_KEY}
         )
         
-        content = response.choices[0].message.content
-        extracted_data = json.loads(content)
-        
-        # Убеждаемся, что page_id правильный
-        extracted_data['page_id'] = page_id
+        usage = usage_from_response(response, time.perf_counter() - started)
+        usage_tracker.add(usage)
+        usages.append(usage)
         
-        return extracted_data, None
-        
-    except Exception as e:
+        return json.loads(response.choices[0].message.content)
+    
+    try:
+        extracted_data = call_with_retries(request, validate_extraction, 'create_patches')
+    except LLMCallFailed as e:
+        metrics.inc('openai_errors_total', script='create_patches', error=type(e.__cause__).__name__)
         error_msg = str(e)
-        if hasattr(e, 'response'):
+        if hasattr(e.__cause__, 'response'):
             try:
-                error_msg += f" | {e.response.text}"
+                error_msg += f" | {e.__cause__.response.text}"
             except:
                 pass
+        if e.error_class in (SCHEMA, PERMANENT):
+            dead_letter.add(page_id, e.error_class, error_msg, e.attempts)
         return None, f"API: {error_msg}"
+    
+    return finalize_extraction(extracted_data, page_id, prefilled, combine_usage(usages)), None
+
+@metrics.timed('openai_packed_request_seconds', script='create_patches')
+def call_openai_api_packed(items):
+    """Извлекает данные нескольких вакансий одним запросом
+    
+    items — список (vacancy_data, page_id, prefilled, user_message).
+    Возвращает список (result, error_message) в том же порядке. Вакансии,
+    которых нет в ответе или чей элемент не прошёл проверку (а при ошибке
+    запроса — все), извлекаются по одной через call_openai_api.
+    """
+    if len(items) == 1:
+        vacancy_data, page_id, prefilled, _ = items[0]
+        return [call_openai_api(vacancy_data, page_id, prefilled)]
+    
+    by_page_id = {}
+    usage = None
+    try:
+        started = time.perf_counter()
+        response = client.beta.chat.completions.parse(
+            model="gpt-4o-mini",
+            messages=[
+                PACKED_SYSTEM_MESSAGE,
+                {"role": "user", "content": PACK_SEPARATOR.join(item[3] for item in items)}
+            ],
+            temperature=0.1,
+            response_format=PACKED_RESPONSE_FORMAT,
+            extra_body={"prompt_cache_key": PACKED_PROMPT_CACHE_KEY}
+        )
+        
+        usage = usage_from_response(response, time.perf_counter() - started)
+        usage_tracker.add(usage)
+        
+        for item in json.loads(response.choices[0].message.content).get('vacancies', []):
+            # Элемент с ошибками проверки — вакансия пойдёт отдельным запросом
+            if isinstance(item, dict) and not validate_extraction(item):
+                by_page_id.setdefault(item['page_id'].strip(), item)
+    except Exception as e:
+        metrics.inc('openai_errors_total', script='create_patches', error=type(e).__name__)
+    
+    results = [None] * len(items)
+    found = [idx for idx, item in enumerate(items) if item[1] in by_page_id]
+    if usage and found:
+        parts = split_usage(usage, [len(items[idx][3]) for idx in found])
+        for idx, part in zip(found, parts):
+            _, page_id, prefilled, _ = items[idx]
+            results[idx] = (finalize_extraction(by_page_id[page_id], page_id, prefilled, part), None)
+    
+    missing = [idx for idx, result in enumerate(results) if result is None]
+    if missing:
+        metrics.inc('packed_fallback_total', len(missing), script='create_patches')
+        for idx in missing:
+            vacancy_data, page_id, prefilled, _ = items[idx]
+            results[idx] = call_openai_api(vacancy_data, page_id, prefilled)
+    return results
 
 def main():
     parser = argparse.ArgumentParser(description='Обработка вакансий через GPT-4o mini')
@@ -474,8 +665,17 @@ def main():
     parser.add_argument('--start-from', type=int, default=0, help='Начать с вакансии номер N')
     parser.add_argument('--vacancies-file', default='vacancies.json', help='Путь к файлу с вакансиями')
     parser.add_argument('--output-dir', default='patches/', help='Папка для сохранения результатов')
+    parser.add_argument('--metrics', help='Сохранить метрики запуска (JSON или .prom)')
+    parser.add_argument('--budget-usd', type=float, default=None, help='Лимит стоимости вызовов GPT, USD')
+    parser.add_argument('--usage-report', help='Сохранить отчёт о токенах и стоимости (JSON)')
+    parser.add_argument('--pack-tokens', type=int, default=0, help='Упаковывать короткие вакансии в один запрос до N токенов (0 = выкл.)')
+    parser.add_argument('--pack-max-vacancies', type=int, default=PACK_MAX_VACANCIES, help='Максимум вакансий в одном запросе')
+    parser.add_argument('--dead-letter', help='Файл карантина (по умолчанию: <output-dir>/dead_letter.jsonl)')
+    parser.add_argument('--retry-dead-letter', action='store_true', help='Повторить вакансии из карантина')
     
     args = parser.parse_args()
+    usage_tracker.budget_usd = args.budget_usd
+    dead_letter.path = args.dead_letter or os.path.join(args.output_dir, 'dead_letter.jsonl')
     
     # Создаем выходную директорию, если её нет
     os.makedirs(args.output_dir, exist_ok=True)
@@ -495,6 +695,10 @@ def main():
     total_vacancies = len(vacancies)
     print(f"✅ Загружено {total_vacancies} вакансий")
     
+    quarantined = {} if args.retry_dead_letter else dead_letter.load()
+    if quarantined:
+        print(f"🚫 В карантине {len(quarantined)} вакансий ({dead_letter.path}), повторить: --retry-dead-letter")
+    
     # Определяем диапазон обработки
     start_idx = args.start_from
     end_idx = min(start_idx + args.batch_size, total_vacancies)
@@ -508,33 +712,93 @@ def main():
     print(f"⚡ Параллельная обработка: 5 вакансий одновременно, задержка 5 сек между батчами\n")
     
     success_count = 0
+    rules_count = 0
     error_count = 0
     skipped_count = 0
+    budget_count = 0
+    quarantined_count = 0
     
-    def process_vacancy(idx, vacancy):
-        page_id = vacancy.get('page_id')
-        
-        if not page_id:
-            return idx, None, "нет page_id"
-        
-        output_file = os.path.join(args.output_dir, f"vacancy-{page_id}.json")
-        if os.path.exists(output_file):
-            return idx, page_id, "skipped"
-        
-        result, error = call_openai_api(vacancy, page_id)
-        
+    def save_result(idx, page_id, result, error, status):
         if result:
+            output_file = os.path.join(args.output_dir, f"vacancy-{page_id}.json")
             try:
                 with open(output_file, 'w', encoding='utf-8') as f:
                     json.dump(result, f, ensure_ascii=False, indent=2)
-                return idx, page_id, "success"
+                return idx, page_id, status
             except Exception as e:
                 return idx, page_id, f"ошибка сохранения: {e}"
         else:
             return idx, page_id, error or "неизвестная ошибка"
     
-    parallel_batch_size = 5
+    def prepare_vacancy(idx, vacancy):
+        """Всё, что не требует GPT. Возвращает (итог, None) или (None, prefilled) — нужен GPT"""
+        page_id = vacancy.get('page_id')
+        
+        if not page_id:
+            return (idx, None, "нет page_id"), None
+        
+        output_file = os.path.join(args.output_dir, f"vacancy-{page_id}.json")
+        if os.path.exists(output_file):
+            return (idx, page_id, "skipped"), None
+        if page_id in quarantined:
+            return (idx, page_id, "quarantined"), None
+        
+        # Сначала извлекаем всё, что можно, правилами — GPT только для остатка
+        vacancy_text, error = get_vacancy_text(vacancy)
+        prefilled = prefill_vacancy(vacancy_text) if vacancy_text else {}
+        
+        if vacancy_text and not missing_fields(prefilled):
+            properties = {field: prefilled[field] for field in VACANCY_FIELD_ORDER}
+            metrics.inc('vacancies_total', path='rules')
+            return save_result(idx, page_id, {'page_id': page_id, 'properties': properties}, None, "rules"), None
+        if error:
+            return (idx, page_id, error), None
+        if usage_tracker.budget_exceeded():
+            return (idx, page_id, "budget"), None
+        return None, prefilled
+    
+    def process_vacancy(idx, vacancy):
+        outcome, prefilled = prepare_vacancy(idx, vacancy)
+        if outcome:
+            return [outcome]
+        page_id = vacancy['page_id']
+        result, error = call_openai_api(vacancy, page_id, prefilled)
+        metrics.inc('vacancies_total', path='gpt')
+        return [save_result(idx, page_id, result, error, "success")]
+    
+    def process_pack(group):
+        """group — список (idx, vacancy, prefilled, user_message)"""
+        results = call_openai_api_packed([
+            (vacancy, vacancy['page_id'], prefilled, user_message)
+            for _, vacancy, prefilled, user_message in group
+        ])
+        metrics.inc('vacancies_total', len(group), path='gpt')
+        return [
+            save_result(idx, vacancy['page_id'], result, error, "success")
+            for (idx, vacancy, _, _), (result, error) in zip(group, results)
+        ]
+    
+    def prepare_packs(batch_indices):
+        """Разбирает батч правилами, остаток упаковывает в группы для GPT"""
+        outcomes = []
+        gpt_items = []
+        for idx in batch_indices:
+            outcome, prefilled = prepare_vacancy(idx, vacancies[idx])
+            if outcome:
+                outcomes.append(outcome)
+                continue
+            vacancy = vacancies[idx]
+            vacancy_text, _ = get_vacancy_text(vacancy)
+            user_message = build_user_message(vacancy_text, vacancy['page_id'], prefilled)
+            gpt_items.append((idx, vacancy, prefilled, user_message))
+        groups = pack_by_tokens(gpt_items, [item[3] for item in gpt_items], args.pack_tokens, args.pack_max_vacancies)
+        return outcomes, groups
+    
+    # При упаковке в батче 5 запросов по pack_max_vacancies вакансий
+    parallel_batch_size = 5 * (args.pack_max_vacancies if args.pack_tokens else 1)
     vacancies_to_process = list(range(start_idx, end_idx))
+    if args.pack_tokens:
+        print(f"📦 Упаковка коротких вакансий: до {args.pack_max_vacancies} вакансий / ~{args.pack_tokens} токенов в запросе\n")
     
     for batch_start in range(0, len(vacancies_to_process), parallel_batch_size):
         batch_end = min(batch_start + parallel_batch_size, len(vacancies_to_process))
@@ -545,21 +809,37 @@ def main():
         batch_had_api_calls = False
         
         with ThreadPoolExecutor(max_workers=5) as executor:
-            futures = {
-                executor.submit(process_vacancy, idx, vacancies[idx]): idx 
-                for idx in batch_indices
-            }
+            if args.pack_tokens:
+                outcomes, groups = prepare_packs(batch_indices)
+                futures = [executor.submit(process_pack, group) for group in groups]
+            else:
+                outcomes = []
+                futures = [executor.submit(process_vacancy, idx, vacancies[idx]) for idx in batch_indices]
+            
+            def completed():
+                yield from outcomes
+                for future in as_completed(futures):
+                    yield from future.result()
             
-            for future in as_completed(futures):
-                idx, page_id, status = future.result()
+            for idx, page_id, status in completed():
                 
                 if status == "success":
                     print(f"  ✅ {idx + 1}: {page_id[:8]}... сохранено")
                     success_count += 1
                     batch_had_api_calls = True
+                elif status == "rules":
+                    print(f"  ⚡ {idx + 1}: {page_id[:8]}... сохранено (без GPT)")
+                    success_count += 1
+                    rules_count += 1
                 elif status == "skipped":
                     print(f"  ⏭️  {idx + 1}: {page_id[:8]}... уже существует")
                     skipped_count += 1
+                elif status == "quarantined":
+                    print(f"  🚫 {idx + 1}: {page_id[:8]}... в карантине ({quarantined[page_id]['error_class']})")
+                    quarantined_count += 1
+                elif status == "budget":
+                    print(f"  💸 {idx + 1}: {page_id[:8]}... отложено (бюджет исчерпан)")
+                    budget_count += 1
                 elif status == "нет page_id":
                     print(f"  ⚠️  {idx + 1}: нет page_id, пропущено")
                     error_count += 1
@@ -574,16 +854,31 @@ def main():
     
     print(f"\n📊 Статистика:")
     print(f"  ✅ Успешно обработано: {success_count}")
+    print(f"  ⚡ Из них без GPT (по правилам): {rules_count}")
     print(f"  ⏭️  Пропущено (уже есть): {skipped_count}")
     print(f"  ❌ Ошибок: {error_count}")
+    if budget_count:
+        print(f"  💸 Отложено (бюджет ${args.budget_usd:g} исчерпан): {budget_count}")
+    if quarantined_count or dead_letter.count:
+        print(f"  🚫 В карантине: пропущено {quarantined_count}, добавлено {dead_letter.count} ({dead_letter.path})")
     print(f"  📦 Всего в диапазоне: {end_idx - start_idx}")
     
+    usage_tracker.print_summary()
+    usage_tracker.write(args.usage_report)
+    
     if end_idx < total_vacancies:
         print(f"\n💡 Для обработки следующего батча используйте:")
         print(f"   python3 process_with_gpt.py --start-from {end_idx} --batch-size {args.batch_size}")
     else:
         print(f"\n🎉 Все вакансии обработаны!")
+    
+    metrics.write_report(args.metrics)
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    except LLMRunAborted as e:
+        # Сохранённые вакансии остаются; карантин не тронут
+        print(f"\n🛑 Запуск остановлен: {e}")
+        sys.exit(1)
 
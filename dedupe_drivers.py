@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+"""
+Поиск и слияние дубликатов в базе водителей Notion
+
+Дубликаты появляются, когда водитель меняет ник в TikTok или две копии
+импорта создают страницу одновременно. Пары кандидатов ищутся по блокам
+(без сравнения всех со всеми):
+  - handle — одинаковый ник после нормализации (@, регистр, ссылка);
+  - phone  — одинаковый телефон в E.164 и ещё один признак: похожий ник
+             или тот же fileName (один номер бывает у разных людей —
+             например, номер менеджера; номера EXCLUDED_PHONE_NUMBERS
+             не учитываются);
+  - name   — одинаковый «скелет» ника (только буквы: ivan.petrov92 и
+             ivan_petrov → ivanpetrov) и похожие ники (SequenceMatcher).
+Блоки больше MAX_BLOCK_SIZE не сливаются, а выводятся для ручной проверки,
+как и пары «только телефон». Пары объединяются в группы (union-find). В
+группе остаётся последняя обновлённая страница (обычно ник, в котором идёт
+переписка), при равенстве — с наибольшим messagesCount; её пустые свойства
+заполняются из дубликатов, multi_select объединяются, а дубликаты
+архивируются. Каждое слияние записывается в журнал; импортёр читает его
+(журнал по умолчанию) и считает ники слитых страниц псевдонимами оставшейся:
+их переписки не создают страницы заново, а пропускаются с пометкой
+«слит с @ник» в отчёте (метрика driver_alias_hits_total).
+
+ИСПОЛЬЗОВАНИЕ:
+  python3 dedupe_drivers.py                    # только показать предложения
+  python3 dedupe_drivers.py --apply            # применить
+  python3 dedupe_drivers.py --apply --include-name
+
+ПАРАМЕТРЫ:
+  --apply          Применить слияния (по умолчанию — только показать)
+  --include-name   Сливать и группы, найденные только по похожести ника
+  --journal FILE   Журнал слияний (по умолчанию: dedupe_journal.jsonl — его читает импортёр)
+  --rate N         Лимит запросов к Notion в секунду (по умолчанию: 3)
+  --workers N      Параллельных слияний (по умолчанию: 4)
+  --metrics FILE   Сохранить метрики запуска (JSON или .prom)
+"""
+
+import json
+import os
+import re
+import sys
+import time
+import argparse
+import threading
+import urllib.request
+import urllib.error
+from datetime import datetime
+from difflib import SequenceMatcher
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+
+import metrics
+from rate_limit import RateLimiter, NOTION_RATE, retry_after_seconds
+from driver_index import (
+    DriverIndex, HANDLE, PHONE, MERGE_JOURNAL_FILE, EXCLUDED_PHONE_NUMBERS, normalize_handle, format_phone_number,
+)
+from notion_properties import MIRRORED_TYPES, mirror_properties, property_type, property_payload
+
+load_dotenv()
+
+NOTION_TOKEN = os.getenv('NOTION_TOKEN')
+# Переопределяется для локального стенда (fake_notion_server.py)
+NOTION_API_URL = os.getenv('NOTION_API_URL', 'https://api.notion.com/v1').rstrip('/')
+DRIVERS_DB_ID = '2ba95810-6f37-815e-86f2-ed07436ca6b0'
+JOURNAL_FILE = MERGE_JOURNAL_FILE
+
+NAME = 'name'
+MAX_WORKERS = 4
+MAX_ATTEMPTS = 5
+# Скелет ника короче — слишком общий для блока (например, «ivan»)
+MIN_SKELETON_LEN = 5
+# Блок больше — слишком общий, пары из него не предлагаются
+MAX_BLOCK_SIZE = 20
+# Порог похожести ников внутри блока name
+NAME_SIMILARITY = 0.8
+# Свойства, которые не переносятся из дубликатов
+KEEP_PROPERTIES = {'Name', 'TikTok Nickname', 'TikTok URL', 'fileName'}
+REPORT_LIMIT = 20
+
+notion_limiter = RateLimiter(NOTION_RATE)
+
+if not NOTION_TOKEN:
+    print("❌ Ошибка: переменная окружения NOTION_TOKEN не установлена")
+    sys.exit(1)
+
+
+def notion_request(method, endpoint, data=None):
+    """Запрос к Notion через общий лимит. Возвращает (ответ, None) или (None, ошибка)"""
+    url = f"{NOTION_API_URL}{endpoint}"
+    headers = {
+        "Authorization": f"Bearer {NOTION_TOKEN}",
+        "Content-Type": "application/json",
+        "Notion-Version": "2022-06-28"
+    }
+    json_data = json.dumps(data).encode('utf-8') if data is not None else None
+
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        notion_limiter.acquire()
+        req = urllib.request.Request(url, data=json_data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(req) as response:
+                return json.loads(response.read().decode('utf-8')), None
+        except urllib.error.HTTPError as e:
+            metrics.inc('notion_request_errors_total', method=method, status=e.code)
+            if e.code == 429 and attempt < MAX_ATTEMPTS:
+                notion_limiter.penalize(retry_after_seconds(e, attempt))
+                e.close()
+                continue
+            error_msg = ''
+            try:
+                error_msg = json.loads(e.read().decode('utf-8')).get('message', '')
+            except Exception:
+                pass
+            return None, f"HTTP {e.code}: {error_msg}"
+        except Exception as e:
+            return None, str(e)
+    return None, 'Max retries exceeded'
+
+
+def fetch_drivers(database_id):
+    """Все страницы базы как записи DriverIndex (+ types, created_time, last_edited_time)"""
+    drivers = []
+    start_cursor = None
+    while True:
+        data = {"page_size": 100}
+        if start_cursor:
+            data["start_cursor"] = start_cursor
+        result, error = notion_request("POST", f"/databases/{database_id}/query", data)
+        if error:
+            print(f"❌ Не удалось загрузить базу: {error}")
+            sys.exit(1)
+
+        for page in result.get("results", []):
+            raw = page.get("properties", {})
+            properties = mirror_properties(raw)
+            nickname = properties.get("TikTok Nickname") or properties.get("Name") or properties.get("TikTok URL")
+            drivers.append({
+                "page_id": page["id"],
+                "nickname": nickname or "",
+                "phone": properties.get("Номер телефона"),
+                "messagesCount": properties.get("messagesCount") or 0,
+                "created_time": page.get("created_time", ""),
+                "last_edited_time": page.get("last_edited_time", ""),
+                "properties": properties,
+                "types": {name: property_type(prop) for name, prop in raw.items()},
+            })
+
+        if not result.get("has_more"):
+            break
+        start_cursor = result.get("next_cursor")
+    return drivers
+
+
+def handle_skeleton(handle):
+    """Ник без цифр и разделителей: ivan.petrov92 → ivanpetrov"""
+    return re.sub(r'[\W\d_]+', '', handle or '')
+
+
+def similar_handles(handle_a, handle_b):
+    return bool(handle_a and handle_b) and (
+        handle_a == handle_b or SequenceMatcher(None, handle_a, handle_b).ratio() >= NAME_SIMILARITY
+    )
+
+
+def phone_pair_confirmed(entry_a, entry_b):
+    """Второй признак для пары с одним телефоном: похожий ник или тот же fileName"""
+    file_a = entry_a['properties'].get('fileName')
+    if file_a and file_a == entry_b['properties'].get('fileName'):
+        return True
+    return similar_handles(normalize_handle(entry_a['nickname']), normalize_handle(entry_b['nickname']))
+
+
+def candidate_pairs(drivers):
+    """
+    Пары (i, j, причина) по блокам: телефон и ник — из DriverIndex, похожесть
+    ника — по скелету с проверкой SequenceMatcher внутри блока.
+    Возвращает (pairs, review): review — [(причина, ключ, [записи])] для
+    ручной проверки: слишком большие блоки и телефоны без второго признака.
+    """
+    index = DriverIndex(drivers)
+    position = {id(entry): idx for idx, entry in enumerate(drivers)}
+    excluded_phones = {format_phone_number(phone) for phone in EXCLUDED_PHONE_NUMBERS}
+    pairs = []
+    review = []
+    for kind, key, entries in index.duplicates():
+        if kind == PHONE and key in excluded_phones:
+            continue
+        if len(entries) > MAX_BLOCK_SIZE:
+            review.append((kind, key, entries))
+            continue
+        if kind == HANDLE:
+            first = position[id(entries[0])]
+            pairs += [(first, position[id(other)], HANDLE) for other in entries[1:]]
+            continue
+        unconfirmed = []
+        for a_pos, entry_a in enumerate(entries):
+            for entry_b in entries[a_pos + 1:]:
+                if phone_pair_confirmed(entry_a, entry_b):
+                    pairs.append((position[id(entry_a)], position[id(entry_b)], PHONE))
+                else:
+                    unconfirmed += [entry for entry in (entry_a, entry_b) if not any(entry is other for other in unconfirmed)]
+        if unconfirmed:
+            review.append((PHONE, key, unconfirmed))
+
+    blocks = {}
+    for idx, entry in enumerate(drivers):
+        skeleton = handle_skeleton(normalize_handle(entry['nickname']))
+        if len(skeleton) >= MIN_SKELETON_LEN:
+            blocks.setdefault(skeleton, []).append(idx)
+    for skeleton, members in blocks.items():
+        if len(members) > MAX_BLOCK_SIZE:
+            review.append((NAME, skeleton, [drivers[idx] for idx in members]))
+            continue
+        for a_pos, a in enumerate(members):
+            handle_a = normalize_handle(drivers[a]['nickname'])
+            for b in members[a_pos + 1:]:
+                handle_b = normalize_handle(drivers[b]['nickname'])
+                if handle_a != handle_b and similar_handles(handle_a, handle_b):
+                    pairs.append((a, b, NAME))
+    return pairs, review
+
+
+class UnionFind:
+    def __init__(self, size):
+        self.parent = list(range(size))
+
+    def find(self, item):
+        while self.parent[item] != item:
+            self.parent[item] = self.parent[self.parent[item]]
+            item = self.parent[item]
+        return item
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+
+def group_duplicates(drivers, pairs, include_name=False):
+    """Группы дубликатов: [{'members': [записи], 'reasons': {причины}}]"""
+    union_find = UnionFind(len(drivers))
+    reasons = {}
+    for a, b, kind in pairs:
+        if kind == NAME and not include_name:
+            continue
+        union_find.union(a, b)
+        reasons.setdefault(a, set()).add(kind)
+        reasons.setdefault(b, set()).add(kind)
+
+    groups = {}
+    for idx in range(len(drivers)):
+        groups.setdefault(union_find.find(idx), []).append(idx)
+    return [
+        {
+            'members': [drivers[idx] for idx in members],
+            'reasons': set().union(*(reasons.get(idx, set()) for idx in members)),
+        }
+        for members in groups.values() if len(members) > 1
+    ]
+
+
+def _is_empty(value):
+    return value is None or value == '' or value == ()
+
+
+def plan_merge(group):
+    """
+    Слияние группы: остаётся последняя обновлённая страница (импорт правит её,
+    когда в переписке новые сообщения, — после смены ника это страница нового
+    ника), затем — с наибольшим messagesCount. Возвращает
+    {survivor, duplicates, reasons, fill, payload}:
+    fill — {свойство: (было, станет, тип)} для выжившей страницы.
+    """
+    members = sorted(group['members'], key=lambda entry: (entry['last_edited_time'], entry['messagesCount']), reverse=True)
+    survivor, duplicates = members[0], members[1:]
+
+    fill = {}
+    for duplicate in duplicates:
+        for name, value in duplicate['properties'].items():
+            # У выжившей страницы свойство может отсутствовать в ответе — тип из дубликата
+            prop_type = survivor['types'].get(name) or duplicate['types'].get(name)
+            if name in KEEP_PROPERTIES or prop_type not in MIRRORED_TYPES or _is_empty(value):
+                continue
+            current = fill[name][1] if name in fill else survivor['properties'].get(name)
+            if prop_type == 'multi_select':
+                merged = tuple(sorted(set(current or ()) | set(value)))
+                if merged != tuple(current or ()):
+                    fill[name] = (survivor['properties'].get(name), merged, prop_type)
+            elif name == 'messagesCount':
+                if value > (current or 0):
+                    fill[name] = (survivor['properties'].get(name), value, prop_type)
+            elif _is_empty(current):
+                fill[name] = (survivor['properties'].get(name), value, prop_type)
+
+    return {
+        'survivor': survivor,
+        'duplicates': duplicates,
+        'reasons': group['reasons'],
+        'fill': fill,
+        'payload': {name: property_payload(prop_type, after) for name, (_, after, prop_type) in fill.items()},
+    }
+
+
+def display_name(entry):
+    return '@' + (entry['nickname'].strip().lstrip('@') or entry['page_id'])
+
+
+REVIEW_LABELS = {HANDLE: 'ник', PHONE: 'телефон', NAME: 'скелет ника'}
+
+
+def print_review(review):
+    """Блоки, которые не сливаются автоматически"""
+    for kind, key, entries in review[:REPORT_LIMIT]:
+        names = ', '.join(display_name(entry) for entry in entries[:REPORT_LIMIT])
+        more = f" ... всего {len(entries)}" if len(entries) > REPORT_LIMIT else ''
+        print(f"  {REVIEW_LABELS[kind]} {key}: {names}{more}")
+    if len(review) > REPORT_LIMIT:
+        print(f"  ... и ещё {len(review) - REPORT_LIMIT}")
+
+
+def print_merges(merges, show_all=False):
+    shown = merges if show_all else merges[:REPORT_LIMIT]
+    for merge in shown:
+        duplicates = ', '.join(display_name(entry) for entry in merge['duplicates'])
+        print(f"  🔗 {display_name(merge['survivor'])} ← {duplicates} ({', '.join(sorted(merge['reasons']))})")
+        for name, (before, after, _) in merge['fill'].items():
+            print(f"      {name}: {before!r} → {after!r}")
+    if len(merges) > len(shown):
+        print(f"  ... и ещё {len(merges) - len(shown)}")
+
+
+class Journal:
+    """Журнал слияний (JSON Lines): какие страницы архивированы и что перенесено"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # Прерванный запуск мог оборвать последнюю строку — новая запись не должна к ней приклеиться
+        self.truncated = False
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                self.truncated = f.read(1) != b'\n'
+
+    def add(self, merge, archived):
+        entry = {
+            'survivor': merge['survivor']['page_id'],
+            'survivor_nickname': merge['survivor']['nickname'],
+            'archived': [{'page_id': entry['page_id'], 'nickname': entry['nickname']} for entry in archived],
+            'reasons': sorted(merge['reasons']),
+            'filled': {name: {'before': before, 'after': after} for name, (before, after, _) in merge['fill'].items()},
+            'merged_at': datetime.now().isoformat(timespec='seconds'),
+        }
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                if self.truncated:
+                    f.write('\n')
+                    self.truncated = False
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+
+def apply_merge(merge, journal):
+    """Дополняет выжившую страницу и архивирует дубликаты. Возвращает ошибку или None"""
+    if merge['payload']:
+        _, error = notion_request("PATCH", f"/pages/{merge['survivor']['page_id']}", {"properties": merge['payload']})
+        if error:
+            return error
+    archived = []
+    errors = []
+    for duplicate in merge['duplicates']:
+        _, error = notion_request("PATCH", f"/pages/{duplicate['page_id']}", {"archived": True})
+        if error:
+            errors.append(f"{display_name(duplicate)}: {error}")
+        else:
+            archived.append(duplicate)
+    # В журнал — и частично выполненное слияние: остаток найдётся при следующем запуске
+    journal.add(merge, archived)
+    return '; '.join(errors) or None
+
+
+def apply_merges(merges, journal, workers=MAX_WORKERS):
+    success_count = 0
+    errors = []
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(apply_merge, merge, journal): merge for merge in merges}
+        for completed, future in enumerate(as_completed(futures), 1):
+            merge = futures[future]
+            error = future.result()
+            nickname = display_name(merge['survivor'])
+            if error is None:
+                metrics.inc('dedupe_merges_total', result='merged')
+                metrics.inc('dedupe_pages_archived_total', len(merge['duplicates']))
+                print(f"  [{completed}/{len(merges)}] {nickname} ✅")
+                success_count += 1
+            else:
+                metrics.inc('dedupe_merges_total', result='error')
+                print(f"  [{completed}/{len(merges)}] {nickname} ❌ {error}")
+                errors.append((nickname, error))
+
+    elapsed = time.time() - start_time
+    print("\n📊 Итоги:")
+    print(f"  Слито групп: {success_count}")
+    if errors:
+        print(f"  Ошибки: {len(errors)}")
+    print(f"  Время выполнения: {elapsed:.1f} сек")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Поиск и слияние дубликатов водителей в Notion')
+    parser.add_argument('--apply', action='store_true', help='Применить слияния (по умолчанию — только показать)')
+    parser.add_argument('--include-name', action='store_true', help='Сливать группы, найденные только по похожести ника')
+    parser.add_argument('--journal', default=JOURNAL_FILE, help='Журнал слияний')
+    parser.add_argument('--rate', type=float, default=NOTION_RATE, help='Лимит запросов к Notion в секунду (0 = без лимита)')
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS, help='Параллельных слияний')
+    parser.add_argument('--metrics', help='Сохранить метрики запуска (JSON или .prom)')
+    args = parser.parse_args()
+
+    global notion_limiter
+    notion_limiter = RateLimiter(args.rate)
+    try:
+        run(args)
+    finally:
+        metrics.write_report(args.metrics)
+
+
+def run(args):
+    if not args.apply:
+        print("🔍 Режим просмотра: изменения не будут внесены (--apply для применения)\n")
+
+    print("📥 Загрузка базы водителей...")
+    drivers = fetch_drivers(DRIVERS_DB_ID)
+    print(f"✅ Загружено {len(drivers)} записей\n")
+
+    pairs, review = candidate_pairs(drivers)
+    groups = group_duplicates(drivers, pairs, include_name=args.include_name)
+    merges = [plan_merge(group) for group in groups]
+    if not args.include_name:
+        # Группы по похожести ника, которые без --include-name не сливаются
+        merged = {id(entry) for group in groups for entry in group['members']}
+        name_only = [
+            group for group in group_duplicates(drivers, pairs, include_name=True)
+            if not all(id(entry) in merged for entry in group['members'])
+        ]
+    else:
+        name_only = []
+
+    print("📊 Результаты анализа:")
+    print(f"  Пар-кандидатов: {len(pairs)}")
+    print(f"  Групп дубликатов: {len(merges)} (страниц к архивации: {sum(len(m['duplicates']) for m in merges)})")
+    if name_only:
+        print(f"  Только по похожести ника (без --include-name не сливаются): {len(name_only)}")
+    if review:
+        print(f"  На ручную проверку (большие блоки, телефон без второго признака): {len(review)}")
+    print()
+
+    if merges:
+        print("📝 Слияния:")
+        print_merges(merges, show_all=not args.apply)
+        print()
+    if name_only:
+        print("⚠️  Похожие ники (проверьте вручную):")
+        for group in name_only[:REPORT_LIMIT]:
+            print(f"  {', '.join(display_name(entry) for entry in group['members'])}")
+        print()
+    if review:
+        print("⚠️  Не сливаются автоматически (проверьте вручную):")
+        print_review(review)
+        print()
+
+    if not merges:
+        print("✅ Дубликатов для слияния нет")
+        return
+    if not args.apply:
+        print("ℹ️  Запустите с --apply для применения")
+        return
+
+    print(f"🔄 Слияние {len(merges)} групп ({args.workers} потоков, "
+          f"{f'до {args.rate:g} req/sec' if args.rate else 'без лимита'}), журнал: {args.journal}")
+    apply_merges(merges, Journal(args.journal), args.workers)
+
+
+if __name__ == "__main__":
+    main()
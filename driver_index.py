@@ -0,0 +1,274 @@
+"""
+Индекс водителей по идентификаторам: TikTok-ник, телефон, id страницы Notion.
+
+Ник нормализуется (normalize_handle): «@Nick», «nick » и
+«https://www.tiktok.com/@Nick?lang=ru» — один и тот же водитель. Телефон
+приводится к E.164 (format_phone_number). Поиск по любому ключу — O(1).
+Несколько страниц с одним ником или телефоном не перетирают друг друга:
+основной остаётся первая, остальные видны в duplicates().
+
+    index = DriverIndex()
+    index.add({'page_id': ..., 'nickname': 'Nick', 'phone': '+48...'})
+    'nick' in index, index['@NICK'], index.find_by_phone('+48 600 000 000')
+    for kind, key, entries in index.duplicates(): ...
+
+Индекс ведёт себя как словарь {ник: запись} (existing_drivers импортёра).
+index.creating — создаваемые сейчас страницы (PendingCreates): один ник
+создаёт одна задача, остальные ждут и видят уже созданную запись.
+Ники страниц, слитых dedupe_drivers.py, — псевдонимы оставшейся страницы
+(load_merge_aliases): 'old_nick' in index находит её, index.is_alias(...) — True.
+"""
+
+import os
+import re
+import json
+import threading
+from concurrent.futures import Future
+from urllib.parse import unquote
+
+import phonenumbers
+from phonenumbers import NumberParseException
+
+TIKTOK_URL_RE = re.compile(r'tiktok\.com/@([^?/#\s]+)', re.IGNORECASE)
+# Регион для номеров без кода страны
+DEFAULT_PHONE_REGION = 'PL'
+
+HANDLE = 'handle'
+PHONE = 'phone'
+# Журнал слияний dedupe_drivers.py — из него берутся псевдонимы ников
+MERGE_JOURNAL_FILE = 'dedupe_journal.jsonl'
+# Черный список номеров (номер менеджера, который AI иногда парсит как номер кандидата)
+EXCLUDED_PHONE_NUMBERS = {
+    '+48573899403',
+    '+48 573 899 403',
+}
+
+
+def normalize_handle(value):
+    """TikTok-ник в нижнем регистре без «@» (из ника или ссылки на профиль) или None"""
+    if not value:
+        return None
+    value = str(value).strip()
+    match = TIKTOK_URL_RE.search(value)
+    if match:
+        value = unquote(match.group(1))
+    value = value.lstrip('@').strip().lower()
+    return value or None
+
+
+def format_phone_number(phone):
+    """
+    Форматирует и валидирует номер телефона для Notion API.
+    Возвращает номер в формате E.164 или None, если номер невалиден.
+    """
+    if not phone:
+        return None
+
+    try:
+        parsed_number = phonenumbers.parse(phone, DEFAULT_PHONE_REGION)
+        if not phonenumbers.is_valid_number(parsed_number):
+            return None
+        return phonenumbers.format_number(parsed_number, phonenumbers.PhoneNumberFormat.E164)
+    except NumberParseException:
+        return None
+
+
+def load_merge_aliases(path=MERGE_JOURNAL_FILE):
+    """
+    {ник архивированной страницы: id оставшейся страницы} из журнала слияний.
+    Цепочки (страницу слили, потом слили и оставшуюся) ведут к последней.
+    """
+    if not os.path.exists(path):
+        return {}
+    redirects = {}
+    handles = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                merge = json.loads(line)
+            except json.JSONDecodeError:
+                # Оборванная запись последнего запуска
+                continue
+            for archived in merge.get('archived', []):
+                redirects[archived['page_id']] = merge['survivor']
+                handle = normalize_handle(archived.get('nickname'))
+                if handle:
+                    handles[handle] = archived['page_id']
+
+    aliases = {}
+    for handle, page_id in handles.items():
+        seen = set()
+        while page_id in redirects and page_id not in seen:
+            seen.add(page_id)
+            page_id = redirects[page_id]
+        aliases[handle] = page_id
+    return aliases
+
+
+class PendingCreates:
+    """
+    Создания страниц «в полёте» по нормализованному нику. Потокобезопасно:
+    ждать можно из потока (future.result()) и из любого event loop
+    (await asyncio.wrap_future(future)).
+
+        owner, future = pending.claim(nick)
+        if owner:
+            try: ... создать страницу и записать в индекс ...
+            finally: pending.release(nick, future)
+        else:
+            await asyncio.wrap_future(future)
+
+    uncertain — ники, чьё создание оборвалось без ответа (таймаут): страница
+    могла создаться, перед повтором её нужно поискать.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.futures = {}
+        self.uncertain = set()
+
+    def claim(self, nickname):
+        """(True, future) — создаёт вызывающий; (False, future) — уже создаёт другой"""
+        handle = normalize_handle(nickname)
+        with self.lock:
+            if handle in self.futures:
+                return False, self.futures[handle]
+            future = self.futures[handle] = Future()
+            return True, future
+
+    def release(self, nickname, future):
+        """Создание завершено (успешно или нет) — ожидающие продолжают"""
+        with self.lock:
+            if self.futures.get(normalize_handle(nickname)) is future:
+                del self.futures[normalize_handle(nickname)]
+        future.set_result(None)
+
+    def mark_uncertain(self, nickname):
+        with self.lock:
+            self.uncertain.add(normalize_handle(nickname))
+
+    def take_uncertain(self, nickname):
+        """Было ли прошлое создание оборвано (флаг сбрасывается)"""
+        handle = normalize_handle(nickname)
+        with self.lock:
+            if handle in self.uncertain:
+                self.uncertain.discard(handle)
+                return True
+            return False
+
+
+class DriverIndex:
+    """
+    Записи водителей ({'page_id', 'nickname', 'phone', ...}) с поиском
+    по нормализованному нику, телефону в E.164 и id страницы.
+    """
+
+    def __init__(self, entries=()):
+        self.by_handle = {}
+        self.by_phone = {}
+        self.by_page = {}
+        self.extra_handles = {}
+        self.aliases = {}
+        self.creating = PendingCreates()
+        for entry in entries:
+            self.add(entry)
+
+    def add(self, entry):
+        """Добавляет запись. Повтор ника или телефона не заменяет основную запись"""
+        handle = normalize_handle(entry.get('nickname'))
+        if entry.get('page_id'):
+            self.by_page[entry['page_id']] = entry
+        if handle:
+            if handle in self.by_handle and self.by_handle[handle] is not entry:
+                self.extra_handles.setdefault(handle, []).append(entry)
+            else:
+                self.by_handle[handle] = entry
+        phone = format_phone_number(entry.get('phone'))
+        if phone:
+            entries = self.by_phone.setdefault(phone, [])
+            if not any(other is entry for other in entries):
+                entries.append(entry)
+        return entry
+
+    def add_aliases(self, aliases):
+        """Псевдонимы {ник: id страницы}; ник с собственной страницей остаётся её ником"""
+        for nickname, page_id in aliases.items():
+            self.aliases[normalize_handle(nickname)] = page_id
+
+    def is_alias(self, nickname):
+        """Ник найден только как псевдоним (его страница слита с другой)"""
+        handle = normalize_handle(nickname)
+        return handle not in self.by_handle and self.aliases.get(handle) in self.by_page
+
+    def _lookup(self, nickname):
+        handle = normalize_handle(nickname)
+        if handle in self.by_handle:
+            return self.by_handle[handle]
+        return self.by_page.get(self.aliases.get(handle))
+
+    def find_by_phone(self, phone):
+        """Все записи с этим номером (любой формат записи номера)"""
+        return self.by_phone.get(format_phone_number(phone), [])
+
+    def get_page(self, page_id):
+        return self.by_page.get(page_id)
+
+    def duplicates(self):
+        """[(HANDLE или PHONE, ключ, [записи])] — ключи, которые есть у нескольких страниц"""
+        groups = [
+            (HANDLE, handle, [self.by_handle[handle]] + extra)
+            for handle, extra in self.extra_handles.items()
+        ]
+        groups += [(PHONE, phone, entries) for phone, entries in self.by_phone.items() if len(entries) > 1]
+        return groups
+
+    # Словарь {ник: запись}: ключи нормализуются при каждом обращении, псевдонимы учитываются
+
+    def __contains__(self, nickname):
+        return self._lookup(nickname) is not None
+
+    def __getitem__(self, nickname):
+        entry = self._lookup(nickname)
+        if entry is None:
+            raise KeyError(nickname)
+        return entry
+
+    def __setitem__(self, nickname, entry):
+        """Как у словаря: заменяет основную запись ника"""
+        entry.setdefault('nickname', nickname)
+        handle = normalize_handle(nickname)
+        self.remove(self.by_handle.get(handle))
+        # remove() мог сделать основной следующую страницу-дубликат — новая важнее
+        promoted = self.by_handle.pop(handle, None)
+        self.add(entry)
+        if promoted is not None:
+            self.extra_handles.setdefault(handle, []).insert(0, promoted)
+
+    def remove(self, entry):
+        """Убирает запись из всех ключей; следующая с тем же ником становится основной"""
+        if entry is None:
+            return
+        self.by_page.pop(entry.get('page_id'), None)
+        phone = format_phone_number(entry.get('phone'))
+        if phone in self.by_phone:
+            self.by_phone[phone] = [other for other in self.by_phone[phone] if other is not entry]
+            if not self.by_phone[phone]:
+                del self.by_phone[phone]
+        handle = normalize_handle(entry.get('nickname'))
+        extra = [other for other in self.extra_handles.pop(handle, []) if other is not entry]
+        if self.by_handle.get(handle) is entry:
+            del self.by_handle[handle]
+            if extra:
+                self.by_handle[handle] = extra.pop(0)
+        if extra:
+            self.extra_handles[handle] = extra
+
+    def get(self, nickname, default=None):
+        entry = self._lookup(nickname)
+        return default if entry is None else entry
+
+    def __len__(self):
+        return len(self.by_handle)
+
+    def __iter__(self):
+        return iter(self.by_handle)
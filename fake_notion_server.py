@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+Локальный стенд Notion API для нагрузочного тестирования скриптов синхронизации
+
+Реализует эндпоинты, которые используют наши скрипты:
+  POST   /v1/databases/{id}/query     (пагинация has_more / next_cursor)
+  POST   /v1/pages
+  GET    /v1/pages/{id}
+  PATCH  /v1/pages/{id}
+  GET    /v1/blocks/{id}/children     (пагинация)
+  PATCH  /v1/blocks/{id}/children
+  DELETE /v1/blocks/{id}
+
+Служебные эндпоинты:
+  GET    /__stats                     счётчики запросов и 429
+  POST   /__reset                     очистить данные и счётчики
+
+ИСПОЛЬЗОВАНИЕ:
+  python3 fake_notion_server.py [--port N] [--latency MS] [--jitter MS] [--rate N] [--burst N]
+                                [--error-rate P] [--page-size N] [--seed FILE]
+
+  NOTION_API_URL=http://127.0.0.1:8787/v1 NOTION_TOKEN=test python3 import_drivers_to_notion.py
+
+ПАРАМЕТРЫ:
+  --port N         Порт (по умолчанию: 8787)
+  --latency MS     Базовая задержка ответа (по умолчанию: 0)
+  --jitter MS      Случайная добавка к задержке 0..MS (по умолчанию: 0)
+  --rate N         Лимит запросов в секунду, как у Notion (по умолчанию: 3, 0 = без лимита)
+  --burst N        Размер "ведра" токенов (по умолчанию: 10)
+  --error-rate P   Доля случайных ответов 429 (0..1, по умолчанию: 0)
+  --page-size N    Максимальный размер страницы пагинации (по умолчанию: 100)
+  --seed FILE      JSON {database_id: [properties, ...]} для предзаполнения баз
+"""
+
+import json
+import sys
+import time
+import uuid
+import random
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+DEFAULT_PORT = 8787
+RICH_TEXT_TYPES = ("title", "rich_text")
+PROPERTY_TYPES = (
+    "title", "rich_text", "number", "select", "multi_select", "status",
+    "checkbox", "url", "phone_number", "email", "date",
+)
+
+
+def _now_iso():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+def _rich_text_response(items):
+    """Приводит rich_text из запроса к виду ответа Notion (type + plain_text)"""
+    result = []
+    for item in items or []:
+        content = item.get("text", {}).get("content", "")
+        result.append({
+            "type": "text",
+            "text": {"content": content, "link": None},
+            "plain_text": content,
+        })
+    return result
+
+
+def to_response_property(value):
+    """Свойство из запроса → свойство в формате ответа (с полем type)"""
+    for prop_type in PROPERTY_TYPES:
+        if prop_type in value:
+            prop_value = value[prop_type]
+            if prop_type in RICH_TEXT_TYPES:
+                prop_value = _rich_text_response(prop_value)
+            return {"type": prop_type, prop_type: prop_value}
+    return value
+
+
+class RateLimiter:
+    """Token bucket: rate токенов в секунду, не больше burst"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        if not self.rate:
+            return True, 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True, 0
+            return False, (1 - self.tokens) / self.rate
+
+
+class FakeNotionState:
+    """Данные стенда в памяти: базы, страницы и дочерние блоки"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.databases = {}
+            self.pages = {}
+            self.children = {}
+            self.stats = {"requests": 0, "rate_limited": 0, "injected_429": 0, "by_endpoint": {}}
+
+    def count(self, endpoint):
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["by_endpoint"][endpoint] = self.stats["by_endpoint"].get(endpoint, 0) + 1
+
+    def add_page(self, database_id, properties):
+        page_id = str(uuid.uuid4())
+        created = _now_iso()
+        page = {
+            "object": "page",
+            "id": page_id,
+            "created_time": created,
+            "last_edited_time": created,
+            "archived": False,
+            "parent": {"type": "database_id", "database_id": database_id},
+            "properties": {name: to_response_property(value) for name, value in (properties or {}).items()},
+        }
+        with self.lock:
+            self.pages[page_id] = page
+            self.databases.setdefault(database_id, []).append(page_id)
+            self.children[page_id] = []
+        return page
+
+    def query_database(self, database_id, start, page_size):
+        with self.lock:
+            page_ids = [pid for pid in self.databases.get(database_id, []) if not self.pages[pid]["archived"]]
+            chunk = [self.pages[pid] for pid in page_ids[start:start + page_size]]
+        return chunk, start + page_size < len(page_ids)
+
+    def update_page(self, page_id, data):
+        with self.lock:
+            page = self.pages.get(page_id)
+            if not page:
+                return None
+            for name, value in data.get("properties", {}).items():
+                page["properties"][name] = to_response_property(value)
+            if "archived" in data:
+                page["archived"] = bool(data["archived"])
+            page["last_edited_time"] = _now_iso()
+            return page
+
+    def append_children(self, parent_id, blocks):
+        created = []
+        with self.lock:
+            target = self.children.setdefault(parent_id, [])
+            for block in blocks:
+                block_type = block.get("type")
+                block_data = dict(block.get(block_type, {}))
+                if "rich_text" in block_data:
+                    block_data["rich_text"] = _rich_text_response(block_data["rich_text"])
+                stored = {
+                    "object": "block",
+                    "id": str(uuid.uuid4()),
+                    "type": block_type,
+                    block_type: block_data,
+                    "has_children": False,
+                    "archived": False,
+                }
+                target.append(stored)
+                self.children[stored["id"]] = []
+                created.append(stored)
+        return created
+
+    def list_children(self, block_id, start, page_size):
+        with self.lock:
+            blocks = [b for b in self.children.get(block_id, []) if not b["archived"]]
+        return blocks[start:start + page_size], start + page_size < len(blocks)
+
+    def delete_block(self, block_id):
+        with self.lock:
+            for blocks in self.children.values():
+                for block in blocks:
+                    if block["id"] == block_id and not block["archived"]:
+                        block["archived"] = True
+                        return block
+        return None
+
+
+class FakeNotionHandler(BaseHTTPRequestHandler):
+    server_version = "FakeNotion/1.0"
+
+    # Конфигурация и состояние задаются в make_server()
+    state = None
+    limiter = None
+    config = {}
+
+    def log_message(self, format, *args):
+        if self.config.get("verbose"):
+            super().log_message(format, *args)
+
+    # -- ответы ---------------------------------------------------------------
+
+    def _send(self, status, body, headers=None):
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _error(self, status, code, message, headers=None):
+        self._send(status, {"object": "error", "status": status, "code": code, "message": message}, headers)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length).decode("utf-8"))
+
+    def _paginate_params(self, query, body):
+        page_size = int(body.get("page_size") or query.get("page_size", [100])[0])
+        page_size = max(1, min(page_size, self.config.get("page_size", 100)))
+        cursor = body.get("start_cursor") or query.get("start_cursor", [None])[0]
+        return (int(cursor) if cursor else 0), page_size
+
+    @staticmethod
+    def _list_response(results, start, page_size, has_more):
+        return {
+            "object": "list",
+            "results": results,
+            "has_more": has_more,
+            "next_cursor": str(start + page_size) if has_more else None,
+        }
+
+    # -- обработка ------------------------------------------------------------
+
+    def _admit(self):
+        """Авторизация, задержка и лимиты. Возвращает False, если ответ уже отправлен"""
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            self._error(401, "unauthorized", "API token is invalid.")
+            return False
+
+        delay_ms = self.config.get("latency", 0) + random.uniform(0, self.config.get("jitter", 0))
+        if delay_ms:
+            time.sleep(delay_ms / 1000)
+
+        allowed, retry_after = self.limiter.try_acquire()
+        if not allowed:
+            with self.state.lock:
+                self.state.stats["rate_limited"] += 1
+            self._error(429, "rate_limited", "Rate limited", {"Retry-After": f"{max(retry_after, 0.1):.2f}"})
+            return False
+
+        if random.random() < self.config.get("error_rate", 0):
+            with self.state.lock:
+                self.state.stats["injected_429"] += 1
+            self._error(429, "rate_limited", "Rate limited (injected)", {"Retry-After": "1"})
+            return False
+        return True
+
+    def _route(self, method):
+        parsed = urlparse(self.path)
+        parts = [p for p in parsed.path.split("/") if p]
+        query = parse_qs(parsed.query)
+
+        if parts == ["__stats"] and method == "GET":
+            with self.state.lock:
+                stats = json.loads(json.dumps(self.state.stats))
+            stats["pages"] = len(self.state.pages)
+            return self._send(200, stats)
+        if parts == ["__reset"] and method == "POST":
+            self.state.reset()
+            return self._send(200, {"ok": True})
+
+        if parts[:1] != ["v1"]:
+            return self._error(404, "object_not_found", "Unknown endpoint")
+        parts = parts[1:]
+        endpoint = f"{method} /{parts[0]}" + ("/{id}" if len(parts) > 1 else "") + (f"/{parts[2]}" if len(parts) > 2 else "")
+        self.state.count(endpoint)
+
+        if not self._admit():
+            return
+
+        try:
+            body = self._read_json() if method in ("POST", "PATCH") else {}
+        except json.JSONDecodeError:
+            return self._error(400, "invalid_json", "Body is not valid JSON")
+
+        if len(parts) == 3 and parts[0] == "databases" and parts[2] == "query" and method == "POST":
+            start, page_size = self._paginate_params(query, body)
+            results, has_more = self.state.query_database(parts[1], start, page_size)
+            return self._send(200, self._list_response(results, start, page_size, has_more))
+
+        if parts == ["pages"] and method == "POST":
+            database_id = body.get("parent", {}).get("database_id")
+            if not database_id:
+                return self._error(400, "validation_error", "parent.database_id is required")
+            return self._send(200, self.state.add_page(database_id, body.get("properties")))
+
+        if len(parts) == 2 and parts[0] == "pages":
+            if method == "GET":
+                page = self.state.pages.get(parts[1])
+            elif method == "PATCH":
+                page = self.state.update_page(parts[1], body)
+            else:
+                return self._error(405, "invalid_request", "Method not allowed")
+            if not page:
+                return self._error(404, "object_not_found", f"Could not find page with ID: {parts[1]}")
+            return self._send(200, page)
+
+        if len(parts) == 3 and parts[0] == "blocks" and parts[2] == "children":
+            if method == "GET":
+                start, page_size = self._paginate_params(query, {})
+                results, has_more = self.state.list_children(parts[1], start, page_size)
+                return self._send(200, self._list_response(results, start, page_size, has_more))
+            if method == "PATCH":
+                created = self.state.append_children(parts[1], body.get("children", []))
+                return self._send(200, self._list_response(created, 0, len(created), False))
+
+        if len(parts) == 2 and parts[0] == "blocks" and method == "DELETE":
+            block = self.state.delete_block(parts[1])
+            if not block:
+                return self._error(404, "object_not_found", f"Could not find block with ID: {parts[1]}")
+            return self._send(200, block)
+
+        return self._error(404, "object_not_found", "Unknown endpoint")
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_PATCH(self):
+        self._route("PATCH")
+
+    def do_DELETE(self):
+        self._route("DELETE")
+
+
+def make_server(host="127.0.0.1", port=DEFAULT_PORT, latency=0, jitter=0, rate=3, burst=10,
+                error_rate=0.0, page_size=100, verbose=False, state=None):
+    """Создаёт сервер стенда (порт 0 — выбрать свободный). Возвращает (server, state)"""
+    state = state or FakeNotionState()
+    handler = type("ConfiguredFakeNotionHandler", (FakeNotionHandler,), {
+        "state": state,
+        "limiter": RateLimiter(rate, burst),
+        "config": {
+            "latency": latency,
+            "jitter": jitter,
+            "error_rate": error_rate,
+            "page_size": page_size,
+            "verbose": verbose,
+        },
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server, state
+
+
+def start_in_thread(**kwargs):
+    """Запускает стенд в фоновом потоке. Возвращает (server, state, base_url)"""
+    server, state = make_server(**kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    return server, state, f"http://{host}:{port}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Локальный стенд Notion API')
+    parser.add_argument('--host', default='127.0.0.1', help='Адрес')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Порт')
+    parser.add_argument('--latency', type=float, default=0, help='Базовая задержка ответа, мс')
+    parser.add_argument('--jitter', type=float, default=0, help='Случайная добавка к задержке, мс')
+    parser.add_argument('--rate', type=float, default=3, help='Лимит запросов в секунду (0 = без лимита)')
+    parser.add_argument('--burst', type=int, default=10, help='Размер ведра токенов')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Доля случайных 429')
+    parser.add_argument('--page-size', type=int, default=100, help='Максимальный размер страницы')
+    parser.add_argument('--seed', help='JSON {database_id: [properties, ...]}')
+    parser.add_argument('--verbose', action='store_true', help='Логировать каждый запрос')
+    args = parser.parse_args()
+
+    server, state = make_server(
+        args.host, args.port, args.latency, args.jitter, args.rate, args.burst,
+        args.error_rate, args.page_size, args.verbose
+    )
+
+    if args.seed:
+        with open(args.seed, 'r', encoding='utf-8') as f:
+            seed = json.load(f)
+        for database_id, pages in seed.items():
+            for properties in pages:
+                state.add_page(database_id, properties)
+        print(f"🌱 Загружено {len(state.pages)} страниц из {args.seed}")
+
+    print(f"🧪 Стенд Notion API: http://{args.host}:{args.port}/v1")
+    print(f"   задержка {args.latency}±{args.jitter} мс, лимит {args.rate or '∞'} req/s, 429: {args.error_rate:.0%}")
+    print(f"   NOTION_API_URL=http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Остановлен")
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
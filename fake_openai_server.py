@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Локальный стенд OpenAI Chat Completions для замеров пропускной способности LLM-этапа
+
+Отвечает на POST /v1/chat/completions в формате, который понимает
+client.beta.chat.completions.parse: content — JSON, валидный по схеме из
+response_format (json_schema). Значения генерируются случайно по схеме или
+берутся из файла фикстур.
+
+Кэш префикса имитирует prompt caching OpenAI: схема ответа и ведущие
+системные сообщения длиной от 1024 токенов, уже встречавшиеся раньше,
+возвращаются в usage.prompt_tokens_details.cached_tokens (кратно 128).
+
+Служебные эндпоинты:
+  GET    /__stats                     счётчики запросов, 429 и токенов
+  POST   /__reset                     сбросить счётчики и окна лимитов
+
+ИСПОЛЬЗОВАНИЕ:
+  python3 fake_openai_server.py [--port N] [--latency-median MS] [--latency-sigma S]
+                                [--rpm N] [--tpm N] [--fixtures FILE] [--seed N]
+
+  OPENAI_BASE_URL=http://127.0.0.1:8788/v1 OPENAI_API_KEY=test python3 analyze_candidates.py
+
+ПАРАМЕТРЫ:
+  --port N              Порт (по умолчанию: 8788)
+  --latency-median MS   Медиана задержки ответа (по умолчанию: 800)
+  --latency-sigma S     Разброс логнормального распределения задержки (по умолчанию: 0.5)
+  --ms-per-token MS     Добавка к задержке на каждый токен ответа (по умолчанию: 0)
+  --rpm N               Лимит запросов в минуту (по умолчанию: 0 = без лимита)
+  --tpm N               Лимит токенов в минуту (по умолчанию: 0 = без лимита)
+  --fixtures FILE       JSON {имя схемы: [ответ, ...]} — отдавать готовые ответы
+  --seed N              Seed генератора случайных ответов
+  --no-prompt-cache     Не имитировать кэш префикса
+"""
+
+import json
+import sys
+import time
+import uuid
+import random
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PORT = 8788
+# Грубая оценка: ~4 символа на токен
+CHARS_PER_TOKEN = 4
+# Prompt caching: минимальный префикс и шаг кэшируемых токенов
+PROMPT_CACHE_MIN_TOKENS = 1024
+PROMPT_CACHE_BLOCK = 128
+RANDOM_WORDS = [
+    'водитель', 'тент', 'реф', 'Польша', 'Германия', 'опыт', 'категория', 'CE',
+    'виза', 'карта побыту', 'экипаж', 'график', 'Варшава', 'Познань', 'договор',
+]
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def random_value(schema, rng):
+    """Случайное значение, удовлетворяющее JSON Schema (подмножество strict-режима)"""
+    if 'enum' in schema:
+        return rng.choice(schema['enum'])
+
+    schema_type = schema.get('type')
+    if isinstance(schema_type, list):
+        non_null = [t for t in schema_type if t != 'null']
+        if 'null' in schema_type and (not non_null or rng.random() < 0.3):
+            return None
+        schema_type = rng.choice(non_null)
+
+    if schema_type == 'object':
+        return {
+            name: random_value(prop_schema, rng)
+            for name, prop_schema in schema.get('properties', {}).items()
+        }
+    if schema_type == 'array':
+        items = schema.get('items', {})
+        if 'enum' in items:
+            return rng.sample(items['enum'], rng.randint(0, min(3, len(items['enum']))))
+        return [random_value(items, rng) for _ in range(rng.randint(0, 3))]
+    if schema_type == 'boolean':
+        return rng.random() < 0.5
+    if schema_type == 'integer':
+        return rng.randint(0, 60)
+    if schema_type == 'number':
+        return round(rng.uniform(1000, 12000), 2)
+    if schema_type == 'string':
+        return ' '.join(rng.choice(RANDOM_WORDS) for _ in range(rng.randint(1, 4)))
+    return None
+
+
+class SlidingWindowLimiter:
+    """Лимиты RPM/TPM по скользящему окну в 60 секунд"""
+
+    WINDOW = 60.0
+
+    def __init__(self, rpm=0, tpm=0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.events = deque()  # (время, токены)
+        self.tokens_in_window = 0
+        self.lock = threading.Lock()
+
+    def reset(self):
+        with self.lock:
+            self.events.clear()
+            self.tokens_in_window = 0
+
+    def try_acquire(self, tokens):
+        """Возвращает (разрешено, через сколько секунд повторить, какой лимит сработал)"""
+        with self.lock:
+            now = time.monotonic()
+            while self.events and now - self.events[0][0] >= self.WINDOW:
+                self.tokens_in_window -= self.events.popleft()[1]
+
+            if self.rpm and len(self.events) >= self.rpm:
+                return False, self.WINDOW - (now - self.events[0][0]), 'requests'
+            if self.tpm and self.tokens_in_window + tokens > self.tpm and self.events:
+                return False, self.WINDOW - (now - self.events[0][0]), 'tokens'
+
+            self.events.append((now, tokens))
+            self.tokens_in_window += tokens
+            return True, 0, None
+
+
+class FakeOpenAIState:
+    """Счётчики стенда"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stats = {
+                "requests": 0,
+                "completed": 0,
+                "rate_limited": 0,
+                "prompt_tokens": 0,
+                "cached_tokens": 0,
+                "completion_tokens": 0,
+            }
+            self.prefixes = set()
+
+    def cached_prefix_tokens(self, prefix_text):
+        """Сколько токенов префикса уже в кэше (0 при первом появлении префикса)"""
+        tokens = estimate_tokens(prefix_text)
+        if tokens < PROMPT_CACHE_MIN_TOKENS:
+            return 0
+        key = hash(prefix_text)
+        with self.lock:
+            if key not in self.prefixes:
+                self.prefixes.add(key)
+                return 0
+        return tokens // PROMPT_CACHE_BLOCK * PROMPT_CACHE_BLOCK
+
+    def add(self, **counters):
+        with self.lock:
+            for key, value in counters.items():
+                self.stats[key] += value
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    server_version = "FakeOpenAI/1.0"
+
+    # Конфигурация и состояние задаются в make_server()
+    state = None
+    limiter = None
+    fixtures = {}
+    rng = None
+    rng_lock = threading.Lock()
+    config = {}
+
+    def log_message(self, format, *args):
+        if self.config.get("verbose"):
+            super().log_message(format, *args)
+
+    def _send(self, status, body, headers=None):
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _error(self, status, message, error_type, code=None, headers=None):
+        self._send(status, {"error": {"message": message, "type": error_type, "param": None, "code": code}}, headers)
+
+    def do_GET(self):
+        if self.path == "/__stats":
+            with self.state.lock:
+                return self._send(200, dict(self.state.stats))
+        self._error(404, "Unknown endpoint", "invalid_request_error")
+
+    def do_POST(self):
+        if self.path == "/__reset":
+            self.state.reset()
+            self.limiter.reset()
+            return self._send(200, {"ok": True})
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            return self._error(404, "Unknown endpoint", "invalid_request_error")
+
+        self.state.add(requests=1)
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            return self._error(401, "Incorrect API key provided", "invalid_request_error", "invalid_api_key")
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length).decode("utf-8"))
+        except (ValueError, json.JSONDecodeError):
+            return self._error(400, "Body is not valid JSON", "invalid_request_error")
+
+        messages = body.get("messages", [])
+        response_format = body.get("response_format") or {}
+        # Кэшируемый префикс: схема ответа и ведущие системные сообщения
+        prefix_parts = [json.dumps(response_format, ensure_ascii=False)]
+        for message in messages:
+            if message.get("role") not in ("system", "developer"):
+                break
+            prefix_parts.append(str(message.get("content", "")))
+        prefix_text = ''.join(prefix_parts)
+        rest_text = ''.join(str(m.get("content", "")) for m in messages[len(prefix_parts) - 1:])
+        prompt_tokens = estimate_tokens(prefix_text + rest_text)
+
+        allowed, retry_after, limit_name = self.limiter.try_acquire(prompt_tokens)
+        if not allowed:
+            self.state.add(rate_limited=1)
+            return self._error(
+                429, f"Rate limit reached for {limit_name} per min (RPM/TPM)", limit_name, "rate_limit_exceeded",
+                {"retry-after": f"{max(retry_after, 0.1):.2f}", f"x-ratelimit-reset-{limit_name}": f"{retry_after:.2f}s"}
+            )
+
+        cached_tokens = self.state.cached_prefix_tokens(prefix_text) if self.config["prompt_cache"] else 0
+        json_schema = response_format.get("json_schema") or {}
+        schema_name = json_schema.get("name", "response")
+        with self.rng_lock:
+            if self.fixtures.get(schema_name):
+                output = self.rng.choice(self.fixtures[schema_name])
+            else:
+                output = random_value(json_schema.get("schema", {"type": "string"}), self.rng)
+            latency_ms = self.rng.lognormvariate(0, self.config["latency_sigma"]) * self.config["latency_median"]
+
+        content = json.dumps(output, ensure_ascii=False)
+        completion_tokens = estimate_tokens(content)
+        latency_ms += completion_tokens * self.config["ms_per_token"]
+        time.sleep(latency_ms / 1000)
+
+        self.state.add(completed=1, prompt_tokens=prompt_tokens, cached_tokens=cached_tokens,
+                       completion_tokens=completion_tokens)
+        self._send(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "system_fingerprint": "fp_fake",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content, "refusal": None},
+                "logprobs": None,
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            },
+        })
+
+
+def make_server(host="127.0.0.1", port=DEFAULT_PORT, latency_median=800, latency_sigma=0.5,
+                ms_per_token=0, rpm=0, tpm=0, fixtures=None, seed=None, verbose=False, prompt_cache=True):
+    """Создаёт сервер стенда (порт 0 — выбрать свободный). Возвращает (server, state)"""
+    state = FakeOpenAIState()
+    handler = type("ConfiguredFakeOpenAIHandler", (FakeOpenAIHandler,), {
+        "state": state,
+        "limiter": SlidingWindowLimiter(rpm, tpm),
+        "fixtures": fixtures or {},
+        "rng": random.Random(seed),
+        "rng_lock": threading.Lock(),
+        "config": {
+            "latency_median": latency_median,
+            "latency_sigma": latency_sigma,
+            "ms_per_token": ms_per_token,
+            "prompt_cache": prompt_cache,
+            "verbose": verbose,
+        },
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server, state
+
+
+def start_in_thread(**kwargs):
+    """Запускает стенд в фоновом потоке. Возвращает (server, state, base_url)"""
+    server, state = make_server(**kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    return server, state, f"http://{host}:{port}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Локальный стенд OpenAI Chat Completions')
+    parser.add_argument('--host', default='127.0.0.1', help='Адрес')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Порт')
+    parser.add_argument('--latency-median', type=float, default=800, help='Медиана задержки, мс')
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help='Разброс логнормальной задержки')
+    parser.add_argument('--ms-per-token', type=float, default=0, help='Задержка на токен ответа, мс')
+    parser.add_argument('--rpm', type=int, default=0, help='Лимит запросов в минуту (0 = без лимита)')
+    parser.add_argument('--tpm', type=int, default=0, help='Лимит токенов в минуту (0 = без лимита)')
+    parser.add_argument('--fixtures', help='JSON {имя схемы: [ответ, ...]}')
+    parser.add_argument('--seed', type=int, help='Seed генератора ответов')
+    parser.add_argument('--verbose', action='store_true', help='Логировать каждый запрос')
+    parser.add_argument('--no-prompt-cache', action='store_true', help='Не имитировать кэш префикса')
+    args = parser.parse_args()
+
+    fixtures = None
+    if args.fixtures:
+        with open(args.fixtures, 'r', encoding='utf-8') as f:
+            fixtures = json.load(f)
+        print(f"📂 Фикстуры: {', '.join(f'{k} ({len(v)})' for k, v in fixtures.items())}")
+
+    server, _ = make_server(
+        args.host, args.port, args.latency_median, args.latency_sigma, args.ms_per_token,
+        args.rpm, args.tpm, fixtures, args.seed, args.verbose, not args.no_prompt_cache
+    )
+
+    print(f"🧪 Стенд OpenAI API: http://{args.host}:{args.port}/v1")
+    print(f"   задержка: медиана {args.latency_median} мс, sigma {args.latency_sigma}")
+    print(f"   лимиты: {args.rpm or '∞'} RPM, {args.tpm or '∞'} TPM")
+    print(f"   OPENAI_BASE_URL=http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Остановлен")
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
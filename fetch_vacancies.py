@@ -3,7 +3,7 @@
 Скрипт для получения ID всех вакансий и содержимого их вложенных документов из Notion
 
 ИСПОЛЬЗОВАНИЕ:
-  python3 fetch_vacancies.py [output_file.json]
+  python3 fetch_vacancies.py [output_file.json] [--metrics FILE]
 
 ПО УМОЛЧАНИЮ:
   Сохраняет данные в файл vacancies.json в текущей директории
@@ -12,14 +12,19 @@
 import json
 import os
 import sys
+import argparse
 import urllib.request
 import urllib.error
 from dotenv import load_dotenv
 
+import metrics
+
 # Загружаем переменные из .env файла
 load_dotenv()
 
 NOTION_TOKEN = os.getenv('NOTION_TOKEN')
+# Переопределяется для локального стенда (fake_notion_server.py)
+NOTION_API_URL = os.getenv('NOTION_API_URL', 'https://api.notion.com/v1').rstrip('/')
 DATABASE_ID = '27c95810-6f37-8024-b175-d15ffe28f383'
 
 if not NOTION_TOKEN:
@@ -27,13 +32,14 @@ if not NOTION_TOKEN:
     print("Создайте файл .env на основе .env.example и заполните ключи")
     sys.exit(1)
 
+@metrics.timed('notion_fetch_seconds', function='get_child_pages')
 def get_child_pages(page_id):
     """Получает ID всех вложенных страниц (child_page) для указанной страницы"""
     child_page_ids = []
     start_cursor = None
     
     while True:
-        url = f"https://api.notion.com/v1/blocks/{page_id}/children"
+        url = f"{NOTION_API_URL}/blocks/{page_id}/children"
         headers = {
             "Authorization": f"Bearer {NOTION_TOKEN}",
             "Content-Type": "application/json",
@@ -66,6 +72,7 @@ def get_child_pages(page_id):
                 break
                 
         except urllib.error.HTTPError as e:
+            metrics.inc('notion_request_errors_total', status=e.code)
             if e.code == 404:
                 return []
             print(f"⚠️  Ошибка при получении дочерних страниц для {page_id}: HTTP {e.code}")
@@ -76,13 +83,14 @@ def get_child_pages(page_id):
     
     return child_page_ids
 
+@metrics.timed('notion_fetch_seconds', function='get_block_children')
 def get_block_children(block_id):
     """Получает дочерние блоки для указанного блока с пагинацией"""
     all_blocks = []
     start_cursor = None
     
     while True:
-        url = f"https://api.notion.com/v1/blocks/{block_id}/children"
+        url = f"{NOTION_API_URL}/blocks/{block_id}/children"
         headers = {
             "Authorization": f"Bearer {NOTION_TOKEN}",
             "Content-Type": "application/json",
@@ -112,6 +120,7 @@ def get_block_children(block_id):
                 break
                 
         except urllib.error.HTTPError as e:
+            metrics.inc('notion_request_errors_total', status=e.code)
             if e.code == 404:
                 return []
             return []
@@ -120,13 +129,14 @@ def get_block_children(block_id):
     
     return all_blocks
 
+@metrics.timed('notion_fetch_seconds', function='get_page_content')
 def get_page_content(page_id):
     """Получает все блоки страницы с пагинацией"""
     all_blocks = []
     start_cursor = None
     
     while True:
-        url = f"https://api.notion.com/v1/blocks/{page_id}/children"
+        url = f"{NOTION_API_URL}/blocks/{page_id}/children"
         headers = {
             "Authorization": f"Bearer {NOTION_TOKEN}",
             "Content-Type": "application/json",
@@ -156,6 +166,7 @@ def get_page_content(page_id):
                 break
                 
         except urllib.error.HTTPError as e:
+            metrics.inc('notion_request_errors_total', status=e.code)
             if e.code == 404:
                 return []
             print(f"⚠️  Ошибка при получении содержимого страницы {page_id}: HTTP {e.code}")
@@ -230,13 +241,14 @@ def extract_status(page):
             return status_data.get('name')
     return None
 
+@metrics.timed('notion_fetch_seconds', function='fetch_all_vacancies')
 def fetch_all_vacancies():
     """Получает все вакансии из базы данных с пагинацией"""
     all_pages = []
     start_cursor = None
     
     while True:
-        url = f"https://api.notion.com/v1/databases/{DATABASE_ID}/query"
+        url = f"{NOTION_API_URL}/databases/{DATABASE_ID}/query"
         headers = {
             "Authorization": f"Bearer {NOTION_TOKEN}",
             "Content-Type": "application/json",
@@ -272,6 +284,7 @@ def fetch_all_vacancies():
                 break
                 
         except urllib.error.HTTPError as e:
+            metrics.inc('notion_request_errors_total', status=e.code)
             print(f"❌ Ошибка HTTP {e.code}")
             try:
                 error_data = json.loads(e.read().decode('utf-8'))
@@ -286,7 +299,11 @@ def fetch_all_vacancies():
     return all_pages
 
 def main():
-    output_file = sys.argv[1] if len(sys.argv) > 1 else 'vacancies.json'
+    parser = argparse.ArgumentParser(description='Получение вакансий из Notion')
+    parser.add_argument('output_file', nargs='?', default='vacancies.json', help='Файл для сохранения')
+    parser.add_argument('--metrics', help='Сохранить метрики запуска (JSON или .prom)')
+    args = parser.parse_args()
+    output_file = args.output_file
     
     print(f"📥 Получение вакансий из Notion...")
     pages = fetch_all_vacancies()
@@ -342,6 +359,8 @@ def main():
     print(f"\n📋 По статусам:")
     for status, count in sorted(status_counts.items()):
         print(f"  {status}: {count}")
+    
+    metrics.write_report(args.metrics)
 
 if __name__ == "__main__":
     main()
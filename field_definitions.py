@@ -1,6 +1,7 @@
 """
 Единый файл с константами для всех полей матчинга.
 Используется в analyze_candidates.py, process_with_gpt.py и vacancy_matcher.py.
+Таблицы синонимов и validate_record — для нормализации ответов GPT.
 """
 
 # =============================================================================
@@ -77,10 +78,190 @@ CONTRACT_TYPE = ["UMOWA O PRACĘ", "UMOWA ZLECENIE", "B2B"]
 # =============================================================================
 ROUTE_TYPE = ["внутренние", "международные"]
 
+# =============================================================================
+# РЕГИОНЫ РАБОТЫ (базовый список, только русские названия)
+# Notion создаёт новые опции автоматически, поэтому список не закрытый
+# =============================================================================
+WORK_REGIONS = [
+    "Польша", "По всей Европе", "Скандинавия", "Великобритания", "Германия",
+    "Франция", "Италия", "Испания", "Бенилюкс", "Чехия", "Словакия", "Австрия",
+    "Венгрия", "Литва", "Латвия", "Эстония", "Словения", "Греция", "Болгария",
+    "Дания", "Швеция", "Финляндия", "Норвегия", "Швейцария", "Румыния",
+    "Хорватия", "Босния", "Сербия", "Восточная Европа", "Западная Европа",
+    "Нидерланды", "Бельгия", "Люксембург", "Португалия",
+]
+
+# =============================================================================
+# СИНОНИМЫ (из filter-fields-basic.md и промптов)
+# Ключи сравниваются без учёта регистра и лишних пробелов
+# =============================================================================
+LICENSE_SYNONYMS = {
+    "C+E": "CE",
+    "C + E": "CE",
+    "C/E": "CE",
+    "С+Е": "CE",
+    "С/Е": "CE",
+    "СЕ": "CE",   # кириллица
+    "В": "B",     # кириллица
+    "С": "C",     # кириллица
+    "С1": "C1",   # кириллица
+    "Д": "D",
+    "Д1": "D1",
+}
+
+VEHICLE_SYNONYMS = {
+    "Тентованный": "Тент",
+    "тентованная": "Тент",
+    "firanka": "Тент",
+    "Реф": "Реф (рефрижератор)",
+    "рефрижератор": "Реф (рефрижератор)",
+    "холодильник": "Реф (рефрижератор)",
+    "chłodnia": "Реф (рефрижератор)",
+    "контейнер": "Контейнеры",
+    "контейнеровоз": "Контейнеры",
+    "изотермический": "Изотерма",
+    "шторный": "Штора",
+}
+
+CREW_SYNONYMS = {
+    "семейный": "парный",
+    "семейный экипаж": "парный",
+    "парный экипаж": "парный",
+    "в двойке": "парный",
+    "два водителя": "парный",
+    "муж и жена": "парный",
+    "одиночный": "соло",
+    "один водитель": "соло",
+    "solo": "соло",
+}
+
+REQUIREMENT_SYNONYMS = {
+    "Желательно, но не обязательно": "Желательно",
+    "Обязателен": "Обязательно",
+    "Обязательна": "Обязательно",
+    "Желателен": "Желательно",
+    "Желательна": "Желательно",
+}
+
+PAYMENT_SYNONYMS = {
+    "Поденная ставка": "Поденная",
+    "дниówka": "Поденная",
+    "за день": "Поденная",
+    "в день": "Поденная",
+    "Ежемесячная": "Месячная",
+    "Раз в месяц": "Месячная",
+    "в месяц": "Месячная",
+    "за месяц": "Месячная",
+    "месячная зарплата": "Месячная",
+}
+
+CURRENCY_SYNONYMS = {
+    "zł": "PLN",
+    "зл": "PLN",
+    "злотых": "PLN",
+    "польских злотых": "PLN",
+    "€": "EUR",
+    "евро": "EUR",
+    "euro": "EUR",
+}
+
+CONTRACT_SYNONYMS = {
+    "Трудовой договор": "UMOWA O PRACĘ",
+    "umowa o prace": "UMOWA O PRACĘ",
+    "UOP": "UMOWA O PRACĘ",
+    "UZ": "UMOWA ZLECENIE",
+}
+
+# Польские названия и общие обозначения Европы → русские названия
+REGION_SYNONYMS = {
+    "по всей Европе": "По всей Европе",
+    "вся Европа": "По всей Европе",
+    "Европа": "По всей Европе",
+    "по Европе": "По всей Европе",
+    "по ЕС": "По всей Европе",
+    "ЕС": "По всей Европе",
+    "EU": "По всей Европе",
+    "UE": "По всей Европе",
+    "Polska": "Польша",
+    "Niemcy": "Германия",
+    "Francja": "Франция",
+    "Anglia": "Великобритания",
+    "Wielka Brytania": "Великобритания",
+    "Англия": "Великобритания",
+    "Włochy": "Италия",
+    "Hiszpania": "Испания",
+    "Czechy": "Чехия",
+    "Słowacja": "Словакия",
+    "Austria": "Австрия",
+    "Węgry": "Венгрия",
+    "Litwa": "Литва",
+    "Łotwa": "Латвия",
+    "Estonia": "Эстония",
+    "Holandia": "Нидерланды",
+    "Belgia": "Бельгия",
+    "Dania": "Дания",
+    "Szwecja": "Швеция",
+    "Norwegia": "Норвегия",
+    "Finlandia": "Финляндия",
+    "Szwajcaria": "Швейцария",
+    "Rumunia": "Румыния",
+    "Skandynawia": "Скандинавия",
+    "Benelux": "Бенилюкс",
+}
+
 # =============================================================================
 # ФУНКЦИИ ВАЛИДАЦИИ
 # =============================================================================
 
+def _lookup_key(value):
+    """Ключ для поиска в таблице: без учёта регистра и лишних пробелов."""
+    return ' '.join(value.split()).casefold()
+
+
+def build_lookup(allowed_values, synonyms=None):
+    """
+    Строит таблицу {ключ: каноничное значение} для O(1) нормализации.
+    Синонимы добавляются после допустимых значений и не перекрывают их.
+    """
+    lookup = {}
+    for allowed in allowed_values:
+        if isinstance(allowed, str):
+            lookup[_lookup_key(allowed)] = allowed
+    for synonym, canonical in (synonyms or {}).items():
+        lookup.setdefault(_lookup_key(synonym), canonical)
+    return lookup
+
+
+# Предкомпилированные таблицы для всех перечислимых полей.
+# Ключ — id списка допустимых значений, чтобы validate_value работал
+# с теми же константами, что передаются в схемы ответа GPT.
+_LOOKUPS = {
+    id(LICENSE_CATEGORIES): (LICENSE_CATEGORIES, build_lookup(LICENSE_CATEGORIES, LICENSE_SYNONYMS)),
+    id(DOCUMENT_STATUS): (DOCUMENT_STATUS, build_lookup(DOCUMENT_STATUS)),
+    id(REQUIREMENT_LEVEL): (REQUIREMENT_LEVEL, build_lookup(REQUIREMENT_LEVEL, REQUIREMENT_SYNONYMS)),
+    id(CREW_TYPE): (CREW_TYPE, build_lookup(CREW_TYPE, CREW_SYNONYMS)),
+    id(POLISH_LEVEL): (POLISH_LEVEL, build_lookup(POLISH_LEVEL)),
+    id(POLISH_REQUIREMENT): (POLISH_REQUIREMENT, build_lookup(POLISH_REQUIREMENT, REQUIREMENT_SYNONYMS)),
+    id(VEHICLE_TYPES): (VEHICLE_TYPES, build_lookup(VEHICLE_TYPES, VEHICLE_SYNONYMS)),
+    id(PAYMENT_TYPE): (PAYMENT_TYPE, build_lookup(PAYMENT_TYPE, PAYMENT_SYNONYMS)),
+    id(SALARY_CURRENCY): (SALARY_CURRENCY, build_lookup(SALARY_CURRENCY, CURRENCY_SYNONYMS)),
+    id(CONTRACT_TYPE): (CONTRACT_TYPE, build_lookup(CONTRACT_TYPE, CONTRACT_SYNONYMS)),
+    id(ROUTE_TYPE): (ROUTE_TYPE, build_lookup(ROUTE_TYPE)),
+    id(WORK_REGIONS): (WORK_REGIONS, build_lookup(WORK_REGIONS, REGION_SYNONYMS)),
+}
+
+
+def get_lookup(allowed_values):
+    """Возвращает предкомпилированную таблицу для списка допустимых значений."""
+    cached = _LOOKUPS.get(id(allowed_values))
+    if cached is not None and cached[0] is allowed_values:
+        return cached[1]
+    # Произвольный список (не из констант выше) — строим таблицу на лету
+    lookup = build_lookup(allowed_values)
+    _LOOKUPS[id(allowed_values)] = (allowed_values, lookup)
+    return lookup
+
+
 def validate_value(value, allowed_values, field_name):
     """
     Проверяет, что значение входит в список допустимых.
@@ -89,30 +270,102 @@ def validate_value(value, allowed_values, field_name):
     if value is None:
         return None, None
     
+    lookup = get_lookup(allowed_values)
+    
     if isinstance(value, list):
         warnings = []
         valid_values = []
         for v in value:
-            normalized, warn = validate_value(v, allowed_values, field_name)
-            if normalized is not None:
+            normalized, warn = _validate_scalar(v, lookup, allowed_values, field_name)
+            if normalized is not None and normalized not in valid_values:
                 valid_values.append(normalized)
             if warn:
                 warnings.append(warn)
         return valid_values, warnings if warnings else None
     
-    # Проверяем точное совпадение
-    if value in allowed_values:
-        return value, None
+    return _validate_scalar(value, lookup, allowed_values, field_name)
+
+
+def _validate_scalar(value, lookup, allowed_values, field_name):
+    if value is None:
+        return None, None
     
-    # Проверяем без учёта регистра
-    value_lower = value.lower() if isinstance(value, str) else value
-    for allowed in allowed_values:
-        if isinstance(allowed, str) and allowed.lower() == value_lower:
-            return allowed, f"Нормализовано '{value}' → '{allowed}' в поле {field_name}"
+    if isinstance(value, str):
+        normalized = lookup.get(_lookup_key(value))
+        if normalized == value:
+            return value, None
+        if normalized is not None:
+            return normalized, f"Нормализовано '{value}' → '{normalized}' в поле {field_name}"
+    elif value in allowed_values:
+        return value, None
     
     return None, f"Неожиданное значение '{value}' в поле {field_name}. Допустимые: {allowed_values}"
 
 
+# =============================================================================
+# СХЕМЫ ПОЛЕЙ (поле → список допустимых значений)
+# Поля, которых нет в схеме, не проверяются (свободный текст, числа)
+# =============================================================================
+CANDIDATE_PROFILE_FIELDS = {
+    "work_permit_status": DOCUMENT_STATUS,
+    "code_95_status": DOCUMENT_STATUS,
+    "adr_status": DOCUMENT_STATUS,
+    "driver_card_status": DOCUMENT_STATUS,
+    "license_categories": LICENSE_CATEGORIES,
+    "polish_language": POLISH_LEVEL,
+    "crew_type": CREW_TYPE,
+    "preferred_vehicle_types": VEHICLE_TYPES,
+    "route_type_preference": ROUTE_TYPE,
+    "salary_currency": SALARY_CURRENCY,
+}
+
+VACANCY_FIELDS = {
+    "Категория прав": LICENSE_CATEGORIES,
+    "Тип техники": VEHICLE_TYPES,
+    "Код 95": REQUIREMENT_LEVEL,
+    "ADR": REQUIREMENT_LEVEL,
+    "Тип оплаты": PAYMENT_TYPE,
+    "Валюта зарплаты": SALARY_CURRENCY,
+    "Тип договора": CONTRACT_TYPE,
+    "Карта водителя": REQUIREMENT_LEVEL,
+    "Тип экипажа": CREW_TYPE,
+    "Требование польского языка": POLISH_REQUIREMENT,
+}
+
+
+def validate_record(record, field_schema):
+    """
+    Проверяет и нормализует все перечислимые поля записи за один проход.
+    Возвращает (normalized_record, warnings, invalid) — исходная запись не
+    изменяется; warnings — сообщения о нормализации синонимов, invalid —
+    [(поле, значение)] для значений не из списка (в normalized_record отброшены).
+    """
+    normalized = dict(record)
+    warnings = []
+    invalid = []
+    for field_name, allowed_values in field_schema.items():
+        value = record.get(field_name)
+        if value is None:
+            continue
+        lookup = get_lookup(allowed_values)
+        valid_values = []
+        for item in (value if isinstance(value, list) else [value]):
+            item_value, warn = _validate_scalar(item, lookup, allowed_values, field_name)
+            if item_value is None:
+                if item is not None:
+                    invalid.append((field_name, item))
+                continue
+            if warn:
+                warnings.append(warn)
+            if item_value not in valid_values:
+                valid_values.append(item_value)
+        if isinstance(value, list):
+            normalized[field_name] = valid_values
+        else:
+            normalized[field_name] = valid_values[0] if valid_values else None
+    return normalized, warnings, invalid
+
+
 def normalize_for_comparison(value):
     """Нормализация значения для сравнения (приведение к нижнему регистру)."""
     if not value:
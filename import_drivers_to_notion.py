@@ -4,7 +4,26 @@
 
   python3 import_drivers_to_notion.py              # импортировать всех
   python3 import_drivers_to_notion.py --batch-size 10
-  python3 import_drivers_to_notion.py --force      # принудительно обновить всех
+  python3 import_drivers_to_notion.py --force      # сверить свойства всех записей
+  python3 import_drivers_to_notion.py --metrics import_metrics.json
+  python3 import_drivers_to_notion.py --from-db    # потоково из pipeline.db
+  python3 import_drivers_to_notion.py --rate 3 --workers 10
+
+Запросы к Notion идут через общий ограничитель частоты (rate_limit.py,
+--rate запросов в секунду, 429 — пауза по Retry-After и повтор). Каждый
+водитель — отдельная задача asyncio: обновление свойств и переписки идут
+одновременно, старые блоки переписки удаляются параллельно, а в работе
+держится --workers водителей без барьеров между батчами, поэтому время
+импорта близко к (число запросов ÷ лимит).
+
+Обновление отправляет только свойства, отличающиеся от текущих значений
+страницы (зеркало из fetch_all_drivers, notion_properties.py). Страница без
+отличий не трогается и с --force, поэтому полная пересинхронизация после
+изменения схемы затрагивает только реально разные страницы.
+
+С --from-db результаты анализа и переписки читаются по одной записи из базы
+конвейера (pipeline_queue.py): в памяти только записи в работе, а не весь
+candidate_analysis.json и user_data_tiktok.json.
 """
 
 import json
@@ -13,28 +32,37 @@ import sys
 import argparse
 import urllib.request
 import urllib.error
-import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-import phonenumbers
-from phonenumbers import NumberParseException
+
+import metrics
+from chat_model import ChatMessages
+from rate_limit import RateLimiter, NOTION_RATE, retry_after_seconds
+from notion_properties import mirror_properties, diff_properties
+from driver_index import DriverIndex, HANDLE, format_phone_number, normalize_handle, load_merge_aliases, EXCLUDED_PHONE_NUMBERS
+from pipeline_queue import DB_FILE, ChatStore
 
 load_dotenv()
 
 NOTION_TOKEN = os.getenv('NOTION_TOKEN')
+# Переопределяется для локального стенда (fake_notion_server.py)
+NOTION_API_URL = os.getenv('NOTION_API_URL', 'https://api.notion.com/v1').rstrip('/')
 DRIVERS_DB_ID = '2ba95810-6f37-815e-86f2-ed07436ca6b0'
 CANDIDATE_ANALYSIS_FILE = 'candidate_analysis.json'
 TIKTOK_DATA_FILE = 'user_data_tiktok.json'
 BATCH_SIZE = 10
-
-# Черный список номеров (номер менеджера, который AI иногда парсит как номер кандидата)
-EXCLUDED_PHONE_NUMBERS = {
-    '+48573899403',
-    '+48 573 899 403',
-}
+# Попыток на запрос при ответе 429
+NOTION_MAX_ATTEMPTS = 5
+# Потоков для HTTP-запросов (urllib блокирующий) на одного водителя в работе
+HTTP_THREADS_PER_WORKER = 4
+# Notion ограничивает текст блока 2000 символами, берём с запасом
+CHAT_BLOCK_MAX_LEN = 1900
 
 # Кэш переписок
 _chat_history_cache = None
+# Общий лимит запросов к Notion на процесс (--rate)
+notion_limiter = RateLimiter(NOTION_RATE)
 
 if not NOTION_TOKEN:
     print("❌ Ошибка: переменная окружения NOTION_TOKEN не установлена")
@@ -42,7 +70,7 @@ if not NOTION_TOKEN:
 
 
 def load_chat_history_cache():
-    """Загружает все переписки из user_data_tiktok.json"""
+    """Загружает все переписки из user_data_tiktok.json (ChatMessages, старые сначала)"""
     global _chat_history_cache
     if _chat_history_cache is not None:
         return _chat_history_cache
@@ -61,33 +89,49 @@ def load_chat_history_cache():
     for key, messages in chat_history.items():
         if key.startswith("Chat History with ") and key.endswith(":"):
             chat_name = key[len("Chat History with "):-1]
-            _chat_history_cache[chat_name] = messages
+            # Сортируем по дате один раз при загрузке
+            ordered = sorted(messages, key=lambda m: m.get('Date', ''))
+            _chat_history_cache[chat_name] = ChatMessages.from_tiktok(ordered, newest_first=False)
     
     return _chat_history_cache
 
 
-def get_chat_text(chat_name):
-    """Возвращает переписку как текст для Notion"""
-    cache = load_chat_history_cache()
-    messages = cache.get(chat_name, [])
+def cached_chat_messages(candidate):
+    """Переписка кандидата из user_data_tiktok.json (источник переписок по умолчанию)"""
+    return load_chat_history_cache().get(candidate.get('chatName', ''))
+
+
+def format_chat_text(messages):
+    """Переписка (ChatMessages) как текст для Notion"""
     if not messages:
         return None
     
-    # Сортируем по дате (старые сначала)
-    sorted_msgs = sorted(messages, key=lambda m: m.get('Date', ''))
-    
-    lines = []
-    for msg in sorted_msgs:
-        date = msg.get('Date', '')
-        author = msg.get('From', '')
-        content = msg.get('Content', '')
-        lines.append(f"[{date}] {author}: {content}")
+    lines = [
+        f"[{date}] {author}: {content}"
+        for date, author, content in zip(messages.times, messages.authors, messages.texts)
+    ]
     
     return "\n\n".join(lines)
 
 
+def get_chat_text(chat_name):
+    """Возвращает переписку как текст для Notion"""
+    return format_chat_text(load_chat_history_cache().get(chat_name))
+
+
+def _endpoint_label(endpoint):
+    """'/blocks/<id>/children?page_size=100' → '/blocks/{id}/children' (для метрик)"""
+    parts = endpoint.split('?')[0].strip('/').split('/')
+    return '/' + '/'.join(part if idx % 2 == 0 else '{id}' for idx, part in enumerate(parts))
+
+
 def notion_request(method, endpoint, data=None):
-    url = f"https://api.notion.com/v1{endpoint}"
+    return notion_request_status(method, endpoint, data)[0]
+
+
+def notion_request_status(method, endpoint, data=None):
+    """Как notion_request, но возвращает (ответ, HTTP-статус); при ошибке ответ — None"""
+    url = f"{NOTION_API_URL}{endpoint}"
     headers = {
         "Authorization": f"Bearer {NOTION_TOKEN}",
         "Content-Type": "application/json",
@@ -95,19 +139,29 @@ def notion_request(method, endpoint, data=None):
     }
     
     json_data = json.dumps(data).encode('utf-8') if data else None
-    req = urllib.request.Request(url, data=json_data, headers=headers, method=method)
+    label = _endpoint_label(endpoint)
     
-    try:
-        with urllib.request.urlopen(req) as response:
-            return json.loads(response.read().decode('utf-8'))
-    except urllib.error.HTTPError as e:
-        error_body = e.read().decode('utf-8')
+    for attempt in range(1, NOTION_MAX_ATTEMPTS + 1):
+        notion_limiter.acquire()
+        req = urllib.request.Request(url, data=json_data, headers=headers, method=method)
         try:
-            error_data = json.loads(error_body)
-            print(f"❌ Notion API Error: {error_data.get('message', error_body)}")
-        except:
-            print(f"❌ Notion API Error: HTTP {e.code} - {error_body}")
-        return None
+            with metrics.timer('notion_request_seconds', method=method, endpoint=label):
+                with urllib.request.urlopen(req) as response:
+                    return json.loads(response.read().decode('utf-8')), response.status
+        except urllib.error.HTTPError as e:
+            metrics.inc('notion_request_errors_total', method=method, endpoint=label, status=e.code)
+            if e.code == 429 and attempt < NOTION_MAX_ATTEMPTS:
+                # Пауза для всех запросов процесса, не только для этого
+                notion_limiter.penalize(retry_after_seconds(e, attempt))
+                e.close()
+                continue
+            error_body = e.read().decode('utf-8')
+            try:
+                error_data = json.loads(error_body)
+                print(f"❌ Notion API Error: {error_data.get('message', error_body)}")
+            except:
+                print(f"❌ Notion API Error: HTTP {e.code} - {error_body}")
+            return None, e.code
 
 
 def get_page_blocks(page_id):
@@ -121,219 +175,109 @@ def delete_block(block_id):
     return notion_request("DELETE", f"/blocks/{block_id}")
 
 
-def update_page_chat(page_id, chat_name):
-    """Обновляет переписку на странице — удаляет старую, добавляет новую"""
-    chat_text = get_chat_text(chat_name)
-    if not chat_text:
-        return
-    
-    # Удаляем старые блоки переписки (ищем по заголовку)
-    blocks = get_page_blocks(page_id)
-    chat_blocks_to_delete = []
-    in_chat_section = False
-    for block in blocks:
-        if block.get("type") == "heading_3":
-            rich_text = block.get("heading_3", {}).get("rich_text", [])
-            if rich_text and rich_text[0].get("text", {}).get("content", "").startswith("💬 Переписка"):
-                in_chat_section = True
-                chat_blocks_to_delete.append(block["id"])
-            else:
-                # Если мы были в секции переписки и встретили другой заголовок - выходим
-                if in_chat_section:
-                    break
-        elif in_chat_section:
-            # Удаляем все блоки после заголовка переписки до следующего заголовка
-            chat_blocks_to_delete.append(block["id"])
-    
-    # Удаляем все найденные блоки
-    for block_id in chat_blocks_to_delete:
-        delete_block(block_id)
-    
-    # Notion ограничивает текст блока до 2000 символов, разбиваем если надо
-    MAX_LEN = 1900
-    text_chunks = []
-    
-    # Разбиваем по сообщениям (каждое сообщение разделено \n\n)
-    parts = chat_text.split("\n\n")
+def split_chat_text(chat_text, max_len=CHAT_BLOCK_MAX_LEN):
+    """
+    Разбивает переписку на куски не длиннее max_len (лимит текста блока Notion).
+    Сообщения (разделены \n\n) склеиваются, пока влезают; слишком длинное
+    сообщение режется по max_len символов.
+    """
+    chunks = []
     current = ""
     
-    for part in parts:
-        # Если часть сама по себе больше лимита, разбиваем её на несколько чанков
-        if len(part) > MAX_LEN:
-            # Сохраняем текущий чанк, если он есть
+    for part in chat_text.split("\n\n"):
+        if len(part) > max_len:
             if current:
-                # Проверяем перед добавлением
-                if len(current) > MAX_LEN:
-                    # Разбиваем current если он превышает лимит
-                    while len(current) > MAX_LEN:
-                        text_chunks.append(current[:MAX_LEN])
-                        current = current[MAX_LEN:]
-                else:
-                    text_chunks.append(current)
-                current = ""
-            
-            # Разбиваем большую часть на чанки по MAX_LEN символов
-            while len(part) > MAX_LEN:
-                text_chunks.append(part[:MAX_LEN])
-                part = part[MAX_LEN:]
-            # Остаток добавляем к current
-            if part:
-                current = part
+                chunks.append(current)
+            while len(part) > max_len:
+                chunks.append(part[:max_len])
+                part = part[max_len:]
+            current = part
             continue
         
-        # Пробуем добавить часть к текущему чанку
-        separator = "\n\n" if current else ""
-        potential = current + separator + part
-        
-        if len(potential) <= MAX_LEN:
-            # Влезает - добавляем
+        potential = f"{current}\n\n{part}" if current else part
+        if len(potential) <= max_len:
             current = potential
         else:
-            # Не влезает - сохраняем текущий чанк и начинаем новый
             if current:
-                # Проверяем перед добавлением
-                if len(current) > MAX_LEN:
-                    # Разбиваем current если он превышает лимит
-                    while len(current) > MAX_LEN:
-                        text_chunks.append(current[:MAX_LEN])
-                        current = current[MAX_LEN:]
-                else:
-                    text_chunks.append(current)
+                chunks.append(current)
             current = part
     
-    # Добавляем последний чанк, если он есть
     if current:
-        # Проверяем перед добавлением
-        if len(current) > MAX_LEN:
-            # Разбиваем current если он превышает лимит
-            while len(current) > MAX_LEN:
-                text_chunks.append(current[:MAX_LEN])
-                current = current[MAX_LEN:]
-            if current:
-                text_chunks.append(current)
-        else:
-            text_chunks.append(current)
-    
-    # Финальная проверка: гарантируем, что все чанки не превышают лимит
-    safe_chunks = []
-    for chunk in text_chunks:
-        if len(chunk) <= MAX_LEN:
-            safe_chunks.append(chunk)
-        else:
-            # Если чанк всё ещё превышает лимит (не должно быть, но на всякий случай)
-            while len(chunk) > MAX_LEN:
-                safe_chunks.append(chunk[:MAX_LEN])
-                chunk = chunk[MAX_LEN:]
-            if chunk:
-                safe_chunks.append(chunk)
-    
-    # Дополнительная проверка: убеждаемся, что все чанки точно не превышают лимит
-    text_chunks = []
-    for chunk in safe_chunks:
-        if len(chunk) > MAX_LEN:
-            # Это критическая ошибка - разбиваем принудительно
-            while len(chunk) > MAX_LEN:
-                text_chunks.append(chunk[:MAX_LEN])
-                chunk = chunk[MAX_LEN:]
-            if chunk:
-                text_chunks.append(chunk)
-        else:
-            text_chunks.append(chunk)
-    
-    # Создаём блоки
+        chunks.append(current)
+    return chunks
+
+
+def build_chat_blocks(chat_text, messages_count):
+    """Блоки секции переписки: заголовок и параграфы с кусками текста"""
     children = [
         {
             "object": "block",
             "type": "heading_3",
             "heading_3": {
-                "rich_text": [{"type": "text", "text": {"content": f"💬 Переписка ({len(load_chat_history_cache().get(chat_name, []))} сообщений)"}}]
+                "rich_text": [{"type": "text", "text": {"content": f"💬 Переписка ({messages_count} сообщений)"}}]
             }
         }
     ]
-    for chunk in text_chunks:
-        # Финальная проверка: гарантируем, что chunk не превышает лимит
-        # Если chunk превышает лимит, разбиваем его на части
-        if len(chunk) > MAX_LEN:
-            # Разбиваем на части по MAX_LEN
-            while len(chunk) > MAX_LEN:
-                children.append({
-                    "object": "block",
-                    "type": "paragraph",
-                    "paragraph": {
-                        "rich_text": [{"type": "text", "text": {"content": chunk[:MAX_LEN]}}]
-                    }
-                })
-                chunk = chunk[MAX_LEN:]
-            # Добавляем остаток, если он есть (с проверкой)
-            if chunk:
-                if len(chunk) > MAX_LEN:
-                    # Если остаток всё ещё большой, разбиваем дальше
-                    while len(chunk) > MAX_LEN:
-                        children.append({
-                            "object": "block",
-                            "type": "paragraph",
-                            "paragraph": {
-                                "rich_text": [{"type": "text", "text": {"content": chunk[:MAX_LEN]}}]
-                            }
-                        })
-                        chunk = chunk[MAX_LEN:]
-                if chunk:
-                    children.append({
-                        "object": "block",
-                        "type": "paragraph",
-                        "paragraph": {
-                            "rich_text": [{"type": "text", "text": {"content": chunk}}]
-                        }
-                    })
-        else:
-            # Chunk в пределах лимита - но проверяем на всякий случай
-            if len(chunk) > MAX_LEN:
-                # Если всё же превышает, разбиваем
-                while len(chunk) > MAX_LEN:
-                    children.append({
-                        "object": "block",
-                        "type": "paragraph",
-                        "paragraph": {
-                            "rich_text": [{"type": "text", "text": {"content": chunk[:MAX_LEN]}}]
-                        }
-                    })
-                    chunk = chunk[MAX_LEN:]
-                if chunk:
-                    children.append({
-                        "object": "block",
-                        "type": "paragraph",
-                        "paragraph": {
-                            "rich_text": [{"type": "text", "text": {"content": chunk}}]
-                        }
-                    })
+    for chunk in split_chat_text(chat_text):
+        children.append({
+            "object": "block",
+            "type": "paragraph",
+            "paragraph": {
+                "rich_text": [{"type": "text", "text": {"content": chunk}}]
+            }
+        })
+    return children
+
+
+def find_chat_blocks(blocks):
+    """id блоков секции переписки: заголовок «💬 Переписка» и всё до следующего заголовка"""
+    chat_blocks = []
+    in_chat_section = False
+    for block in blocks:
+        if block.get("type") == "heading_3":
+            rich_text = block.get("heading_3", {}).get("rich_text", [])
+            if rich_text and rich_text[0].get("text", {}).get("content", "").startswith("💬 Переписка"):
+                in_chat_section = True
+                chat_blocks.append(block["id"])
             else:
-                children.append({
-                    "object": "block",
-                    "type": "paragraph",
-                    "paragraph": {
-                        "rich_text": [{"type": "text", "text": {"content": chunk}}]
-                    }
-                })
-    
-    # Добавляем на страницу
-    notion_request("PATCH", f"/blocks/{page_id}/children", {"children": children})
+                # Если мы были в секции переписки и встретили другой заголовок - выходим
+                if in_chat_section:
+                    break
+        elif in_chat_section:
+            # Удаляем все блоки после заголовка переписки до следующего заголовка
+            chat_blocks.append(block["id"])
+    return chat_blocks
 
 
-def format_phone_number(phone):
+@metrics.timed('update_page_chat_seconds')
+async def update_page_chat_async(page_id, chat_name, messages=None, new_page=False):
     """
-    Форматирует и валидирует номер телефона для Notion API.
-    Возвращает номер в формате E.164 или None, если номер невалиден.
+    Обновляет переписку на странице — удаляет старую, добавляет новую.
+    messages — ChatMessages; по умолчанию берётся из user_data_tiktok.json.
+    На только что созданной странице (new_page) удалять нечего — блоки не читаются.
+    Возвращает ответ Notion на добавление блоков (None — ошибка) или True,
+    если записывать нечего.
     """
-    if not phone:
-        return None
+    if messages is None:
+        messages = load_chat_history_cache().get(chat_name)
+    chat_text = format_chat_text(messages)
+    if not chat_text:
+        return True
     
-    try:
-        parsed_number = phonenumbers.parse(phone, 'PL')
-        if not phonenumbers.is_valid_number(parsed_number):
-            return None
-        return phonenumbers.format_number(parsed_number, phonenumbers.PhoneNumberFormat.E164)
-    except NumberParseException:
-        return None
+    if not new_page:
+        # Старые блоки переписки удаляются параллельно (ограничивает notion_limiter)
+        blocks = await asyncio.to_thread(get_page_blocks, page_id)
+        chat_blocks_to_delete = find_chat_blocks(blocks)
+        await asyncio.gather(*(
+            asyncio.to_thread(delete_block, block_id) for block_id in chat_blocks_to_delete
+        ))
+        metrics.inc('chat_blocks_deleted_total', len(chat_blocks_to_delete))
+    
+    children = build_chat_blocks(chat_text, len(messages))
+    metrics.inc('chat_blocks_appended_total', len(children))
+    
+    # Добавляем на страницу
+    return await asyncio.to_thread(notion_request, "PATCH", f"/blocks/{page_id}/children", {"children": children})
 
 
 def get_candidate_stage(checklist):
@@ -470,6 +414,7 @@ def build_page_properties(candidate, is_update=False):
 
 
 def create_driver_page(database_id, candidate):
+    """POST новой страницы. Возвращает (страница или None, HTTP-статус)"""
     props = build_page_properties(candidate)
     
     data = {
@@ -477,17 +422,64 @@ def create_driver_page(database_id, candidate):
         "properties": props
     }
     
-    return notion_request("POST", "/pages", data)
+    return notion_request_status("POST", "/pages", data)
 
 
-def update_driver_page(page_id, candidate):
-    props = build_page_properties(candidate, is_update=True)
+def update_driver_page(page_id, candidate, properties=None):
+    """PATCH свойств страницы: properties (только изменённые) или все из кандидата"""
+    props = properties if properties is not None else build_page_properties(candidate, is_update=True)
     return notion_request("PATCH", f"/pages/{page_id}", {"properties": props})
 
 
+def driver_entry(page):
+    """Запись DriverIndex для страницы из ответа API или None, если у страницы нет ника"""
+    properties = mirror_properties(page.get("properties", {}))
+    # Ник: TikTok Nickname, иначе заголовок или ссылка на профиль (нормализует DriverIndex)
+    nickname = properties.get("TikTok Nickname") or properties.get("Name") or properties.get("TikTok URL")
+    if not nickname:
+        return None
+    return {
+        "page_id": page["id"],
+        "nickname": nickname,
+        "phone": properties.get("Номер телефона"),
+        "messagesCount": properties.get("messagesCount") or 0,
+        "properties": properties
+    }
+
+
+def find_driver_page(database_id, nickname):
+    """Ищет в базе страницу водителя по нику (запрос с фильтром). Запись DriverIndex или None"""
+    data = {
+        "filter": {"or": [
+            {"property": "TikTok Nickname", "rich_text": {"equals": nickname}},
+            {"property": "Name", "title": {"equals": nickname}},
+        ]},
+        "page_size": 100
+    }
+    while True:
+        result = notion_request("POST", f"/databases/{database_id}/query", data)
+        if not result:
+            return None
+        for page in result.get("results", []):
+            entry = driver_entry(page)
+            if entry and normalize_handle(entry["nickname"]) == normalize_handle(nickname):
+                return entry
+        if not result.get("has_more"):
+            return None
+        data["start_cursor"] = result.get("next_cursor")
+
+
+@metrics.timed('notion_fetch_seconds', function='fetch_all_drivers')
 def fetch_all_drivers(database_id):
-    """Загружает все записи из базы и возвращает словарь {nickname: {page_id, messagesCount}}"""
-    drivers = {}
+    """
+    Загружает все записи из базы и возвращает DriverIndex — словарь
+    {nickname: {page_id, nickname, phone, messagesCount, properties}} с поиском
+    по нормализованному нику и телефону; properties — зеркало текущих значений
+    свойств (notion_properties.mirror_properties). Страницы с повторяющимся
+    ником не перетирают первую, а попадают в drivers.duplicates(). Ники из
+    журнала слияний dedupe_drivers.py — псевдонимы оставшихся страниц.
+    """
+    drivers = DriverIndex()
     start_cursor = None
     
     while True:
@@ -500,51 +492,166 @@ def fetch_all_drivers(database_id):
             break
         
         for page in result.get("results", []):
-            nickname_prop = page.get("properties", {}).get("TikTok Nickname", {}).get("rich_text", [])
-            if nickname_prop:
-                nickname = nickname_prop[0].get("text", {}).get("content", "")
-            else:
-                title_prop = page.get("properties", {}).get("Name", {}).get("title", [])
-                nickname = title_prop[0].get("text", {}).get("content", "") if title_prop else ""
-            
-            if nickname:
-                messages_count = page.get("properties", {}).get("messagesCount", {}).get("number", 0) or 0
-                drivers[nickname] = {
-                    "page_id": page["id"],
-                    "messagesCount": messages_count
-                }
+            entry = driver_entry(page)
+            if entry:
+                drivers.add(entry)
         
         if not result.get("has_more"):
             break
         start_cursor = result.get("next_cursor")
     
+    # Ники слитых страниц (dedupe_drivers.py) ведут на оставшуюся, а не к созданию новой
+    drivers.add_aliases(load_merge_aliases())
+    
     return drivers
 
 
-def upsert_driver(database_id, candidate, existing_drivers, force=False):
-    """Создаёт или обновляет запись водителя. Возвращает (result, action, info)"""
+async def upsert_driver_async(database_id, candidate, existing_drivers, force=False, chat_source=cached_chat_messages):
+    """
+    Создаёт или обновляет запись водителя. Возвращает (result, action, info).
+    chat_source(candidate) → ChatMessages: откуда брать переписку; вызывается,
+    только если страницу действительно нужно записать.
+    Страница создаётся один раз на ник: пока её создаёт другая задача или поток,
+    эта ждёт (existing_drivers.creating) и затем обновляет созданную.
+    Ник слитой страницы (dedupe_drivers.py) пропускается с пометкой в info.
+    """
     chat_name = candidate.get('chatName', '')
     current_messages = candidate.get('messagesCount', 0)
     
-    if chat_name in existing_drivers:
-        existing = existing_drivers[chat_name]
-        existing_messages = existing.get('messagesCount', 0)
-        
-        if not force and current_messages == existing_messages:
-            return None, "skipped", None
-        
-        result = update_driver_page(existing['page_id'], candidate)
-        if result:
-            update_page_chat(existing['page_id'], chat_name)
-        return result, "updated", None
-    else:
-        result = create_driver_page(database_id, candidate)
-        if result and result.get('id'):
-            update_page_chat(result['id'], chat_name)
-        return result, "created", None
-
-
-def import_drivers(database_id, batch_size=None, force=False):
+    if existing_drivers.is_alias(chat_name):
+        # Ник слит с другой страницей (dedupe_drivers.py оставляет страницу ника,
+        # в котором идёт переписка) — её ведёт переписка оставшегося ника
+        metrics.inc('driver_alias_hits_total')
+        return None, "skipped", f"слит с @{existing_drivers[chat_name]['nickname']}"
+    
+    while chat_name not in existing_drivers:
+        owner, pending = existing_drivers.creating.claim(chat_name)
+        if not owner:
+            await asyncio.wrap_future(pending)
+            continue
+        try:
+            return await create_driver_async(database_id, candidate, existing_drivers, chat_source)
+        finally:
+            existing_drivers.creating.release(chat_name, pending)
+    
+    existing = existing_drivers[chat_name]
+    existing_messages = existing.get('messagesCount', 0)
+    
+    if not force and current_messages == existing_messages:
+        return None, "skipped", None
+    
+    # Только отличающиеся свойства; без отличий страница не трогается даже с --force
+    changed = diff_properties(build_page_properties(candidate, is_update=True), existing.get('properties', {}))
+    if not changed:
+        return None, "skipped", None
+    metrics.inc('notion_properties_patched_total', len(changed))
+    
+    # Переписка перезаписывается, только если изменилось число сообщений, и до
+    # свойств: messagesCount на странице меняется, лишь когда переписка записана,
+    # иначе следующий запуск счёл бы её актуальной
+    page_id = existing['page_id']
+    if current_messages != existing_messages:
+        chat = await update_page_chat_async(page_id, chat_name, chat_source(candidate) or ChatMessages())
+        if not chat:
+            return None, "updated", "переписка не записана"
+    result = await asyncio.to_thread(update_driver_page, page_id, candidate, changed)
+    if result:
+        existing['messagesCount'] = current_messages
+        existing.setdefault('properties', {}).update(mirror_properties(changed))
+    return result, "updated", None
+
+
+async def create_driver_async(database_id, candidate, existing_drivers, chat_source=cached_chat_messages):
+    """
+    Создаёт страницу и сразу записывает её в existing_drivers. Вызывается
+    только владельцем ника в existing_drivers.creating.
+    Если прошлое создание оборвалось без ответа или с 408/5xx, страница могла
+    появиться — сначала она ищется в базе, и при находке дописывается только
+    переписка.
+    """
+    chat_name = candidate.get('chatName', '')
+    
+    if existing_drivers.creating.take_uncertain(chat_name):
+        entry = await asyncio.to_thread(find_driver_page, database_id, chat_name)
+        if entry:
+            metrics.inc('notion_create_recovered_total')
+            existing_drivers.add(entry)
+            await write_created_chat(entry, chat_name, chat_source(candidate) or ChatMessages(), new_page=False)
+            return {"id": entry["page_id"]}, "created", None
+    
+    try:
+        result, status = await asyncio.to_thread(create_driver_page, database_id, candidate)
+    except Exception:
+        # Ответа нет — страница могла создаться; повтор начнётся с поиска
+        existing_drivers.creating.mark_uncertain(chat_name)
+        raise
+    if result is None and (status == 408 or status >= 500):
+        # Таймаут шлюза или ошибка сервера: Notion мог успеть создать страницу
+        existing_drivers.creating.mark_uncertain(chat_name)
+    
+    if result and result.get('id'):
+        entry = driver_entry(result) or {"page_id": result["id"], "nickname": chat_name, "properties": {}}
+        entry["messagesCount"] = candidate.get('messagesCount', 0)
+        existing_drivers.add(entry)
+        await write_created_chat(entry, chat_name, chat_source(candidate) or ChatMessages(), new_page=True)
+    return result, "created", None
+
+
+async def write_created_chat(entry, chat_name, messages, new_page):
+    """Переписка новой страницы; если не записалась — повтор обновит страницу вместе с ней"""
+    try:
+        written = await update_page_chat_async(entry["page_id"], chat_name, messages, new_page=new_page)
+    except Exception:
+        written = None
+        raise
+    finally:
+        if not written:
+            entry["messagesCount"] = None
+            entry["properties"].pop("messagesCount", None)
+
+
+def upsert_driver(database_id, candidate, existing_drivers, force=False, chat_source=cached_chat_messages):
+    """Синхронная версия upsert_driver_async (для вызова из потока)"""
+    return asyncio.run(upsert_driver_async(database_id, candidate, existing_drivers, force, chat_source))
+
+
+async def run_upserts(database_id, candidates, existing_drivers, force=False,
+                      chat_source=cached_chat_messages, workers=BATCH_SIZE):
+    """
+    Импорт кандидатов из итератора: в работе до workers водителей, следующий
+    берётся, как только освободилось место. Частоту запросов ограничивает
+    notion_limiter. Возвращает счётчики {created, updated, skipped, errors}.
+    """
+    workers = max(1, workers)
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=workers * HTTP_THREADS_PER_WORKER)
+    )
+    if chat_source is cached_chat_messages:
+        # Разбор всего экспорта TikTok — до первого upsert и не в потоке цикла событий
+        await asyncio.to_thread(load_chat_history_cache)
+    counts = {"created": 0, "updated": 0, "skipped": 0, "errors": 0}
+    slots = asyncio.Semaphore(workers)
+    tasks = set()
+    
+    async def run_one(candidate):
+        try:
+            outcome = await upsert_driver_async(database_id, candidate, existing_drivers, force, chat_source)
+        except Exception as e:
+            outcome = e
+        finally:
+            slots.release()
+        counts[report_upsert(candidate, outcome)] += 1
+    
+    for candidate in candidates:
+        await slots.acquire()
+        task = asyncio.create_task(run_one(candidate))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    await asyncio.gather(*tasks)
+    return counts
+
+
+def import_drivers(database_id, batch_size=None, force=False, workers=BATCH_SIZE):
     if not os.path.exists(CANDIDATE_ANALYSIS_FILE):
         print(f"❌ Файл {CANDIDATE_ANALYSIS_FILE} не найден")
         return
@@ -559,67 +666,124 @@ def import_drivers(database_id, batch_size=None, force=False):
         print(f"📦 Лимит: {batch_size}")
     
     if force:
-        print("🔄 Режим принудительного обновления: все записи будут обновлены")
+        print("🔄 Режим принудительного обновления: свойства всех записей будут сверены, отправятся только отличия")
     
     print("🔍 Загружаем существующие записи из Notion...")
     existing_drivers = fetch_all_drivers(database_id)
     print(f"📋 Найдено {len(existing_drivers)} существующих записей")
+    print_duplicates(existing_drivers)
     
-    print(f"\n🚀 Импорт {len(candidates)} водителей (батчи по {BATCH_SIZE})...")
+    print(f"\n🚀 Импорт {len(candidates)} водителей ({workers} одновременно, {format_rate()})...")
     
-    created = 0
-    updated = 0
-    skipped = 0
-    errors = 0
-    total = len(candidates)
+    counts = asyncio.run(run_upserts(database_id, candidates, existing_drivers, force, workers=workers))
+    print_import_summary(counts)
+
+
+def report_upsert(candidate, outcome):
+    """
+    Печатает и учитывает в метриках итог upsert_driver_async
+    (кортеж или исключение). Возвращает ключ счётчика.
+    """
+    chat_name = candidate.get('chatName', 'unknown')
+    if isinstance(outcome, Exception):
+        metrics.inc('drivers_total', action="error")
+        print(f"  ❌ {chat_name}: {outcome}")
+        return "errors"
+    
+    result, action, info = outcome
+    metrics.inc('drivers_total', action=action if result or action == "skipped" else "error")
+    if action == "skipped":
+        if info:
+            print(f"  ⏭️  {chat_name} ({info})")
+        return "skipped"
+    if action == "created" and result:
+        print(f"  ✅ {chat_name} (создан)")
+        return "created"
+    if action == "updated" and result:
+        print(f"  🔄 {chat_name} (обновлён)")
+        return "updated"
+    print(f"  ❌ {chat_name}{f' ({info})' if info else ''}")
+    return "errors"
+
+
+def print_duplicates(drivers, limit=10):
+    """Предупреждение о страницах с одинаковым ником или телефоном"""
+    duplicates = drivers.duplicates()
+    if not duplicates:
+        return
+    print(f"⚠️  Дубликаты в Notion: {len(duplicates)} (обновляется первая страница)")
+    for kind, key, entries in duplicates[:limit]:
+        label = "ник" if kind == HANDLE else "телефон"
+        print(f"  {label} {key}: {', '.join(entry['nickname'] for entry in entries)}")
+    if len(duplicates) > limit:
+        print(f"  ... и ещё {len(duplicates) - limit}")
+    print("  Слить дубликаты: python3 dedupe_drivers.py")
+
+
+def print_import_summary(counts):
+    print(f"\n📊 Результат: ✅ создано {counts['created']} / 🔄 обновлено {counts['updated']} / "
+          f"⏭️  без изменений {counts['skipped']} / ❌ ошибок {counts['errors']}")
+
+
+def format_rate():
+    return f"до {notion_limiter.rate:g} запросов/сек" if notion_limiter.rate else "без лимита запросов"
+
+
+def import_from_store(database_id, db_path, limit=None, force=False, workers=BATCH_SIZE):
+    """
+    Потоковый импорт из базы конвейера: записи читаются курсором по одной,
+    переписка загружается только для записей, которые пишутся в Notion.
+    """
+    if not os.path.exists(db_path):
+        print(f"❌ База {db_path} не найдена")
+        return
     
-    for batch_start in range(0, total, BATCH_SIZE):
-        batch = candidates[batch_start:batch_start + BATCH_SIZE]
-        batch_num = batch_start // BATCH_SIZE + 1
-        total_batches = (total + BATCH_SIZE - 1) // BATCH_SIZE
-        
-        print(f"\n📦 Батч {batch_num}/{total_batches}...")
-        
-        with ThreadPoolExecutor(max_workers=BATCH_SIZE) as executor:
-            futures = {
-                executor.submit(upsert_driver, database_id, c, existing_drivers, force): c 
-                for c in batch
-            }
-            
-            for future in as_completed(futures):
-                candidate = futures[future]
-                chat_name = candidate.get('chatName', 'unknown')
-                
-                try:
-                    result, action, info = future.result()
-                    if action == "skipped":
-                        skipped += 1
-                    elif action == "created" and result:
-                        print(f"  ✅ {chat_name} (создан)")
-                        created += 1
-                    elif action == "updated" and result:
-                        print(f"  🔄 {chat_name} (обновлён)")
-                        updated += 1
-                    else:
-                        print(f"  ❌ {chat_name}")
-                        errors += 1
-                except Exception as e:
-                    print(f"  ❌ {chat_name}: {e}")
-                    errors += 1
-        
-        if batch_start + BATCH_SIZE < total:
-            time.sleep(1)
+    store = ChatStore(db_path)
+    total = store.count_results()
+    if limit:
+        total = min(total, limit)
+    print(f"📥 В базе {db_path}: {total} результатов анализа")
+    
+    if force:
+        print("🔄 Режим принудительного обновления: свойства всех записей будут сверены, отправятся только отличия")
     
-    print(f"\n📊 Результат: ✅ создано {created} / 🔄 обновлено {updated} / ⏭️  без изменений {skipped} / ❌ ошибок {errors}")
+    print("🔍 Загружаем существующие записи из Notion...")
+    existing_drivers = fetch_all_drivers(database_id)
+    print(f"📋 Найдено {len(existing_drivers)} существующих записей")
+    print_duplicates(existing_drivers)
+    
+    print(f"\n🚀 Потоковый импорт {total} водителей ({workers} одновременно, {format_rate()})...")
+    
+    try:
+        counts = asyncio.run(run_upserts(
+            database_id, store.iter_results(limit), existing_drivers, force, store.messages, workers
+        ))
+    finally:
+        store.close()
+    print_import_summary(counts)
 
 
 def main():
     parser = argparse.ArgumentParser(description='Импорт водителей в Notion')
     parser.add_argument('--batch-size', type=int, help='Количество записей для импорта')
-    parser.add_argument('--force', action='store_true', help='Принудительно обновить все записи, даже если количество сообщений не изменилось')
+    parser.add_argument('--force', action='store_true', help='Сравнить свойства всех записей, даже если количество сообщений не изменилось (отправляются только отличия)')
+    parser.add_argument('--metrics', help='Сохранить метрики запуска (JSON или .prom)')
+    parser.add_argument('--from-db', nargs='?', const=DB_FILE, metavar='FILE',
+                        help=f'Потоковый импорт из базы конвейера (по умолчанию: {DB_FILE})')
+    parser.add_argument('--workers', type=int, default=BATCH_SIZE, help='Водителей в работе одновременно')
+    parser.add_argument('--rate', type=float, default=NOTION_RATE,
+                        help=f'Лимит запросов к Notion в секунду (по умолчанию: {NOTION_RATE:g}, 0 = без лимита)')
     
     args = parser.parse_args()
-    import_drivers(DRIVERS_DB_ID, args.batch_size, args.force)
+    global notion_limiter
+    notion_limiter = RateLimiter(args.rate)
+    try:
+        if args.from_db:
+            import_from_store(DRIVERS_DB_ID, args.from_db, args.batch_size, args.force, args.workers)
+        else:
+            import_drivers(DRIVERS_DB_ID, args.batch_size, args.force, args.workers)
+    finally:
+        metrics.write_report(args.metrics)
 
 
 if __name__ == "__main__":
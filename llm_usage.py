@@ -0,0 +1,207 @@
+"""
+Учёт токенов и стоимости вызовов OpenAI.
+
+usage_from_response() достаёт из ответа prompt/completion/cached токены,
+UsageTracker суммирует их за запуск, считает стоимость по PRICING_PER_1M
+и следит за бюджетом (--budget-usd): после превышения новые вызовы не запускаются,
+уже отправленные запросы завершаются (перерасход — не больше одного батча).
+"""
+
+import json
+import hashlib
+import threading
+
+import metrics
+
+# Цены USD за 1M токенов (input, cached input, output)
+PRICING_PER_1M = {
+    'gpt-4o-mini': {'input': 0.15, 'cached_input': 0.075, 'output': 0.60},
+}
+DEFAULT_MODEL = 'gpt-4o-mini'
+# Оценка длины без токенизатора: в русском тексте ~3 символа на токен
+CHARS_PER_TOKEN = 3
+
+
+def _price(model):
+    for name, price in PRICING_PER_1M.items():
+        # Ответ содержит версию модели: gpt-4o-mini-2024-07-18
+        if model == name or (model or '').startswith(name + '-'):
+            return price
+    return PRICING_PER_1M[DEFAULT_MODEL]
+
+
+def usage_cost(prompt_tokens, completion_tokens, cached_tokens, model=DEFAULT_MODEL):
+    """Стоимость вызова в USD (закэшированные токены входа дешевле)"""
+    price = _price(model)
+    uncached = max(prompt_tokens - cached_tokens, 0)
+    return (
+        uncached * price['input']
+        + cached_tokens * price['cached_input']
+        + completion_tokens * price['output']
+    ) / 1_000_000
+
+
+def estimate_tokens(text):
+    """Грубая оценка числа токенов текста (для упаковки нескольких записей в запрос)"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def pack_by_tokens(items, texts, pack_tokens, max_items, keys=None):
+    """
+    Жадно группирует записи по порядку для упаковки в один запрос: в группе
+    не больше pack_tokens (оценка по texts) и max_items записей, ключи keys
+    в группе не повторяются. Запись длиннее лимита идёт отдельной группой.
+    """
+    groups = []
+    current = []
+    current_tokens = 0
+    current_keys = set()
+    for idx, item in enumerate(items):
+        tokens = estimate_tokens(texts[idx])
+        key = keys[idx] if keys is not None else idx
+        if current and (current_tokens + tokens > pack_tokens or len(current) >= max_items or key in current_keys):
+            groups.append(current)
+            current, current_tokens, current_keys = [], 0, set()
+        current.append(item)
+        current_tokens += tokens
+        current_keys.add(key)
+    if current:
+        groups.append(current)
+    return groups
+
+
+def prefix_fingerprint(system_prompt, response_format):
+    """
+    Хэш статического префикса запроса (системный промпт + схема ответа).
+    Одинаковый хэш между запусками — префикс байт в байт тот же и попадает в кэш.
+    """
+    payload = json.dumps([system_prompt, response_format], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def usage_from_response(response, latency_seconds):
+    """Словарь usage для записи в результат: токены, задержка, модель, стоимость"""
+    usage = getattr(response, 'usage', None)
+    prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+    completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached_tokens = getattr(details, 'cached_tokens', 0) or 0
+    model = getattr(response, 'model', None) or DEFAULT_MODEL
+    return {
+        'model': model,
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'cached_tokens': cached_tokens,
+        'latency_seconds': round(latency_seconds, 3),
+        'cost_usd': round(usage_cost(prompt_tokens, completion_tokens, cached_tokens, model), 6),
+    }
+
+
+def combine_usage(usages):
+    """Сумма usage нескольких попыток одного вызова (повторы, repair-промпт)"""
+    if len(usages) == 1:
+        return usages[0]
+    return {
+        'model': usages[-1]['model'],
+        **{key: sum(usage[key] for usage in usages) for key in ('prompt_tokens', 'completion_tokens', 'cached_tokens')},
+        'latency_seconds': round(sum(usage['latency_seconds'] for usage in usages), 3),
+        'cost_usd': round(sum(usage['cost_usd'] for usage in usages), 6),
+        'attempts': len(usages),
+    }
+
+
+def split_usage(usage, weights):
+    """
+    Делит usage одного запроса с несколькими записями между ними пропорционально
+    weights (например, длине текста). Задержка у всех общая, packed — размер пачки.
+    """
+    total = sum(weights) or 1
+    parts = []
+    for weight in weights:
+        share = weight / total
+        part = {
+            key: round(usage[key] * share) for key in ('prompt_tokens', 'completion_tokens', 'cached_tokens')
+        }
+        parts.append({
+            'model': usage['model'],
+            **part,
+            'latency_seconds': usage['latency_seconds'],
+            'cost_usd': round(usage['cost_usd'] * share, 6),
+            'packed': len(weights),
+        })
+    return parts
+
+
+class UsageTracker:
+    """Сумма usage за запуск (потокобезопасно) и проверка бюджета"""
+
+    def __init__(self, script, budget_usd=None, prefix_hash=None):
+        self.script = script
+        self.budget_usd = budget_usd
+        self.prefix_hash = prefix_hash
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.cost_usd = 0.0
+        self.latencies = []
+        self.models = {}
+
+    def add(self, usage):
+        with self.lock:
+            self.calls += 1
+            self.prompt_tokens += usage['prompt_tokens']
+            self.completion_tokens += usage['completion_tokens']
+            self.cached_tokens += usage['cached_tokens']
+            self.cost_usd += usage['cost_usd']
+            self.latencies.append(usage['latency_seconds'])
+            self.models[usage['model']] = self.models.get(usage['model'], 0) + 1
+
+        metrics.inc('openai_tokens_total', usage['prompt_tokens'], script=self.script, kind='prompt')
+        metrics.inc('openai_tokens_total', usage['completion_tokens'], script=self.script, kind='completion')
+        metrics.inc('openai_tokens_total', usage['cached_tokens'], script=self.script, kind='cached')
+        metrics.inc('openai_cost_usd_total', usage['cost_usd'], script=self.script)
+
+    def budget_exceeded(self):
+        if self.budget_usd is None:
+            return False
+        with self.lock:
+            return self.cost_usd >= self.budget_usd
+
+    def report(self):
+        with self.lock:
+            ordered = sorted(self.latencies)
+            return {
+                'script': self.script,
+                'calls': self.calls,
+                'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens,
+                'cached_tokens': self.cached_tokens,
+                'cache_hit_ratio': round(self.cached_tokens / self.prompt_tokens, 4) if self.prompt_tokens else 0.0,
+                'cost_usd': round(self.cost_usd, 6),
+                'budget_usd': self.budget_usd,
+                'avg_prompt_tokens': round(self.prompt_tokens / self.calls, 1) if self.calls else 0,
+                'latency_p50_seconds': metrics.percentile(ordered, 50),
+                'latency_p95_seconds': metrics.percentile(ordered, 95),
+                'models': dict(self.models),
+                'prefix_hash': self.prefix_hash,
+            }
+
+    def print_summary(self):
+        report = self.report()
+        if not report['calls']:
+            return
+        print(f"\n💰 Использование OpenAI:")
+        print(f"  Вызовов: {report['calls']}")
+        print(f"  Токены: вход {report['prompt_tokens']} (из кэша {report['cached_tokens']}, "
+              f"{report['cache_hit_ratio']:.0%}), выход {report['completion_tokens']}")
+        print(f"  Стоимость: ${report['cost_usd']:.4f}" + (f" из ${report['budget_usd']:g}" if report['budget_usd'] is not None else ""))
+        print(f"  Задержка: p50 {report['latency_p50_seconds']} с, p95 {report['latency_p95_seconds']} с")
+
+    def write(self, path):
+        if not path:
+            return
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+        print(f"💾 Отчёт об использовании: {path}")
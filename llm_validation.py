@@ -0,0 +1,286 @@
+"""
+Проверка ответов GPT и повторы с классификацией ошибок.
+
+Ответ проверяется по JSON Schema запроса (validate_schema) и по спискам
+допустимых значений field_definitions (check_enums). Ошибки делятся на классы:
+  - transient — сеть, таймаут, 429, 5xx: повтор с экспоненциальной задержкой
+    (учитывается Retry-After);
+  - schema — ответ не разобрался или не прошёл проверку: один повтор
+    с repair-промптом (ответ + список ошибок);
+  - permanent — ошибка конкретной записи (400, фильтр контента):
+    без повторов, запись в dead-letter файл (DeadLetter);
+  - fatal — ошибка всего запуска (401 — ключ, 403 — доступ, 404 — модель):
+    исключение LLMRunAborted, запуск останавливается, карантин не пишется —
+    иначе туда попали бы все записи запуска.
+
+    data = await call_with_retries_async(request, validate, script='analyze_candidates')
+
+request(repair_messages) выполняет запрос (repair_messages добавляются после
+сообщения пользователя) и возвращает разобранный JSON; validate(data) —
+список ошибок. Исчерпанные попытки — исключение LLMCallFailed.
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+from datetime import datetime
+
+import openai
+
+import metrics
+from field_definitions import validate_record
+
+TRANSIENT = 'transient'
+SCHEMA = 'schema'
+PERMANENT = 'permanent'
+FATAL = 'fatal'
+
+# Попыток на transient-ошибки (включая первую)
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+# Сколько ошибок проверки показывать модели в repair-промпте
+REPAIR_MAX_ERRORS = 20
+
+_JSON_TYPES = {
+    'object': dict,
+    'array': list,
+    'string': str,
+    'boolean': bool,
+    'null': type(None),
+}
+
+
+class SchemaValidationError(Exception):
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('; '.join(errors[:3]) + (f" (+{len(errors) - 3})" if len(errors) > 3 else ''))
+
+
+class LLMCallFailed(Exception):
+    def __init__(self, error_class, message, attempts):
+        self.error_class = error_class
+        self.attempts = attempts
+        super().__init__(message)
+
+
+class LLMRunAborted(Exception):
+    """Ошибка, после которой продолжать запуск бессмысленно (ключ, доступ, модель)"""
+
+
+def _type_matches(value, json_type):
+    if json_type == 'integer':
+        return isinstance(value, int) and not isinstance(value, bool)
+    if json_type == 'number':
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return isinstance(value, _JSON_TYPES.get(json_type, object))
+
+
+def validate_schema(value, schema, path='$'):
+    """Проверка по подмножеству JSON Schema из Structured Outputs. Возвращает список ошибок"""
+    errors = []
+    types = schema.get('type')
+    if types is not None:
+        types = types if isinstance(types, list) else [types]
+        if not any(_type_matches(value, json_type) for json_type in types):
+            return [f"{path}: ожидался тип {'|'.join(types)}, получено {type(value).__name__}"]
+
+    if 'enum' in schema and value not in schema['enum']:
+        errors.append(f"{path}: значение {value!r} не из списка допустимых")
+
+    if isinstance(value, dict):
+        properties = schema.get('properties', {})
+        for name in schema.get('required', []):
+            if name not in value:
+                errors.append(f"{path}.{name}: обязательное поле отсутствует")
+        for name, item in value.items():
+            if name in properties:
+                errors.extend(validate_schema(item, properties[name], f"{path}.{name}"))
+            elif schema.get('additionalProperties') is False:
+                errors.append(f"{path}.{name}: лишнее поле")
+    elif isinstance(value, list) and 'items' in schema:
+        for idx, item in enumerate(value):
+            errors.extend(validate_schema(item, schema['items'], f"{path}[{idx}]"))
+    return errors
+
+
+def check_enums(record, field_schema):
+    """
+    Проверка перечислимых полей по field_definitions (field_schema — например,
+    CANDIDATE_PROFILE_FIELDS). Синонимы нормализуются и ошибкой не считаются.
+    Возвращает (нормализованная запись, ошибки).
+    """
+    normalized, _, invalid = validate_record(record, field_schema)
+    return normalized, [f"{field_name}: недопустимое значение {item!r}" for field_name, item in invalid]
+
+
+def classify_error(error):
+    """Класс ошибки вызова: TRANSIENT, SCHEMA, PERMANENT или FATAL"""
+    if isinstance(error, (SchemaValidationError, json.JSONDecodeError)):
+        return SCHEMA
+    # Ответ обрезан по длине или не разобран клиентом (openai>=1.40)
+    if type(error).__name__ in ('LengthFinishReasonError', 'APIResponseValidationError', 'ValidationError'):
+        return SCHEMA
+    if isinstance(error, (openai.AuthenticationError, openai.PermissionDeniedError, openai.NotFoundError)):
+        return FATAL
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return TRANSIENT
+    if isinstance(error, openai.APIStatusError) and (error.status_code in (408, 409) or error.status_code >= 500):
+        return TRANSIENT
+    return PERMANENT
+
+
+def backoff_delay(attempt, error=None):
+    """Задержка перед повтором attempt (1, 2, ...): Retry-After или экспонента с джиттером"""
+    response = getattr(error, 'response', None)
+    retry_after = getattr(response, 'headers', {}).get('retry-after') if response is not None else None
+    try:
+        if retry_after is not None:
+            return min(float(retry_after), BACKOFF_MAX)
+    except ValueError:
+        pass
+    return min(BACKOFF_BASE * 2 ** (attempt - 1), BACKOFF_MAX) * random.uniform(0.5, 1.0)
+
+
+def repair_messages(previous, errors):
+    """Сообщения для повтора после ошибки проверки: прошлый ответ и что в нём не так"""
+    messages = []
+    if previous is not None:
+        messages.append({"role": "assistant", "content": json.dumps(previous, ensure_ascii=False)})
+    listed = '\n'.join(f"- {error}" for error in errors[:REPAIR_MAX_ERRORS])
+    messages.append({
+        "role": "user",
+        "content": f"Ответ не прошёл проверку:\n{listed}\n\nИсправь ошибки и верни полный ответ строго по схеме."
+    })
+    return messages
+
+
+class _RetryState:
+    """Общая логика повторов для sync и async версий"""
+
+    def __init__(self, script, max_attempts):
+        self.script = script
+        self.max_attempts = max_attempts
+        self.attempt = 0
+        self.repair = None
+        self.repaired = False
+
+    def on_error(self, error, previous=None):
+        """Возвращает задержку перед повтором или бросает LLMCallFailed / LLMRunAborted"""
+        error_class = classify_error(error)
+        metrics.inc('openai_call_errors_total', script=self.script, error_class=error_class)
+        if error_class == FATAL:
+            raise LLMRunAborted(f"{type(error).__name__}: {error}") from error
+        if error_class == TRANSIENT and self.attempt < self.max_attempts:
+            metrics.inc('openai_retries_total', script=self.script, error_class=error_class)
+            return backoff_delay(self.attempt, error)
+        if error_class == SCHEMA and not self.repaired:
+            metrics.inc('openai_retries_total', script=self.script, error_class=error_class)
+            self.repaired = True
+            errors = error.errors if isinstance(error, SchemaValidationError) else [str(error)]
+            self.repair = repair_messages(previous, errors)
+            return 0
+        raise LLMCallFailed(error_class, f"{error_class}: {error}", self.attempt) from error
+
+
+def call_with_retries(request, validate, script, max_attempts=MAX_ATTEMPTS):
+    """Синхронный вызов request с проверкой ответа и повторами (см. модуль)"""
+    state = _RetryState(script, max_attempts)
+    while True:
+        state.attempt += 1
+        data = None
+        try:
+            data = request(state.repair)
+            errors = validate(data)
+            if errors:
+                raise SchemaValidationError(errors)
+            return data
+        except Exception as e:
+            delay = state.on_error(e, data)
+        if delay:
+            time.sleep(delay)
+
+
+async def call_with_retries_async(request, validate, script, max_attempts=MAX_ATTEMPTS):
+    """Асинхронный вариант call_with_retries: request — корутина"""
+    state = _RetryState(script, max_attempts)
+    while True:
+        state.attempt += 1
+        data = None
+        try:
+            data = await request(state.repair)
+            errors = validate(data)
+            if errors:
+                raise SchemaValidationError(errors)
+            return data
+        except Exception as e:
+            delay = state.on_error(e, data)
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class DeadLetter:
+    """
+    Файл карантина (JSON Lines): записи, которые не удалось обработать
+    без ручного вмешательства. Такие записи пропускаются в следующих
+    запусках, пока их не удалят из файла или не запустят с --retry-dead-letter.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def load(self):
+        """{ключ: последняя запись карантина}"""
+        entries = {}
+        if not self.path:
+            return entries
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return entries
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+                entries[entry['key']] = entry
+            except (json.JSONDecodeError, KeyError):
+                # Оборванная строка прерванного запуска (или правленная вручную) — не роняем запуск
+                where = "последняя строка" if number == len(lines) else "строка"
+                print(f"⚠️  {self.path}:{number}: {where} карантина не разобрана — пропущена")
+        return entries
+
+    def _ends_with_newline(self):
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() == 0:
+                    return True
+                f.seek(-1, os.SEEK_END)
+                return f.read(1) == b'\n'
+        except FileNotFoundError:
+            return True
+
+    def add(self, key, error_class, error, attempts=None, **extra):
+        if not self.path:
+            return
+        entry = {
+            'key': key,
+            'error_class': error_class,
+            'error': error,
+            'attempts': attempts,
+            'failed_at': datetime.now().isoformat(timespec='seconds'),
+            **extra,
+        }
+        with self.lock:
+            # Последняя строка оборвана (процесс убит во время записи) — новая запись с новой строки
+            prefix = '' if self._ends_with_newline() else '\n'
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(prefix + json.dumps(entry, ensure_ascii=False) + '\n')
+            self.count += 1
@@ -0,0 +1,211 @@
+"""
+Лёгкая инструментация скриптов: счётчики, таймеры и гистограммы.
+
+Метрики копятся в памяти процесса (потокобезопасно) и в конце запуска
+сохраняются в файл: *.prom / *.txt — текстовый формат Prometheus,
+иначе JSON (с p50/p95/p99 по последним наблюдениям).
+
+    import metrics
+
+    with metrics.timer('notion_request_seconds', method='POST'):
+        ...
+    metrics.inc('notion_request_errors_total', status=429)
+
+    @metrics.timed('openai_request_seconds', script='create_patches')
+    def call_openai_api(...): ...
+
+    metrics.write_report('run_metrics.json')
+"""
+
+import json
+import time
+import asyncio
+import functools
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+# Границы бакетов гистограмм (секунды)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Сколько последних наблюдений хранить для перцентилей в JSON
+MAX_SAMPLES = 10000
+
+
+def _series_key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def percentile(sorted_values, q):
+    """Перцентиль q (0–100) отсортированного списка по ближайшему рангу; None для пустого"""
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[idx]
+
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels) + list(extra or [])
+    if not pairs:
+        return ''
+    escaped = (f'{key}="{value}"'.replace('\n', ' ') for key, value in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.samples = deque(maxlen=MAX_SAMPLES)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.samples.append(value)
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[idx] += 1
+                break
+
+    def to_dict(self):
+        ordered = sorted(self.samples)
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'mean': round(self.sum / self.count, 6) if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': percentile(ordered, 50),
+            'p95': percentile(ordered, 95),
+            'p99': percentile(ordered, 99),
+        }
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+            self.started_at = datetime.now()
+            self.started = time.perf_counter()
+
+    def inc(self, name, value=1, **labels):
+        key = _series_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = _series_key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'started_at': self.started_at.isoformat(timespec='seconds'),
+                'duration_seconds': round(time.perf_counter() - self.started, 3),
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                'histograms': [
+                    {'name': name, 'labels': dict(labels), **histogram.to_dict()}
+                    for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0])
+                ],
+            }
+
+    def to_prometheus(self):
+        lines = []
+        with self.lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.bucket_counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram.count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+
+            lines.append("# TYPE run_duration_seconds gauge")
+            lines.append(f"run_duration_seconds {time.perf_counter() - self.started:.3f}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        if path.endswith(('.prom', '.txt')):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+
+
+REGISTRY = Registry()
+
+
+def inc(name, value=1, **labels):
+    """Увеличивает счётчик"""
+    REGISTRY.inc(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    """Добавляет наблюдение в гистограмму"""
+    REGISTRY.observe(name, value, **labels)
+
+
+@contextmanager
+def timer(name, **labels):
+    """Замеряет длительность блока в гистограмму name (секунды)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        REGISTRY.observe(name, time.perf_counter() - started, **labels)
+
+
+def timed(name, **labels):
+    """Декоратор: длительность каждого вызова функции (sync или async)"""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with timer(name, **labels):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(name, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def write_report(path):
+    """Сохраняет метрики запуска (ничего не делает, если path пустой)"""
+    if not path:
+        return
+    REGISTRY.write(path)
+    print(f"📈 Метрики сохранены: {path}")
@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+"""
+Миграция значений свойств между базами Notion по декларативной спецификации
+
+Спецификация (dict в скрипте-обёртке или JSON-файл):
+
+  {
+    "name": "driver_statuses",
+    "source": {"database_id": "...", "key": [{"property": "URL", "extract": "tiktok_username"}]},
+    "target": {"database_id": "...", "key": [{"property": "TikTok Nickname", "extract": "tiktok_username"},
+                                             {"property": "TikTok URL", "extract": "tiktok_username"}]},
+    "mappings": [
+      {"source": "Status", "target": "Status", "values": {"Ждет новые вакансии": "Ждет новых вакансий"}}
+    ]
+  }
+
+  key       — свойства для связи страниц: берётся первое непустое значение
+              (extract — KEY_EXTRACTORS: tiktok_username — ник из ника или
+              ссылки на профиль, phone — номер в E.164), без учёта регистра;
+              несколько целевых страниц с одним ключом попадают в отчёт
+  mappings  — какое свойство источника в какое свойство цели; тип цели
+              берётся со страницы, поддерживаются все типы notion_properties.
+              values — замена значений; значение не из values не переносится
+              и попадает в отчёт. Пустые значения источника не переносятся.
+
+ИСПОЛЬЗОВАНИЕ:
+  python3 notion_migrate.py SPEC.json [--dry-run] [--journal FILE] [--rate N] [--workers N]
+
+ПАРАМЕТРЫ:
+  --dry-run       Показать изменения по страницам, ничего не меняя
+  --journal FILE  Журнал применённых изменений (по умолчанию: <name>.journal.jsonl)
+  --rate N        Лимит запросов к Notion в секунду (по умолчанию: 3)
+  --workers N     Параллельных PATCH (по умолчанию: 8)
+
+В PATCH попадают только отличающиеся свойства; страницы без отличий не
+трогаются. Каждое применённое изменение дописывается в журнал (с прежними
+значениями): повторный запуск пропускает уже применённые изменения, даже
+если их потом поменяли вручную, поэтому прерванную миграцию можно просто
+запустить снова.
+"""
+
+import json
+import os
+import sys
+import time
+import argparse
+import threading
+import urllib.request
+import urllib.error
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+
+import metrics
+from rate_limit import RateLimiter, NOTION_RATE, retry_after_seconds
+from driver_index import normalize_handle, format_phone_number
+from notion_properties import (
+    TEXT_TYPES,
+    NAMED_TYPES,
+    MIRRORED_TYPES,
+    property_type,
+    property_value,
+    property_payload,
+)
+
+load_dotenv()
+
+NOTION_TOKEN = os.getenv('NOTION_TOKEN')
+# Переопределяется для локального стенда (fake_notion_server.py)
+NOTION_API_URL = os.getenv('NOTION_API_URL', 'https://api.notion.com/v1').rstrip('/')
+
+MAX_WORKERS = 8
+MAX_ATTEMPTS = 5
+# Сколько строк каждого раздела отчёта показывать (кроме изменений в --dry-run)
+REPORT_LIMIT = 10
+
+notion_limiter = RateLimiter(NOTION_RATE)
+
+if not NOTION_TOKEN:
+    print("❌ Ошибка: переменная окружения NOTION_TOKEN не установлена")
+    print("Создайте файл .env и добавьте NOTION_TOKEN=your_token")
+    sys.exit(1)
+
+
+# Преобразования значения свойства в ключ связи ("extract" в спецификации)
+KEY_EXTRACTORS = {
+    # Ник или ссылка на профиль → ник (driver_index.normalize_handle)
+    'tiktok_username': normalize_handle,
+    'phone': format_phone_number,
+}
+
+
+class MigrationError(Exception):
+    pass
+
+
+def notion_request(method, endpoint, data=None):
+    """Запрос к Notion через общий лимит. Возвращает (ответ, None) или (None, ошибка)"""
+    url = f"{NOTION_API_URL}{endpoint}"
+    headers = {
+        "Authorization": f"Bearer {NOTION_TOKEN}",
+        "Content-Type": "application/json",
+        "Notion-Version": "2022-06-28"
+    }
+    json_data = json.dumps(data).encode('utf-8') if data is not None else None
+
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        notion_limiter.acquire()
+        req = urllib.request.Request(url, data=json_data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(req) as response:
+                return json.loads(response.read().decode('utf-8')), None
+        except urllib.error.HTTPError as e:
+            metrics.inc('notion_request_errors_total', method=method, status=e.code)
+            if e.code == 429 and attempt < MAX_ATTEMPTS:
+                notion_limiter.penalize(retry_after_seconds(e, attempt))
+                e.close()
+                continue
+            error_msg = ''
+            try:
+                error_msg = json.loads(e.read().decode('utf-8')).get('message', '')
+            except Exception:
+                pass
+            return None, f"HTTP {e.code}: {error_msg}"
+        except Exception as e:
+            return None, str(e)
+    return None, 'Max retries exceeded'
+
+
+def page_key(properties, key_spec):
+    """Ключ связи страницы: первое непустое из key_spec, в нижнем регистре"""
+    for item in key_spec:
+        prop = properties.get(item['property'])
+        if not prop:
+            continue
+        value = property_value(prop)
+        extract = item.get('extract')
+        if extract:
+            value = KEY_EXTRACTORS[extract](value)
+        if value:
+            return str(value).strip().lower()
+    return None
+
+
+def fetch_pages(database_id, key_spec, property_names):
+    """
+    Все страницы базы: [{page_id, key, values, types}], где values/types —
+    значения и типы свойств property_names. Страницы без ключа пропускаются.
+    """
+    pages = []
+    start_cursor = None
+    while True:
+        data = {"page_size": 100}
+        if start_cursor:
+            data["start_cursor"] = start_cursor
+        result, error = notion_request("POST", f"/databases/{database_id}/query", data)
+        if error:
+            raise MigrationError(f"не удалось загрузить базу {database_id}: {error}")
+
+        for page in result.get('results', []):
+            properties = page.get('properties', {})
+            key = page_key(properties, key_spec)
+            if not key:
+                continue
+            pages.append({
+                'page_id': page['id'],
+                'key': key,
+                'values': {name: property_value(properties[name]) for name in property_names if name in properties},
+                'types': {name: property_type(properties[name]) for name in property_names if name in properties},
+            })
+
+        if not result.get('has_more'):
+            break
+        start_cursor = result.get('next_cursor')
+    return pages
+
+
+def coerce_value(value, target_type):
+    """Значение источника под тип свойства цели (например, multi_select → текст)"""
+    if isinstance(value, tuple) and (target_type in TEXT_TYPES or target_type in NAMED_TYPES):
+        return ', '.join(value) or None
+    if target_type == 'multi_select' and isinstance(value, str):
+        return (value,)
+    return value
+
+
+def map_value(value, mapping):
+    """Значение после замены по mapping['values']. (значение, ok); ok=False — нет в values"""
+    values = mapping.get('values')
+    if values is None:
+        return value, True
+    if isinstance(value, tuple):
+        mapped = tuple(values.get(item) for item in value)
+        if None in mapped:
+            return value, False
+        return tuple(sorted(mapped)), True
+    if isinstance(value, str) and value in values:
+        return values[value], True
+    return value, False
+
+
+class Journal:
+    """Журнал применённых изменений (JSON Lines): что, где, было → стало"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # Последняя строка оборвана (процесс убит во время записи) — следующая запись с новой строки
+        self.truncated = False
+
+    def load(self):
+        """{page_id: {свойство: применённое значение}}"""
+        applied = {}
+        if not os.path.exists(self.path):
+            return applied
+        with open(self.path, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # Строка, оборванная прерванным запуском (после дозаписи она уже не последняя)
+                print(f"⚠️  {self.path}:{number}: оборванная запись (прерванный запуск) — пропущена")
+                self.truncated = number == len(lines) and not line.endswith('\n')
+                continue
+            applied.setdefault(entry['page_id'], {}).update(entry['after'])
+        return applied
+
+    def add(self, change):
+        entry = {
+            'page_id': change['page_id'],
+            'key': change['key'],
+            'before': {name: before for name, (before, _) in change['properties'].items()},
+            'after': {name: after for name, (_, after) in change['properties'].items()},
+            'applied_at': datetime.now().isoformat(timespec='seconds'),
+        }
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                if self.truncated:
+                    f.write('\n')
+                    self.truncated = False
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+
+def _journal_value(value):
+    # В JSON кортежи становятся списками — сравниваем в одном виде
+    return list(value) if isinstance(value, tuple) else value
+
+
+def plan_migration(spec, source_pages, target_pages, applied=None):
+    """
+    Изменения для целевых страниц. Возвращает (changes, report):
+    changes — [{page_id, key, properties: {имя: (было, стало)}, payload}],
+    report — {matched, not_found, unmapped, already_applied, duplicates}.
+    Если у ключа несколько целевых страниц, изменяются все (и они в duplicates).
+    """
+    applied = applied or {}
+    targets_by_key = {}
+    for page in target_pages:
+        targets_by_key.setdefault(page['key'], []).append(page)
+
+    changes = []
+    report = {
+        'matched': 0, 'not_found': [], 'unmapped': [], 'already_applied': 0,
+        'duplicates': {key: len(pages) for key, pages in targets_by_key.items() if len(pages) > 1},
+    }
+    for source in source_pages:
+        targets = targets_by_key.get(source['key'])
+        if not targets:
+            report['not_found'].append(source)
+            continue
+        report['matched'] += 1
+
+        desired = {}
+        for mapping in spec['mappings']:
+            value = source['values'].get(mapping['source'])
+            if value is None or value == '' or value == ():
+                continue
+            value, ok = map_value(value, mapping)
+            if not ok:
+                report['unmapped'].append((source['key'], mapping['source'], value))
+                continue
+            desired[mapping['target']] = value
+
+        for target in targets:
+            properties = {}
+            payload = {}
+            for name, value in desired.items():
+                target_type = target['types'].get(name)
+                if target_type not in MIRRORED_TYPES:
+                    continue
+                value = coerce_value(value, target_type)
+                current = target['values'].get(name)
+                if current == value:
+                    continue
+                if applied.get(target['page_id'], {}).get(name, object()) == _journal_value(value):
+                    # Уже применено раньше и с тех пор изменено вручную — не перетираем
+                    report['already_applied'] += 1
+                    continue
+                properties[name] = (current, value)
+                payload[name] = property_payload(target_type, value)
+            if payload:
+                changes.append({
+                    'page_id': target['page_id'],
+                    'key': target['key'],
+                    'properties': properties,
+                    'payload': payload,
+                })
+    return changes, report
+
+
+def print_plan(changes, report, show_all):
+    print("📊 Результаты анализа:")
+    print(f"  Найдено совпадений: {report['matched']}")
+    print(f"  Требуется обновить: {len(changes)}")
+    print(f"  Не найдено в целевой базе: {len(report['not_found'])}")
+    if report['unmapped']:
+        print(f"  Значения без маппинга: {len(report['unmapped'])}")
+    if report['already_applied']:
+        print(f"  Уже применено раньше (журнал): {report['already_applied']}")
+    if report['duplicates']:
+        print(f"  Ключи с несколькими целевыми страницами: {len(report['duplicates'])}")
+    print()
+
+    if changes:
+        print("📝 Изменения:")
+        shown = changes if show_all else changes[:REPORT_LIMIT]
+        for change in shown:
+            diff = ', '.join(
+                f"{name}: {before!r} → {after!r}"
+                for name, (before, after) in change['properties'].items()
+            )
+            print(f"  @{change['key']}: {diff}")
+        if len(changes) > len(shown):
+            print(f"  ... и ещё {len(changes) - len(shown)}")
+        print()
+
+    if report['not_found']:
+        print("⚠️  Не найдены в целевой базе:")
+        for page in report['not_found'][:REPORT_LIMIT]:
+            print(f"  @{page['key']}")
+        if len(report['not_found']) > REPORT_LIMIT:
+            print(f"  ... и ещё {len(report['not_found']) - REPORT_LIMIT}")
+        print()
+
+    if report['duplicates']:
+        print("⚠️  Несколько целевых страниц с одним ключом (изменяются все):")
+        for key, count in list(report['duplicates'].items())[:REPORT_LIMIT]:
+            print(f"  @{key}: {count} страниц")
+        if len(report['duplicates']) > REPORT_LIMIT:
+            print(f"  ... и ещё {len(report['duplicates']) - REPORT_LIMIT}")
+        print()
+
+    if report['unmapped']:
+        print("⚠️  Значения без маппинга:")
+        for key, name, value in report['unmapped']:
+            print(f"  @{key}: {name} = {value!r}")
+        print()
+
+
+def apply_changes(changes, journal, workers=MAX_WORKERS):
+    """Параллельные PATCH через общий лимит; успешные изменения — в журнал"""
+    success_count = 0
+    errors = []
+    start_time = time.time()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(notion_request, "PATCH", f"/pages/{change['page_id']}", {"properties": change['payload']}): change
+            for change in changes
+        }
+        for completed, future in enumerate(as_completed(futures), 1):
+            change = futures[future]
+            result, error = future.result()
+            if error is None:
+                journal.add(change)
+                metrics.inc('migration_pages_total', result='updated')
+                print(f"  [{completed}/{len(changes)}] @{change['key']} ✅")
+                success_count += 1
+            else:
+                metrics.inc('migration_pages_total', result='error')
+                print(f"  [{completed}/{len(changes)}] @{change['key']} ❌ {error}")
+                errors.append((change['key'], error))
+
+    elapsed = time.time() - start_time
+    print("\n📊 Итоги:")
+    print(f"  Успешно обновлено: {success_count}")
+    if errors:
+        print(f"  Ошибки: {len(errors)}")
+    print(f"  Время выполнения: {elapsed:.1f} сек ({len(changes) / max(elapsed, 1e-9):.1f} req/sec)")
+
+    if errors:
+        print("\n⚠️  Ошибки при обновлении:")
+        for key, error in errors[:REPORT_LIMIT]:
+            print(f"  @{key}: {error}")
+        if len(errors) > REPORT_LIMIT:
+            print(f"  ... и ещё {len(errors) - REPORT_LIMIT}")
+
+
+def run_migration(spec, dry_run=False, journal_path=None, rate=NOTION_RATE, workers=MAX_WORKERS):
+    """Загружает обе базы, показывает изменения и (без dry_run) применяет их"""
+    global notion_limiter
+    notion_limiter = RateLimiter(rate)
+    journal = Journal(journal_path or f"{spec['name']}.journal.jsonl")
+
+    if dry_run:
+        print("🔍 Режим просмотра (--dry-run): изменения не будут внесены\n")
+
+    source_names = [mapping['source'] for mapping in spec['mappings']]
+    target_names = [mapping['target'] for mapping in spec['mappings']]
+    try:
+        print(f"📥 Загрузка исходной базы {spec['source']['database_id']}...")
+        source_pages = fetch_pages(spec['source']['database_id'], spec['source']['key'], source_names)
+        print(f"✅ Загружено {len(source_pages)} записей\n")
+
+        print(f"📥 Загрузка целевой базы {spec['target']['database_id']}...")
+        target_pages = fetch_pages(spec['target']['database_id'], spec['target']['key'], target_names)
+        print(f"✅ Загружено {len(target_pages)} записей\n")
+    except MigrationError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    changes, report = plan_migration(spec, source_pages, target_pages, journal.load())
+    print_plan(changes, report, show_all=dry_run)
+
+    if not changes:
+        print("✅ Нет изменений для применения")
+        return
+    if dry_run:
+        print("ℹ️  Запустите без --dry-run для применения изменений")
+        return
+
+    print(f"🔄 Применение {len(changes)} обновлений ({workers} потоков, "
+          f"{f'до {rate:g} req/sec' if rate else 'без лимита'}), журнал: {journal.path}")
+    apply_changes(changes, journal, workers)
+
+
+def add_arguments(parser):
+    parser.add_argument('--dry-run', action='store_true', help='Показать изменения, ничего не меняя')
+    parser.add_argument('--journal', help='Журнал применённых изменений (по умолчанию: <name>.journal.jsonl)')
+    parser.add_argument('--rate', type=float, default=NOTION_RATE, help='Лимит запросов к Notion в секунду (0 = без лимита)')
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS, help='Параллельных PATCH')
+    parser.add_argument('--metrics', help='Сохранить метрики запуска (JSON или .prom)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Миграция свойств между базами Notion')
+    parser.add_argument('spec', help='JSON-файл спецификации миграции')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    with open(args.spec, 'r', encoding='utf-8') as f:
+        spec = json.load(f)
+    try:
+        run_migration(spec, args.dry_run, args.journal, args.rate, args.workers)
+    finally:
+        metrics.write_report(args.metrics)
+
+
+if __name__ == "__main__":
+    main()
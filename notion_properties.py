@@ -0,0 +1,85 @@
+"""
+Сравнение свойств страниц Notion.
+
+Свойства в запросе ({"select": {"name": "B"}}) и в ответе API (то же плюс
+"id", "type", "plain_text", annotations...) приводятся к простым значениям
+(property_value): строка, число, bool, None или кортеж имён для
+multi_select. Так можно хранить зеркало текущих значений страницы
+(mirror_properties) и отправлять в PATCH только отличающиеся свойства
+(diff_properties). property_payload — обратное преобразование: простое
+значение → свойство для запроса.
+
+    mirror = mirror_properties(page["properties"])
+    changed = diff_properties(build_page_properties(candidate), mirror)
+"""
+
+# Типы свойств, которые умеем сравнивать (formula, rollup, people... — нет)
+TEXT_TYPES = ('title', 'rich_text')
+SCALAR_TYPES = ('number', 'checkbox', 'url', 'phone_number', 'email', 'date')
+NAMED_TYPES = ('select', 'status')
+MIRRORED_TYPES = TEXT_TYPES + SCALAR_TYPES + NAMED_TYPES + ('multi_select',)
+
+
+def property_type(prop):
+    """Тип свойства: из поля "type" (ответ API) или по единственному ключу (запрос)"""
+    if 'type' in prop:
+        return prop['type']
+    for key in prop:
+        if key in MIRRORED_TYPES:
+            return key
+    return None
+
+
+def property_value(prop):
+    """Простое значение свойства для сравнения"""
+    prop_type = property_type(prop)
+    value = prop.get(prop_type)
+    if prop_type in TEXT_TYPES:
+        return ''.join(
+            part.get('plain_text') or part.get('text', {}).get('content', '')
+            for part in value or []
+        )
+    if prop_type in NAMED_TYPES:
+        return value.get('name') if value else None
+    if prop_type == 'multi_select':
+        # Порядок опций не считаем изменением
+        return tuple(sorted(option.get('name', '') for option in value or []))
+    if prop_type == 'date':
+        return (value.get('start'), value.get('end')) if value else None
+    return value
+
+
+def mirror_properties(properties):
+    """{имя: значение} для свойств страницы, которые умеем сравнивать"""
+    return {
+        name: property_value(prop)
+        for name, prop in properties.items()
+        if property_type(prop) in MIRRORED_TYPES
+    }
+
+
+def diff_properties(new_properties, mirror):
+    """
+    Свойства из new_properties, значения которых отличаются от зеркала.
+    Свойства, которых нет в new_properties, не трогаются.
+    """
+    return {
+        name: prop
+        for name, prop in new_properties.items()
+        if name not in mirror or property_value(prop) != mirror[name]
+    }
+
+
+def property_payload(prop_type, value):
+    """Свойство для PATCH из простого значения (как у property_value)"""
+    if prop_type in TEXT_TYPES:
+        return {prop_type: [{"text": {"content": value}}] if value else []}
+    if prop_type in NAMED_TYPES:
+        return {prop_type: {"name": value} if value else None}
+    if prop_type == 'multi_select':
+        return {prop_type: [{"name": name} for name in value or ()]}
+    if prop_type == 'date':
+        return {prop_type: {"start": value[0], "end": value[1]} if value else None}
+    if prop_type == 'checkbox':
+        return {prop_type: bool(value)}
+    return {prop_type: value}
@@ -0,0 +1,561 @@
+#!/usr/bin/env python3
+"""
+Очередь задач с приоритетами для конвейера экспорт → анализ → импорт в Notion
+
+Каждый чат — отдельная задача, которая проходит стадии analyse и import
+независимо от остальных. Свежий чат попадает в Notion через несколько минут
+после экспорта, не дожидаясь обработки всего батча.
+
+ИСПОЛЬЗОВАНИЕ:
+  python3 pipeline_queue.py enqueue [--messages-dir DIR | --tiktok-export FILE] [--deadline-minutes N]
+  python3 pipeline_queue.py run [--parallel N] [--import-workers N] [--watch] [--metrics FILE]
+  python3 pipeline_queue.py status
+  python3 pipeline_queue.py export [--output FILE]
+
+КОМАНДЫ:
+  enqueue  Добавить в очередь новые и изменившиеся чаты (после index.js)
+  run      Обработать очередь: анализ (GPT) и импорт (Notion) параллельно
+  status   Показать состояние очереди
+  export   Выгрузить результаты анализа в candidate_analysis.json
+
+ПАРАМЕТРЫ:
+  --db FILE              База очереди (по умолчанию: pipeline.db)
+  --deadline-minutes N   Срок для новых задач; просроченные идут первыми (по умолчанию: 60)
+  --parallel N           Параллельных запросов к GPT (по умолчанию: 5)
+  --import-workers N     Параллельных импортов в Notion (по умолчанию: 3)
+  --watch                Не завершаться на пустой очереди, ждать новые задачи
+  --metrics FILE         Сохранить метрики запуска (JSON или .prom)
+
+ПОРЯДОК ОБРАБОТКИ:
+  просроченные → по приоритету (оценка триажа) → по сроку; у анализа и импорта свои воркеры
+"""
+
+import json
+import os
+import sys
+import time
+import sqlite3
+import asyncio
+import argparse
+import threading
+
+import metrics
+from chat_model import ChatMessages
+
+DB_FILE = 'pipeline.db'
+STAGE_ANALYSE = 'analyse'
+STAGE_IMPORT = 'import'
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF = 30  # секунд, умножается на номер попытки
+POLL_INTERVAL = 5   # секунд между проверками очереди в режиме --watch
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats (
+    file_name TEXT PRIMARY KEY,
+    chat_name TEXT NOT NULL,
+    messages_count INTEGER NOT NULL,
+    fingerprint TEXT,
+    messages TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    file_name TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    priority REAL NOT NULL DEFAULT 0,
+    deadline REAL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    not_before REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    UNIQUE (file_name, stage)
+);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (stage, status, not_before);
+CREATE TABLE IF NOT EXISTS results (
+    file_name TEXT PRIMARY KEY,
+    record TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def open_db(path, check_same_thread=True):
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=check_same_thread)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    migrate_db(conn)
+    return conn
+
+
+def migrate_db(conn):
+    """Добавляет в базу старой версии колонку chats.fingerprint и заполняет её"""
+    columns = {row['name'] for row in conn.execute("PRAGMA table_info(chats)")}
+    if 'fingerprint' in columns:
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Другой процесс мог успеть добавить колонку, пока ждали блокировку
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(chats)")}
+        if 'fingerprint' not in columns:
+            conn.execute("ALTER TABLE chats ADD COLUMN fingerprint TEXT")
+            rows = conn.execute("SELECT file_name, messages FROM chats").fetchall()
+            for row in rows:
+                fingerprint = ChatMessages.from_dicts(json.loads(row['messages'])).fingerprint()
+                conn.execute("UPDATE chats SET fingerprint = ? WHERE file_name = ?", (fingerprint, row['file_name']))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def upsert_job(conn, file_name, stage, priority, deadline):
+    """Ставит задачу в очередь (или перезапускает существующую)"""
+    now = time.time()
+    conn.execute(
+        """
+        INSERT INTO jobs (file_name, stage, priority, deadline, status, attempts, not_before, created_at, updated_at)
+        VALUES (?, ?, ?, ?, 'pending', 0, 0, ?, ?)
+        ON CONFLICT (file_name, stage) DO UPDATE SET
+            priority = excluded.priority,
+            deadline = MIN(COALESCE(jobs.deadline, excluded.deadline), excluded.deadline),
+            status = 'pending',
+            attempts = 0,
+            not_before = 0,
+            last_error = NULL,
+            updated_at = excluded.updated_at
+        """,
+        (file_name, stage, priority, deadline, now, now)
+    )
+
+
+def claim_job(conn, stage):
+    """Атомарно забирает следующую задачу стадии. Возвращает строку задачи или None"""
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            """
+            SELECT * FROM jobs
+            WHERE stage = ? AND status = 'pending' AND not_before <= ?
+            ORDER BY (deadline IS NOT NULL AND deadline <= ?) DESC, priority DESC, deadline ASC, id ASC
+            LIMIT 1
+            """,
+            (stage, now, now)
+        ).fetchone()
+        if row:
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (now, row['id'])
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return row
+
+
+def finish_job(conn, job_id):
+    conn.execute("UPDATE jobs SET status = 'done', last_error = NULL, updated_at = ? WHERE id = ?", (time.time(), job_id))
+
+
+def fail_job(conn, job, error):
+    """Возвращает задачу в очередь с задержкой или помечает как failed"""
+    now = time.time()
+    if job['attempts'] >= MAX_ATTEMPTS:
+        metrics.inc('jobs_failed_total', stage=job['stage'])
+        conn.execute(
+            "UPDATE jobs SET status = 'failed', last_error = ?, updated_at = ? WHERE id = ?",
+            (error, now, job['id'])
+        )
+        return False
+    metrics.inc('jobs_retried_total', stage=job['stage'])
+    conn.execute(
+        "UPDATE jobs SET status = 'pending', not_before = ?, last_error = ?, updated_at = ? WHERE id = ?",
+        (now + RETRY_BACKOFF * job['attempts'], error, now, job['id'])
+    )
+    return True
+
+
+def load_chat(conn, file_name):
+    row = conn.execute("SELECT * FROM chats WHERE file_name = ?", (file_name,)).fetchone()
+    if not row:
+        return None
+    return {
+        'fileName': row['file_name'],
+        'chatName': row['chat_name'],
+        'messages': ChatMessages.from_dicts(json.loads(row['messages']))
+    }
+
+
+def load_result(conn, file_name):
+    row = conn.execute("SELECT record FROM results WHERE file_name = ?", (file_name,)).fetchone()
+    return json.loads(row['record']) if row else None
+
+
+def save_result(conn, record):
+    conn.execute(
+        """
+        INSERT INTO results (file_name, record, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT (file_name) DO UPDATE SET record = excluded.record, updated_at = excluded.updated_at
+        """,
+        (record['fileName'], json.dumps(record, ensure_ascii=False), time.time())
+    )
+
+
+class ChatStore:
+    """
+    Чтение результатов и переписок из базы для импорта в Notion.
+    У каждого потока своё соединение (sqlite3 не делит их между потоками).
+
+        store = ChatStore('pipeline.db')
+        for record in store.iter_results():    # курсором, по одной записи
+            messages = store.messages(record)  # ChatMessages или None
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+
+    def conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            # Закрывается из основного потока в close()
+            conn = open_db(self.path, check_same_thread=False)
+            self.local.conn = conn
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+
+    def count_results(self):
+        return self.conn().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def iter_results(self, limit=None):
+        """Результаты анализа по одному, без загрузки всей таблицы"""
+        query = "SELECT record FROM results ORDER BY file_name"
+        params = ()
+        if limit:
+            query += " LIMIT ?"
+            params = (limit,)
+        # Отдельное соединение: курсор живёт всю итерацию, пока поток делает другие запросы
+        conn = open_db(self.path)
+        try:
+            for row in conn.execute(query, params):
+                yield json.loads(row['record'])
+        finally:
+            conn.close()
+
+    def messages(self, record):
+        """Переписка записи (по fileName) или None"""
+        row = self.conn().execute(
+            "SELECT messages FROM chats WHERE file_name = ?", (record.get('fileName'),)
+        ).fetchone()
+        return ChatMessages.from_dicts(json.loads(row['messages'])) if row else None
+
+    def close(self):
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections = []
+
+
+def reset_stale_running(conn):
+    """Задачи, оставшиеся в running после падения процесса, возвращаем в очередь"""
+    cursor = conn.execute("UPDATE jobs SET status = 'pending' WHERE status = 'running'")
+    return cursor.rowcount
+
+
+# =============================================================================
+# enqueue
+# =============================================================================
+
+def enqueue(args):
+    # Импорт внутри команды: analyze_candidates проверяет OPENAI_API_KEY при загрузке
+    from analyze_candidates import (
+        read_chat_files,
+        read_tiktok_export,
+        RECRUITER_ACCOUNT,
+        EXCLUDED_PHONE_NUMBERS,
+    )
+    from chat_signals import collect_chat_signals, triage_score
+    from chat_prepare import chat_fingerprint
+
+    if args.tiktok_export:
+        if not os.path.exists(args.tiktok_export):
+            print(f"❌ Файл {args.tiktok_export} не найден")
+            sys.exit(1)
+        print(f"📥 Загрузка переписок из TikTok экспорта {args.tiktok_export}...")
+        chats = read_tiktok_export(args.tiktok_export)
+    else:
+        if not os.path.exists(args.messages_dir):
+            print(f"❌ Папка {args.messages_dir} не найдена")
+            sys.exit(1)
+        print(f"📥 Загрузка переписок из {args.messages_dir}...")
+        chats = read_chat_files(args.messages_dir)
+
+    conn = open_db(args.db)
+    known = {
+        row['file_name']: row['fingerprint']
+        for row in conn.execute("SELECT file_name, fingerprint FROM chats")
+    }
+
+    deadline = time.time() + args.deadline_minutes * 60
+    enqueued = 0
+    unchanged = 0
+
+    conn.execute("BEGIN")
+    for chat in chats:
+        # Отпечаток, а не число сообщений: правка или удаление сообщения его тоже меняют
+        fingerprint = chat_fingerprint(chat)
+        if known.get(chat['fileName']) == fingerprint:
+            unchanged += 1
+            continue
+
+        signals = collect_chat_signals(chat['messages'], RECRUITER_ACCOUNT, EXCLUDED_PHONE_NUMBERS)
+        priority = triage_score(chat['messages'], signals, RECRUITER_ACCOUNT)
+
+        conn.execute(
+            """
+            INSERT INTO chats (file_name, chat_name, messages_count, fingerprint, messages, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (file_name) DO UPDATE SET
+                chat_name = excluded.chat_name,
+                messages_count = excluded.messages_count,
+                fingerprint = excluded.fingerprint,
+                messages = excluded.messages,
+                updated_at = excluded.updated_at
+            """,
+            (
+                chat['fileName'], chat['chatName'], len(chat['messages']), fingerprint,
+                json.dumps(chat['messages'].to_dicts(), ensure_ascii=False), time.time()
+            )
+        )
+        upsert_job(conn, chat['fileName'], STAGE_ANALYSE, priority, deadline)
+        enqueued += 1
+    conn.execute("COMMIT")
+
+    print(f"✅ В очередь добавлено {enqueued} чатов, без изменений {unchanged}")
+
+
+# =============================================================================
+# run
+# =============================================================================
+
+async def analyse_worker(conn, args, stats, stop_event):
+    from analyze_candidates import process_batch, clean_manager_phone
+
+    while not stop_event.is_set():
+        job = claim_job(conn, STAGE_ANALYSE)
+        if not job:
+            if not args.watch and not has_pending(conn):
+                return
+            await asyncio.sleep(POLL_INTERVAL)
+            continue
+
+        chat = load_chat(conn, job['file_name'])
+        if not chat:
+            fail_job(conn, job, "чат не найден в базе")
+            continue
+
+        if len(chat['messages']) < 2:
+            print(f"  ⚠️  {chat['chatName']} — мало сообщений")
+            finish_job(conn, job['id'])
+            continue
+
+        # Номер в этом запуске: счётчик растёт до первого await, у каждого воркера свой номер;
+        # всего — взятые в этом запуске плюс ещё ждущие
+        position = stats['started']
+        stats['started'] += 1
+        pending = conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE stage = ? AND status = 'pending'", (STAGE_ANALYSE,)
+        ).fetchone()[0]
+        results = await process_batch([(position, chat)], stats['started'] + pending)
+        if not results:
+            if not fail_job(conn, job, "ошибка анализа"):
+                stats['errors'] += 1
+            continue
+
+        record = clean_manager_phone(results[0])
+        save_result(conn, record)
+        # Импорт сразу же ставится в очередь с тем же приоритетом и сроком
+        upsert_job(conn, job['file_name'], STAGE_IMPORT, job['priority'], job['deadline'])
+        finish_job(conn, job['id'])
+        stats['analysed'] += 1
+
+
+async def import_worker(conn, args, stats, stop_event, existing_drivers, store):
+    from import_drivers_to_notion import DRIVERS_DB_ID, upsert_driver_async
+
+    while not stop_event.is_set():
+        job = claim_job(conn, STAGE_IMPORT)
+        if not job:
+            if not args.watch and not has_pending(conn):
+                return
+            await asyncio.sleep(POLL_INTERVAL)
+            continue
+
+        record = load_result(conn, job['file_name'])
+        if not record:
+            fail_job(conn, job, "нет результата анализа")
+            continue
+
+        chat_name = record.get('chatName', 'unknown')
+        try:
+            result, action, info = await upsert_driver_async(
+                DRIVERS_DB_ID, record, existing_drivers, chat_source=store.messages
+            )
+        except Exception as e:
+            result, action, info = None, f"ошибка: {e}", None
+
+        if action == "skipped":
+            if info:
+                print(f"  ⏭️  {chat_name} ({info})")
+            finish_job(conn, job['id'])
+            stats['skipped'] += 1
+        elif result and action in ("created", "updated"):
+            # Новую страницу и новое число сообщений upsert_driver_async уже записал в existing_drivers
+            print(f"  {'✅' if action == 'created' else '🔄'} {chat_name} → Notion ({'создан' if action == 'created' else 'обновлён'})")
+            finish_job(conn, job['id'])
+            stats['imported'] += 1
+        else:
+            if not fail_job(conn, job, info or action):
+                print(f"  ❌ {chat_name} — импорт не удался")
+                stats['errors'] += 1
+
+
+def has_pending(conn):
+    """Есть ли ещё задачи, которые могут появиться или выполниться"""
+    row = conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'running')").fetchone()
+    return row[0] > 0
+
+
+async def run_async(args):
+    from import_drivers_to_notion import DRIVERS_DB_ID, fetch_all_drivers
+
+    conn = open_db(args.db)
+    restored = reset_stale_running(conn)
+    if restored:
+        print(f"♻️  Возвращено в очередь незавершённых задач: {restored}")
+
+    print("🔍 Загружаем существующие записи из Notion...")
+    existing_drivers = fetch_all_drivers(DRIVERS_DB_ID)
+    print(f"📋 Найдено {len(existing_drivers)} существующих записей")
+
+    print(f"\n🚀 Обработка очереди: анализ ×{args.parallel}, импорт ×{args.import_workers}" + (" (--watch)" if args.watch else ""))
+
+    stats = {'started': 0, 'analysed': 0, 'imported': 0, 'skipped': 0, 'errors': 0}
+    stop_event = asyncio.Event()
+    started = time.monotonic()
+
+    workers = [analyse_worker(conn, args, stats, stop_event) for _ in range(args.parallel)]
+    # Переписки для Notion — из той же базы, а не из user_data_tiktok.json
+    store = ChatStore(args.db)
+    workers += [import_worker(conn, args, stats, stop_event, existing_drivers, store) for _ in range(args.import_workers)]
+    try:
+        await asyncio.gather(*workers)
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        stop_event.set()
+    finally:
+        store.close()
+
+    elapsed = time.monotonic() - started
+    print(f"\n📊 Итоги за {elapsed:.0f} сек:")
+    print(f"  🧠 Проанализировано: {stats['analysed']}")
+    print(f"  📤 Импортировано: {stats['imported']}")
+    print(f"  ⏭️  Без изменений в Notion: {stats['skipped']}")
+    print(f"  ❌ Ошибок: {stats['errors']}")
+
+
+# =============================================================================
+# status / export
+# =============================================================================
+
+def status(args):
+    conn = open_db(args.db)
+    rows = conn.execute("SELECT stage, status, COUNT(*) AS n FROM jobs GROUP BY stage, status ORDER BY stage, status").fetchall()
+    if not rows:
+        print("📭 Очередь пуста")
+        return
+    print("📊 Состояние очереди:")
+    for row in rows:
+        print(f"  {row['stage']:8} {row['status']:8} {row['n']}")
+
+    overdue = conn.execute(
+        "SELECT COUNT(*) FROM jobs WHERE status = 'pending' AND deadline IS NOT NULL AND deadline <= ?",
+        (time.time(),)
+    ).fetchone()[0]
+    if overdue:
+        print(f"  ⏰ Просрочено: {overdue}")
+
+    failed = conn.execute("SELECT file_name, stage, last_error FROM jobs WHERE status = 'failed' LIMIT 10").fetchall()
+    if failed:
+        print("\n❌ Неудачные задачи:")
+        for row in failed:
+            print(f"  {row['file_name']} ({row['stage']}): {row['last_error']}")
+
+
+def export(args):
+    conn = open_db(args.db)
+    results = {}
+    if os.path.exists(args.output):
+        with open(args.output, 'r', encoding='utf-8') as f:
+            for item in json.load(f):
+                results[item['fileName']] = item
+
+    exported = 0
+    for row in conn.execute("SELECT record FROM results"):
+        record = json.loads(row['record'])
+        results[record['fileName']] = record
+        exported += 1
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(list(results.values()), f, ensure_ascii=False, indent=2)
+    print(f"💾 Выгружено {exported} результатов, всего в {args.output}: {len(results)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Очередь задач конвейера анализа и импорта')
+    parser.add_argument('--db', default=DB_FILE, help='База очереди')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    enqueue_parser = subparsers.add_parser('enqueue', help='Добавить новые и изменившиеся чаты')
+    enqueue_parser.add_argument('--messages-dir', default='TickTokDMParser/exported_messages', help='Папка с переписками')
+    enqueue_parser.add_argument('--tiktok-export', help='Файл экспорта данных TikTok (user_data_tiktok.json)')
+    enqueue_parser.add_argument('--deadline-minutes', type=float, default=60, help='Срок обработки новых задач')
+
+    run_parser = subparsers.add_parser('run', help='Обработать очередь')
+    run_parser.add_argument('--parallel', type=int, default=5, help='Параллельных запросов к GPT')
+    run_parser.add_argument('--import-workers', type=int, default=3, help='Параллельных импортов в Notion')
+    run_parser.add_argument('--watch', action='store_true', help='Ждать новые задачи на пустой очереди')
+    run_parser.add_argument('--metrics', help='Сохранить метрики запуска (JSON или .prom)')
+
+    subparsers.add_parser('status', help='Состояние очереди')
+
+    export_parser = subparsers.add_parser('export', help='Выгрузить результаты анализа')
+    export_parser.add_argument('--output', default='candidate_analysis.json', help='Выходной файл')
+
+    args = parser.parse_args()
+    if args.command == 'enqueue':
+        enqueue(args)
+    elif args.command == 'run':
+        from llm_validation import LLMRunAborted
+        try:
+            asyncio.run(run_async(args))
+        except LLMRunAborted as e:
+            # Задачи остаются в очереди и будут взяты при следующем запуске
+            print(f"\n🛑 Запуск остановлен: {e}")
+            sys.exit(1)
+        finally:
+            metrics.write_report(args.metrics)
+    elif args.command == 'status':
+        status(args)
+    elif args.command == 'export':
+        export(args)
+
+
+if __name__ == "__main__":
+    main()
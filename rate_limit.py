@@ -0,0 +1,99 @@
+"""
+Общий ограничитель частоты запросов (token bucket) для потоков и asyncio.
+
+Notion допускает в среднем 3 запроса в секунду на интеграцию. Один
+RateLimiter на процесс делят все потоки и корутины: каждый запрос берёт
+токен, а если токенов нет — резервирует следующий и ждёт ровно до его
+появления. Ожидающие обслуживаются по порядку, без опроса в цикле.
+Ответ 429 (penalize) ставит паузу на Retry-After для всех, включая уже
+занявших очередь, и снижает частоту на RATE_BACKOFF (не ниже MIN_RATE_SHARE
+от заданной): если --rate выше, чем реально пропускает сервер, лимит сам
+опускается до рабочего.
+
+    limiter = RateLimiter(3)
+    limiter.acquire()              # в потоке
+    await limiter.acquire_async()  # в корутине
+"""
+
+import time
+import asyncio
+import threading
+
+# Notion: 3 запроса в секунду в среднем
+NOTION_RATE = 3.0
+# Во сколько раз снижать частоту после 429 и до какой доли от заданной
+RATE_BACKOFF = 0.8
+MIN_RATE_SHARE = 0.25
+
+
+def retry_after_seconds(error, attempt, default_backoff=1.0):
+    """Пауза после 429: заголовок Retry-After или default_backoff × номер попытки"""
+    headers = getattr(error, 'headers', None)
+    value = headers.get('Retry-After') if headers is not None else None
+    try:
+        if value is not None:
+            return float(value)
+    except ValueError:
+        pass
+    return default_backoff * attempt
+
+
+class RateLimiter:
+    """Token bucket: rate запросов в секунду, до burst подряд. rate=0 — без ограничения"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate or 0)
+        self.min_rate = self.rate * MIN_RATE_SHARE
+        self.burst = float(burst) if burst else max(1.0, self.rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _reserve(self):
+        """Забирает токен (возможно, в долг). Возвращает, сколько ждать до него"""
+        if not self.rate:
+            return 0
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens -= 1
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    def _paused_for(self):
+        return self.paused_until - time.monotonic()
+
+    def acquire(self):
+        while True:
+            delay = self._reserve()
+            if delay:
+                time.sleep(delay)
+            # Пока ждали, пришёл 429 — ждём конца паузы и встаём в очередь заново
+            paused = self._paused_for()
+            if paused <= 0:
+                return
+            time.sleep(paused)
+
+    async def acquire_async(self):
+        while True:
+            delay = self._reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            paused = self._paused_for()
+            if paused <= 0:
+                return
+            await asyncio.sleep(paused)
+
+    def penalize(self, seconds):
+        """Сервер ответил 429: ближайшие seconds секунд токенов нет ни у кого"""
+        with self.lock:
+            now = time.monotonic()
+            # Не суммируем: 429 от уже отправленных запросов — та же пауза
+            if self.rate and now >= self.paused_until:
+                self._refill(now)
+                self.rate = max(self.min_rate, self.rate * RATE_BACKOFF)
+                self.tokens = min(self.tokens, 0)
+            self.paused_until = max(self.paused_until, now + seconds)
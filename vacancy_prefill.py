@@ -0,0 +1,388 @@
+"""
+Детерминированное предизвлечение полей вакансии по шаблону из filter-fields-basic.md.
+
+Заполняет поля RESPONSE_SCHEMA из create_patches.py регулярными выражениями
+("Водительские права:", "Прицеп:", "Средняя дневная зарплата:" и т.д.).
+Поле попадает в результат, только если значение определено однозначно —
+всё остальное остаётся для GPT.
+"""
+
+import re
+
+from field_definitions import (
+    LICENSE_CATEGORIES,
+    VEHICLE_TYPES,
+    PAYMENT_TYPE,
+    WORK_REGIONS,
+    get_lookup,
+)
+
+# Все поля вакансии в порядке схемы
+VACANCY_FIELD_ORDER = [
+    "Категория прав", "Тип техники", "Регионы работы",
+    "Минимальный опыт (месяцы)", "Код 95", "ADR",
+    "Тип оплаты", "Минимальная зарплата (нетто)",
+    "Максимальная зарплата (нетто)", "Валюта зарплаты",
+    "Тип договора", "Карта водителя",
+    "Тип экипажа", "Требование польского языка", "Город базы",
+    "Допустимое гражданство", "Исключённое гражданство",
+]
+
+# Метки блоков шаблона (начало строки, затем ":" или тире)
+LABEL_LICENSE = r'Водительские права'
+LABEL_VEHICLE = r'Прицеп'
+LABEL_EXPERIENCE = r'(?:Минимальный\s+)?опыт работы'
+LABEL_CODE_95 = r'Свидетельство квалификации(?:\s*\(код 95\))?|Код 95'
+LABEL_ADR = r'ADR(?:\s*\([^)]*\))?'
+LABEL_DRIVER_CARD = r'Карта водителя(?:\s*\([^)]*\))?'
+LABEL_CONTRACT = r'Тип договора'
+LABEL_PAYMENT = r'Система оплаты'
+LABEL_SALARY = (
+    r'Средняя дневная зарплата(?:\s*\(нетто\))?'
+    r'|Средняя месячная зарплата(?:\s*\(нетто\))?'
+    r'|Поденная ставка|Оплата'
+)
+LABEL_REGIONS = r'Регионы работы|Постоянные маршруты/регионы'
+LABEL_BASE = r'Место работы \(база\)|База|Lokalizacja|Miejsce pracy'
+
+# Ключевые слова: если их нет во всём тексте, поле считается "не указано"
+KEYWORDS_CODE_95 = re.compile(r'код\s*95|kod\s*95', re.IGNORECASE)
+KEYWORDS_ADR = re.compile(r'\bADR\b|опасн\w*\s+груз', re.IGNORECASE)
+KEYWORDS_DRIVER_CARD = re.compile(r'карт\w*\s+водител|тахограф', re.IGNORECASE)
+KEYWORDS_EXPERIENCE = re.compile(r'опыт|doświadczen', re.IGNORECASE)
+KEYWORDS_CREW = re.compile(
+    r'экипаж|двойк|соло|\bsolo\b|один водитель|два водителя|муж и жена|одиночн|семейн',
+    re.IGNORECASE
+)
+KEYWORDS_POLISH = re.compile(
+    r'польск\w*\s+язык|язык\w*[^\n]*польск|знани\w*\s+польск|по-польски'
+    r'|polsk\w*\s+język|język\w*\s+polsk',
+    re.IGNORECASE
+)
+KEYWORDS_CITIZENSHIP = re.compile(
+    r'граждан|паспорт|русскояз|русскогово|СНГ|obywatel',
+    re.IGNORECASE
+)
+KEYWORDS_SALARY = re.compile(r'зарплат|оплат|ставк|\bzł\b|злот|€|\bEUR\b|\bPLN\b|евро', re.IGNORECASE)
+
+DAY_MARKERS = re.compile(r'поденн|дневн|за день|в день|/\s*день|dniówk|/\s*dzie', re.IGNORECASE)
+MONTH_MARKERS = re.compile(r'месяц|месячн|ежемесячн|miesi', re.IGNORECASE)
+PLN_MARKERS = re.compile(r'\bzł|злот|\bPLN\b|\bзл\b', re.IGNORECASE)
+EUR_MARKERS = re.compile(r'€|\bEUR\b|евро|\beuro\b', re.IGNORECASE)
+
+# Сумма: "450", "12 000", "95,5"
+AMOUNT_PATTERN = re.compile(r'\d{1,3}(?:[  ]\d{3})+(?:[.,]\d+)?|\d+(?:[.,]\d+)?')
+RANGE_PATTERN = re.compile(
+    r'(\d{1,3}(?:[  ]\d{3})+|\d+)\s*[-–—]\s*(\d{1,3}(?:[  ]\d{3})+|\d+)'
+)
+
+POSTAL_CODE_PATTERN = re.compile(r'^\d{2}-\d{3}\s*')
+LATIN_CITY_PATTERN = re.compile(r'^[A-Za-zÀ-ſ][A-Za-zÀ-ſ .\-]*$')
+
+# Частые города базы: кириллица → польское написание
+CITY_TRANSLATIONS = {
+    "варшава": "Warszawa",
+    "краков": "Kraków",
+    "лодзь": "Łódź",
+    "познань": "Poznań",
+    "вроцлав": "Wrocław",
+    "гданьск": "Gdańsk",
+    "щецин": "Szczecin",
+    "катовице": "Katowice",
+    "люблин": "Lublin",
+    "быдгощ": "Bydgoszcz",
+    "белосток": "Białystok",
+    "ченстохова": "Częstochowa",
+    "жешув": "Rzeszów",
+    "торунь": "Toruń",
+    "кельце": "Kielce",
+    "ополе": "Opole",
+    "гдыня": "Gdynia",
+}
+
+NOT_REQUIRED_PREFIXES = ("не требу", "нет", "не обязател", "не нужн")
+STANDARD_TRAILER_MARKERS = ("стандартн", "нет", "не указано", "обычн")
+
+_LICENSE_LOOKUP = get_lookup(LICENSE_CATEGORIES)
+_VEHICLE_LOOKUP = get_lookup(VEHICLE_TYPES)
+_PAYMENT_LOOKUP = get_lookup(PAYMENT_TYPE)
+_REGION_LOOKUP = get_lookup(WORK_REGIONS)
+
+_LABEL_CACHE = {}
+
+
+def _label_regex(label):
+    regex = _LABEL_CACHE.get(label)
+    if regex is None:
+        regex = re.compile(rf'^[ \t•\-*]*(?:{label})[ \t]*[:–—-][ \t]*(.*)$', re.IGNORECASE | re.MULTILINE)
+        _LABEL_CACHE[label] = regex
+    return regex
+
+
+def find_block(text, label):
+    """
+    Возвращает значение блока "Метка: значение" или None, если метки нет.
+    Если значение перенесено на следующую строку — берёт её.
+    """
+    match = _label_regex(label).search(text)
+    if not match:
+        return None
+    value = match.group(1).strip()
+    if value:
+        return value
+    for line in text[match.end():].split('\n'):
+        if line.strip():
+            return line.strip()
+    return ''
+
+
+def _key(value):
+    return ' '.join(value.split()).casefold()
+
+
+def _split_items(value):
+    parts = re.split(r'[,;]|\s+и\s+', value)
+    return [p.strip(' .') for p in parts if p.strip(' .')]
+
+
+def parse_requirement(value):
+    """'Обязательно' / 'Желательно' / None (не требуется). Возвращает (resolved, value)."""
+    lowered = value.casefold()
+    if 'желател' in lowered:
+        return True, "Желательно"
+    if lowered.startswith(NOT_REQUIRED_PREFIXES):
+        return True, None
+    if 'обязател' in lowered:
+        return True, "Обязательно"
+    return False, None
+
+
+def parse_license_categories(value):
+    cleaned = re.sub(r'категори\w*', '', value, flags=re.IGNORECASE)
+    categories = []
+    for item in _split_items(cleaned):
+        if item.upper() == 'BDF':
+            # BDF — тип техники, не категория прав
+            continue
+        category = _LICENSE_LOOKUP.get(_key(item))
+        if category is None:
+            return False, None
+        if category not in categories:
+            categories.append(category)
+    if not categories:
+        return False, None
+    return True, categories
+
+
+def parse_vehicle_types(value):
+    lowered = value.casefold()
+    if lowered.startswith(STANDARD_TRAILER_MARKERS):
+        return True, []
+    types = []
+    for item in re.split(r'[,;/]', value):
+        item = item.strip(' .')
+        if not item:
+            continue
+        vehicle_type = _VEHICLE_LOOKUP.get(_key(item))
+        if vehicle_type is None:
+            return False, None
+        if vehicle_type not in types:
+            types.append(vehicle_type)
+    if not types:
+        return False, None
+    return True, types
+
+
+def parse_experience_months(value):
+    lowered = value.casefold()
+    if 'полгода' in lowered:
+        return True, 6
+    if 'полтора' in lowered:
+        return True, 18
+    match = re.search(r'(\d+)\s*(?:месяц|мес)', lowered)
+    if match:
+        return True, int(match.group(1))
+    match = re.search(r'(\d+)\s*(?:год|года|лет)\b', lowered)
+    if match:
+        return True, int(match.group(1)) * 12
+    if re.search(r'\bгод\b', lowered):
+        return True, 12
+    return False, None
+
+
+def parse_contract_type(text):
+    """Ищет тип договора по ключевым словам; несколько разных → неоднозначно."""
+    lowered = text.casefold()
+    found = set()
+    if 'umowa o prac' in lowered or 'трудов' in lowered or re.search(r'\buop\b', lowered):
+        found.add("UMOWA O PRACĘ")
+    if 'zlecen' in lowered:
+        found.add("UMOWA ZLECENIE")
+    if re.search(r'\bb2b\b', lowered):
+        found.add("B2B")
+    if len(found) > 1:
+        return False, None
+    return True, found.pop() if found else None
+
+
+def _parse_amount(raw):
+    number = float(re.sub(r'[  ]', '', raw).replace(',', '.'))
+    return int(number) if number.is_integer() else number
+
+
+def parse_salary(label_line, value, payment_value):
+    """
+    Разбирает строку зарплаты. Возвращает (resolved, {тип, мин, макс, валюта}).
+    Все четыре поля определяются вместе или не определяются вовсе.
+    """
+    if PLN_MARKERS.search(value) and not EUR_MARKERS.search(value):
+        currency = "PLN"
+    elif EUR_MARKERS.search(value) and not PLN_MARKERS.search(value):
+        currency = "EUR"
+    else:
+        return False, None
+
+    range_match = RANGE_PATTERN.search(value)
+    amounts = AMOUNT_PATTERN.findall(value)
+    if range_match and len(amounts) == 2:
+        min_salary = _parse_amount(range_match.group(1))
+        max_salary = _parse_amount(range_match.group(2))
+    elif len(amounts) == 1:
+        min_salary = _parse_amount(amounts[0])
+        max_salary = None
+    else:
+        return False, None
+
+    payment_type = None
+    if payment_value:
+        payment_type = _PAYMENT_LOOKUP.get(_key(payment_value))
+    context = f"{label_line} {value} {payment_value or ''}"
+    if payment_type is None:
+        is_day = bool(DAY_MARKERS.search(context))
+        is_month = bool(MONTH_MARKERS.search(context))
+        if is_day == is_month:
+            return False, None
+        payment_type = "Поденная" if is_day else "Месячная"
+
+    return True, {
+        "Тип оплаты": payment_type,
+        "Минимальная зарплата (нетто)": min_salary,
+        "Максимальная зарплата (нетто)": max_salary,
+        "Валюта зарплаты": currency,
+    }
+
+
+def parse_regions(value):
+    regions = []
+    for item in _split_items(value):
+        region = _REGION_LOOKUP.get(_key(item))
+        if region is None:
+            return False, None
+        if region not in regions:
+            regions.append(region)
+    if not regions:
+        return False, None
+    return True, regions
+
+
+def parse_base_city(value):
+    city = POSTAL_CODE_PATTERN.sub('', value).strip(' .')
+    city = re.split(r'[,(]', city)[0].strip()
+    if not city:
+        return False, None
+    translated = CITY_TRANSLATIONS.get(city.casefold())
+    if translated:
+        return True, translated
+    if LATIN_CITY_PATTERN.match(city):
+        return True, city
+    return False, None
+
+
+def _resolve_requirement(resolved, text, field, label, keywords):
+    value = find_block(text, label)
+    if value:
+        ok, level = parse_requirement(value)
+        if ok:
+            resolved[field] = level
+    elif value is None and not keywords.search(text):
+        resolved[field] = None
+
+
+def prefill_vacancy(text):
+    """
+    Извлекает поля вакансии по правилам.
+    Возвращает словарь {поле: значение} только для однозначно определённых полей.
+    """
+    resolved = {}
+
+    value = find_block(text, LABEL_LICENSE)
+    if value:
+        ok, categories = parse_license_categories(value)
+        if ok:
+            resolved["Категория прав"] = categories
+
+    value = find_block(text, LABEL_VEHICLE)
+    if value:
+        ok, types = parse_vehicle_types(value)
+        if ok:
+            resolved["Тип техники"] = types
+
+    value = find_block(text, LABEL_REGIONS)
+    if value:
+        ok, regions = parse_regions(value)
+        if ok:
+            resolved["Регионы работы"] = regions
+
+    value = find_block(text, LABEL_EXPERIENCE)
+    if value:
+        ok, months = parse_experience_months(value)
+        if ok:
+            resolved["Минимальный опыт (месяцы)"] = months
+    elif value is None and not KEYWORDS_EXPERIENCE.search(text):
+        resolved["Минимальный опыт (месяцы)"] = None
+
+    _resolve_requirement(resolved, text, "Код 95", LABEL_CODE_95, KEYWORDS_CODE_95)
+    _resolve_requirement(resolved, text, "ADR", LABEL_ADR, KEYWORDS_ADR)
+    _resolve_requirement(resolved, text, "Карта водителя", LABEL_DRIVER_CARD, KEYWORDS_DRIVER_CARD)
+
+    salary_match = _label_regex(LABEL_SALARY).search(text)
+    if salary_match:
+        salary_value = find_block(text, LABEL_SALARY)
+        ok, salary = parse_salary(salary_match.group(0), salary_value, find_block(text, LABEL_PAYMENT))
+        if ok:
+            resolved.update(salary)
+    elif not KEYWORDS_SALARY.search(text):
+        resolved.update({
+            "Тип оплаты": None,
+            "Минимальная зарплата (нетто)": None,
+            "Максимальная зарплата (нетто)": None,
+            "Валюта зарплаты": None,
+        })
+
+    value = find_block(text, LABEL_CONTRACT)
+    ok, contract = parse_contract_type(value or text)
+    if ok:
+        resolved["Тип договора"] = contract
+
+    if not KEYWORDS_CREW.search(text):
+        resolved["Тип экипажа"] = None
+
+    if not KEYWORDS_POLISH.search(text):
+        resolved["Требование польского языка"] = None
+
+    value = find_block(text, LABEL_BASE)
+    if value:
+        ok, city = parse_base_city(value)
+        if ok:
+            resolved["Город базы"] = city
+
+    if not KEYWORDS_CITIZENSHIP.search(text):
+        resolved["Допустимое гражданство"] = []
+        resolved["Исключённое гражданство"] = []
+
+    return resolved
+
+
+def missing_fields(resolved):
+    """Поля, которые не удалось определить правилами (в порядке схемы)."""
+    return [field for field in VACANCY_FIELD_ORDER if field not in resolved]